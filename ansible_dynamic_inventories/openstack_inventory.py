@@ -22,9 +22,10 @@
 # /etc/ansible/openstack_inventory.conf
 #
 
-import json
+import argparse
 import os
 import sys
+import time
 
 sys.path.insert(1,'..')
 
@@ -33,63 +34,328 @@ from ansible_dynamic_inventories.utils import *
 from ansible_dynamic_inventories.utils.parse import *
 from ansible_dynamic_inventories.utils.ansible_utils import *
 from ansible_dynamic_inventories.utils.openstack_utils import *
+from ansible_dynamic_inventories.utils.output import *
+from ansible_dynamic_inventories.utils.snapshot import *
+from ansible_dynamic_inventories.utils.inventory_diff import NO_HOSTS_PATTERN, diff_inventories, limit_pattern, restrict_inventory
+from ansible_dynamic_inventories.utils.metadata_codec import MetadataDecodingError, get_metadata_variables
+from ansible_dynamic_inventories.utils.profiler import PROFILER, add_profile_arguments, enable_profiler
 
+# Exit status of --changed-hosts when no host changed
+NO_CHANGED_HOSTS_STATUS = 3
 
-def get_inventory(configs):
-    """Generate an inventory from OpenStack platform.
+
+def get_servers(configs):
+    """Get the list of servers of the OpenStack platform.
     :param configs: (dict) Configuration
-    :return: (dict) inventory
+    :return: list of (dict) servers, see openstack_utils.server_info, or
+             None if no client is available
+    """
+    with PROFILER.phase("list servers"):
+        osclient = OpenStackClient(configs)
+        osclient.initiate_client()
+        nova = osclient.nova
+        if not nova:
+            return None
+        return osclient.list_servers()
+
+
+def iter_hosts(configs, server_list):
+    """Generate the inventory hosts from a list of servers.
+    Servers that do not carry the groups metadata of the namespace are
+    ignored. Servers whose packed variables cannot be decoded are skipped
+    with a warning, so that Ansible does not run on them with missing
+    variables.
+    :param configs: (dict) Configuration
+    :param server_list: list of (dict) servers, see openstack_utils.server_info
+    :return: generator of (hostname, group names, variables) tuples
     """
-    inventory = get_template(configs)
-    osclient = OpenStackClient(configs)
-    osclient.initiate_client()
-    nova = osclient.nova
-    if not nova:
-        return {}
-    server_list = nova.servers.list()
     default_section = configs.get("Default", {})
     namespace = default_section.get("metadata_namespace",
                                     DEFAULT_METADATA_NAMESPACE)
     key_folder = default_section.get("key_folder", DEFAULT_KEY_FOLDER)
     key_folder = os.path.abspath(os.path.expanduser(key_folder))
+    group_key = namespace + 'groups'
 
     for s in server_list:
-        inventory_hostname = s.name
-        metadata = s.metadata
-        group_key = namespace + 'groups'
-        address = s.networks[s.networks.keys()[0]][0]
-        if group_key in s.metadata:
-            for group in s.metadata[group_key].split(','):
-                if group not in inventory:
-                    inventory[group] = {"hosts": [inventory_hostname]}
-                elif "hosts" not in inventory[group]:
-                    inventory[group]["hosts"] = [inventory_hostname]
-                else:
-                    inventory[group]["hosts"].append(inventory_hostname)
+        inventory_hostname = s["name"]
+        metadata = s["metadata"]
+        networks = s["networks"]
+        address = networks[list(networks)[0]][0] if networks else None
+        if group_key in metadata:
+            try:
+                # Variables are stored one per metadata item, or packed
+                host_vars = get_metadata_variables(metadata, namespace)
+            except MetadataDecodingError as e:
+                sys.stderr.write("Warning: skipping host %s: %s\n" %
+                                 (inventory_hostname, e))
+                continue
             variables = {}
             # Take the first address as ansible_host by default.
             # If host has more than one addresses (e.g. multiple NICs,
             # Floating IP), then user should specify host address by
             # '<metadata_namespace>:ansible_host' key in metadata
             variables['ansible_host'] = address
-            variables['ansible_hostname'] = s.name
-            for key, value in metadata.items():
-                if key == (namespace + "ansible_private_key_file"):
-                    variables["ansible_private_key_file"] = os.path.join(key_folder, value)
-                elif (key.startswith(namespace) and (key != group_key)):
-                    keyname = key[len(namespace):]
-                    variables[keyname] = value
+            variables['ansible_hostname'] = inventory_hostname
+            variables.update(host_vars)
+            if "ansible_private_key_file" in variables:
+                variables["ansible_private_key_file"] = os.path.join(
+                    key_folder, variables["ansible_private_key_file"])
             # If 'ansible_private_key_file' is not explicitly declared, use VM's key_name
-            if "ansible_private_key_file" not in variables:
-                variables["ansible_private_key_file"] = os.path.join(key_folder, s.key_name)
-            inventory["_meta"]["hostvars"][inventory_hostname] = variables
+            if "ansible_private_key_file" not in variables and s["key_name"]:
+                variables["ansible_private_key_file"] = os.path.join(key_folder, s["key_name"])
+            yield (inventory_hostname, metadata[group_key].split(','),
+                   variables)
+
+
+def add_host(inventory, hostname, groups, variables):
+    """Add a host to an inventory.
+    :param inventory: (dict) inventory
+    :param hostname: (string) name of the host
+    :param groups: list of (string) group names of the host
+    :param variables: (dict) host variables
+    """
+    for group in groups:
+        if group not in inventory:
+            inventory[group] = {"hosts": [hostname]}
+        elif "hosts" not in inventory[group]:
+            inventory[group]["hosts"] = [hostname]
+        else:
+            inventory[group]["hosts"].append(hostname)
+    inventory["_meta"]["hostvars"][hostname] = variables
+
+
+def get_inventory(configs):
+    """Generate an inventory from OpenStack platform.
+    :param configs: (dict) Configuration
+    :return: (dict) inventory
+    """
+    server_list = get_servers(configs)
+    if server_list is None:
+        return {}
+    return build_inventory(configs, server_list)
+
+
+def build_inventory(configs, server_list):
+    """Generate an inventory from a list of servers.
+    :param configs: (dict) Configuration
+    :param server_list: list of (dict) servers, see openstack_utils.server_info
+    :return: (dict) inventory
+    """
+    with PROFILER.phase("template"):
+        compiled = get_compiled_template(configs)
+        inventory = get_template(configs, compiled)
+    with PROFILER.phase("hostvars"):
+        for hostname, groups, variables in iter_hosts(configs, server_list):
+            add_host(inventory, hostname, groups, variables)
+
+    default_section = configs.get("Default", {})
+    if to_bool(default_section.get("factor_hostvars")):
+        with PROFILER.phase("factor hostvars"):
+            stats = factor_hostvars(inventory,
+                                    compiled["ancestors"] if compiled else None)
+        sys.stderr.write("Factored %d variables into group vars, "
+                         "saved %d bytes of compact JSON\n" %
+                         (stats["hoisted_vars"], stats["saved_bytes"]))
     return inventory
 
 
-def main():
-    configs = get_config()
+def get_cache_file(configs, refresh=False):
+    """Get the inventory cache file if it can be used.
+    :param configs: (dict) Configuration
+    :param refresh: (bool) True to ignore the content of the cache
+    :return: (tuple) (path, fresh): path of the cache file, None if no cache
+             is configured; fresh is True if the cache can be read
+    """
+    cache_section = configs.get("Cache", {})
+    cache_file = cache_section.get("inventory_cache")
+    if not cache_file:
+        return None, False
+    cache_file = os.path.abspath(os.path.expanduser(cache_file))
+    max_age = int(cache_section.get("inventory_cache_max_age",
+                                    DEFAULT_CACHE_MAX_AGE))
+    fresh = (not refresh and os.path.isfile(cache_file) and
+             time.time() - os.path.getmtime(cache_file) < max_age)
+    return cache_file, fresh
+
+
+def get_cached_inventory(configs, refresh=False):
+    """Get the inventory from the cache if it is fresh enough, otherwise
+    generate it from OpenStack platform and update the cache.
+    :param configs: (dict) Configuration
+    :param refresh: (bool) True to ignore the content of the cache
+    :return: (dict) inventory
+    """
+    cache_file, fresh = get_cache_file(configs, refresh)
+    if fresh:
+        try:
+            with PROFILER.phase("load cache"):
+                return load_inventory(cache_file)
+        except (SnapshotError, IOError) as e:
+            sys.stderr.write("Warning: ignoring inventory cache: %s\n" % e)
     inventory = get_inventory(configs)
-    print json.dumps(inventory, indent=2)
+    if cache_file and inventory:
+        with PROFILER.phase("save cache"):
+            save_inventory(inventory, cache_file,
+                           compress=to_bool(configs["Cache"].get("compress")))
+    return inventory
+
+
+def get_baseline_file(configs, baseline=None):
+    """Get the file of the baseline inventory, the inventory the changes are
+    computed from.
+    :param configs: (dict) Configuration
+    :param baseline: (string) file given on the command line
+    :return: (string) path
+    """
+    baseline = (baseline or
+                configs.get("Cache", {}).get("baseline_inventory",
+                                             DEFAULT_BASELINE_FILE))
+    return os.path.abspath(os.path.expanduser(baseline))
+
+
+def load_baseline(baseline_file):
+    """Load the baseline inventory.
+    :param baseline_file: (string) path
+    :return: (dict) inventory, empty if there is no baseline yet
+    """
+    if not os.path.isfile(baseline_file):
+        return {}
+    try:
+        with PROFILER.phase("load baseline"):
+            return load_inventory(baseline_file)
+    except (SnapshotError, IOError) as e:
+        sys.stderr.write("Warning: ignoring baseline inventory: %s\n" % e)
+        return {}
+
+
+def save_baseline(configs, inventory, baseline_file):
+    "Make an inventory the baseline of the next changes"
+    directory = os.path.dirname(baseline_file)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with PROFILER.phase("save baseline"):
+        save_inventory(inventory, baseline_file,
+                       compress=to_bool(configs.get("Cache", {}).get("compress")))
+
+
+def write_changes(configs, inventory, args, output_format):
+    """Write the changes of an inventory since the baseline, as requested on
+    the command line, and update the baseline if requested.
+    :param configs: (dict) Configuration
+    :param inventory: (dict) current inventory
+    :param args: command line arguments
+    :param output_format: (string) see utils.output
+    :return: (int) exit status: NO_CHANGED_HOSTS_STATUS if --changed-hosts
+             found no host, otherwise 0
+    """
+    status = 0
+    baseline_file = get_baseline_file(configs, args.baseline)
+    if args.diff or args.changed_hosts or args.changed_inventory:
+        with PROFILER.phase("diff"):
+            changes = diff_inventories(load_baseline(baseline_file), inventory)
+        with PROFILER.phase("render"):
+            if args.changed_hosts:
+                sys.stdout.write(limit_pattern(changes["changed_hosts"]) + "\n")
+                if not changes["changed_hosts"]:
+                    status = NO_CHANGED_HOSTS_STATUS
+            elif args.changed_inventory:
+                write_inventory(restrict_inventory(inventory,
+                                                   changes["changed_hosts"]),
+                                sys.stdout, output_format)
+            else:
+                write_inventory(changes, sys.stdout, output_format)
+    if args.save_baseline:
+        save_baseline(configs, inventory, baseline_file)
+    return status
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='OpenStack dynamic inventory')
+    parser.add_argument('-c', '--config', metavar='config',
+                        default=None,
+                        help="Configuration file")
+    parser.add_argument('--list', action='store_true',
+                        help="Output the whole inventory (default)")
+    parser.add_argument('--host', metavar='host', default=None,
+                        help="Output the variables of a host")
+    parser.add_argument('-f', '--format', metavar='format',
+                        choices=OUTPUT_FORMATS, default=None,
+                        help="Output format: %s. Default is the "
+                             "'output_format' configuration, or '%s'" %
+                             (', '.join(OUTPUT_FORMATS), DEFAULT_OUTPUT_FORMAT))
+    parser.add_argument('-r', '--refresh-cache', action='store_true',
+                        help="Ignore the content of the inventory cache")
+    changes = parser.add_mutually_exclusive_group()
+    changes.add_argument('--diff', action='store_true',
+                         help="Output the changes since the baseline "
+                              "inventory: hosts added or removed, group "
+                              "membership and variable changes")
+    changes.add_argument('--changed-hosts', action='store_true',
+                         help="Output the hosts added or changed since the "
+                              "baseline inventory, comma-separated for "
+                              "ansible --limit. If no host changed, output "
+                              "'%s' and exit with status %d" %
+                              (NO_HOSTS_PATTERN, NO_CHANGED_HOSTS_STATUS))
+    changes.add_argument('--changed-inventory', action='store_true',
+                         help="Output the inventory restricted to the hosts "
+                              "added or changed since the baseline inventory")
+    parser.add_argument('-b', '--baseline', metavar='baseline', default=None,
+                        help="Baseline inventory file. Default is the "
+                             "'baseline_inventory' configuration, or %s" %
+                             DEFAULT_BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Make the current inventory the baseline, after "
+                             "the output of the changes if any")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    enable_profiler(args)
+    with PROFILER.phase("config"):
+        configs = get_config(args.config)
+    output_format = (args.format or
+                     to_string(configs.get("Default", {}).get("output_format"),
+                               DEFAULT_OUTPUT_FORMAT))
+    cache_file, fresh = get_cache_file(configs, args.refresh_cache)
+    if (args.diff or args.changed_hosts or args.changed_inventory or
+            args.save_baseline):
+        inventory = get_cached_inventory(configs, args.refresh_cache)
+        status = write_changes(configs, inventory, args,
+                               "compact" if output_format == "stream"
+                               else output_format)
+        if status:
+            sys.exit(status)
+    elif args.host:
+        if fresh:
+            # Only the variables of this host are decoded
+            with PROFILER.phase("load cache"):
+                hostvars = load_hostvars(cache_file, args.host) or {}
+        else:
+            inventory = get_cached_inventory(configs, args.refresh_cache)
+            hostvars = inventory.get("_meta", {}).get("hostvars", {})
+            hostvars = hostvars.get(args.host, {})
+        with PROFILER.phase("render"):
+            write_inventory(hostvars, sys.stdout,
+                            "compact" if output_format == "stream" else output_format)
+    elif (output_format == "stream" and not cache_file and
+          not to_bool(configs.get("Default", {}).get("factor_hostvars"))):
+        # Hostvars are written as soon as they are built
+        with PROFILER.phase("template"):
+            template = get_template(configs)
+        template.pop("_meta", None)
+        server_list = get_servers(configs)
+        if server_list is None:
+            server_list = []
+        # Includes building the hostvars
+        with PROFILER.phase("render"):
+            stream_inventory(template, iter_hosts(configs, server_list),
+                             sys.stdout)
+    else:
+        inventory = get_cached_inventory(configs, args.refresh_cache)
+        with PROFILER.phase("render"):
+            write_inventory(inventory, sys.stdout, output_format)
 
 
 if __name__ == "__main__":
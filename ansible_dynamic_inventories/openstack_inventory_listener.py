@@ -0,0 +1,253 @@
+#!/usr//bin/env python
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Keep the inventory cache of openstack_inventory.py up to date from the
+# notifications of Nova and Cinder.
+# At start, and then at every reconcile interval, the whole platform is
+# listed. In between, notifications are applied to the model of the platform
+# and the inventory cache is rebuilt from it, without any API call.
+# While the listener runs, the cache is kept fresh for openstack_inventory.py.
+# If the listener stops, the cache expires and openstack_inventory.py
+# queries the platform again.
+#
+# This script will look for configuration file in the following order:
+# .ansible/openstack_inventory.conf
+# ~/ansible/openstack_inventory.conf
+# /etc/ansible/openstack_inventory.conf
+#
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(1, '..')
+
+from ansible_dynamic_inventories.openstack_inventory import build_inventory, get_cache_file
+from ansible_dynamic_inventories.openstack_inventory_manager import OpenStackInventoryManager
+from ansible_dynamic_inventories.utils import *
+from ansible_dynamic_inventories.utils import notifications as nt
+from ansible_dynamic_inventories.utils.openstack_utils import ConfigError
+from ansible_dynamic_inventories.utils.parse import get_config, to_bool
+from ansible_dynamic_inventories.utils.profiler import PROFILER, add_profile_arguments, enable_profiler
+from ansible_dynamic_inventories.utils.snapshot import save_inventory
+
+# Maximum time to wait for notifications before checking the cache age
+POLL_INTERVAL = 1.0
+# Delay before retrying a failed reconcile
+RECONCILE_RETRY_DELAY = 60
+
+
+class InventoryListener(object):
+    "Apply notifications to the inventory cache"
+
+    def __init__(self, configs, source, reconcile_interval=None,
+                 platform_snapshot=None):
+        """
+        :param configs: (dict) Configuration
+        :param source: (notifications.NotificationSource)
+        :param reconcile_interval: (int) seconds between two listings of the
+                                   whole platform
+        :param platform_snapshot: (string) also keep this platform snapshot
+                                  of openstack_push.py up to date
+        """
+        self.configs = configs
+        self.source = source
+        cache_section = configs.get("Cache", {})
+        self.cache_file, _ = get_cache_file(configs)
+        if not self.cache_file:
+            raise ConfigError("inventory_cache is not set in the [Cache] "
+                              "section")
+        self.max_age = int(cache_section.get("inventory_cache_max_age",
+                                             DEFAULT_CACHE_MAX_AGE))
+        self.compress = to_bool(cache_section.get("compress"))
+        self.reconcile_interval = int(reconcile_interval or
+                                      cache_section.get("reconcile_interval",
+                                                        DEFAULT_RECONCILE_INTERVAL))
+        self.platform_snapshot = platform_snapshot
+        self.namespace = configs.get("Default", {}).get(
+            "metadata_namespace", DEFAULT_METADATA_NAMESPACE)
+        self.manager = OpenStackInventoryManager(configs, connect=False)
+        self.platform = None
+        self.next_reconcile = 0
+        self.last_write = 0
+        # ("server" or "volume", ID) of the resources whose notifications
+        # could not be applied, to fetch from the platform
+        self.stale = set()
+
+    def reconcile(self):
+        "List the whole platform and rewrite the cache"
+        with PROFILER.phase("reconcile"):
+            self.platform = self.manager.list_platform(self.namespace)
+        self.stale = set()
+        self.next_reconcile = time.time() + self.reconcile_interval
+        self.write()
+
+    def schedule_reconcile(self):
+        "Reconcile soon, e.g. after an error"
+        self.next_reconcile = min(self.next_reconcile,
+                                  time.time() + min(RECONCILE_RETRY_DELAY,
+                                                    self.reconcile_interval))
+
+    def fetch_server(self, vm_id):
+        "Get a server from the platform, see notifications.apply_notification"
+        return self.manager.connect().get_server(vm_id)
+
+    def fetch_volume(self, volume_id):
+        "Get a volume from the platform"
+        return self.manager.connect().get_volume(volume_id)
+
+    def handle(self, notifications):
+        """Apply notifications to the model of the platform.
+        :param notifications: list of notifications
+        :return: (bool) True if the model changed
+        """
+        changed = False
+        with PROFILER.phase("notifications"):
+            for notification in notifications:
+                try:
+                    if nt.apply_notification(self.platform, notification,
+                                             self.fetch_server):
+                        changed = True
+                except nt.NotificationError as e:
+                    sys.stderr.write("Warning: %s\n" % e)
+                except Exception as e:
+                    # Unexpected payload, API error...: the resource is
+                    # fetched again, or the platform listed again
+                    sys.stderr.write("Warning: cannot apply notification: "
+                                     "%s\n" % e)
+                    resource = nt.notification_resource(notification)
+                    if resource:
+                        self.stale.add(resource)
+                    else:
+                        self.schedule_reconcile()
+        return changed
+
+    def refresh_stale(self):
+        """Fetch the resources whose notifications could not be applied.
+        If a resource cannot be fetched, a reconcile is scheduled.
+        :return: (bool) True if the model changed
+        """
+        changed = False
+        with PROFILER.phase("refresh stale"):
+            for kind, resource_id in sorted(self.stale):
+                try:
+                    if kind == "server":
+                        vm = self.fetch_server(resource_id)
+                        if vm is None or vm["status"] == "DELETED":
+                            self.platform.remove_vm(resource_id)
+                        else:
+                            self.platform.add_vm(**vm)
+                    else:
+                        vol = self.fetch_volume(resource_id)
+                        self.platform.remove_volume(resource_id)
+                        if vol is not None:
+                            self.platform.add_volume_info(**vol)
+                    changed = True
+                except Exception as e:
+                    sys.stderr.write("Warning: cannot get %s %s: %s\n" %
+                                     (kind, resource_id, e))
+                    self.schedule_reconcile()
+        self.stale = set()
+        return changed
+
+    def write(self):
+        "Rebuild the inventory cache from the model of the platform"
+        with PROFILER.phase("write cache"):
+            inventory = build_inventory(self.configs,
+                                        self.platform.server_dicts())
+            save_inventory(inventory, self.cache_file, compress=self.compress)
+            if self.platform_snapshot:
+                self.platform.save(self.platform_snapshot,
+                                   compress=self.compress)
+        self.last_write = time.time()
+
+    def run(self):
+        "Listen to the notifications until interrupted"
+        self.reconcile()
+        while True:
+            now = time.time()
+            if now >= self.next_reconcile:
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    # Notifications are still applied until the next try
+                    sys.stderr.write("Warning: reconcile failed: %s\n" % e)
+                    self.next_reconcile = now + min(RECONCILE_RETRY_DELAY,
+                                                    self.reconcile_interval)
+                continue
+            notifications = self.source.poll(
+                min(POLL_INTERVAL, self.next_reconcile - now))
+            changed = bool(notifications) and self.handle(notifications)
+            if self.stale and self.refresh_stale():
+                changed = True
+            if changed:
+                self.write()
+            elif time.time() - self.last_write > self.max_age / 2.0:
+                # Nothing changed: keep the cache fresh
+                os.utime(self.cache_file, None)
+                self.last_write = time.time()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=
+                        'Update the OpenStack inventory cache from '
+                        'notifications')
+    parser.add_argument('-c', '--config', metavar='config',
+                        default=None,
+                        help="Configuration file")
+    parser.add_argument('-s', '--source', metavar='source',
+                        default=None,
+                        help="Source of the notifications, e.g. "
+                             "file:/var/log/nova/notifications.log. Default "
+                             "is the 'notification_source' configuration")
+    parser.add_argument('-i', '--reconcile-interval', metavar='seconds',
+                        type=int, default=None,
+                        help="Seconds between two listings of the whole "
+                             "platform. Default is the 'reconcile_interval' "
+                             "configuration, or %d" % DEFAULT_RECONCILE_INTERVAL)
+    parser.add_argument('-p', '--platform-snapshot', metavar='snapshot',
+                        default=None,
+                        help="Also keep this platform snapshot of "
+                             "openstack_push.py up to date")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    enable_profiler(args)
+    configs = get_config(args.config)
+    cache_section = configs.get("Cache", {})
+    source_url = args.source or cache_section.get("notification_source")
+    if not source_url:
+        print("ERROR: no notification source, use --source")
+        exit(1)
+    listener = InventoryListener(
+        configs, nt.get_source(source_url),
+        reconcile_interval=args.reconcile_interval,
+        platform_snapshot=(args.platform_snapshot or
+                           cache_section.get("platform_snapshot")))
+    try:
+        listener.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.source.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -25,23 +25,203 @@
 # /etc/ansible/openstack_inventory.conf
 #
 
+import json
+import os
+import time
+
 from utils import *
 from utils import ansible_utils as au
+from utils import journal as jn
+from utils import metadata_codec as mc
 from utils import openstack_utils as ou
+from utils import planner
+from utils import platform_model as pm
+from utils.parse import to_bool, to_string
+from utils.profiler import PROFILER
+
+# Seconds subtracted from the date of a snapshot when asking the platform
+# for the changes since that date
+SNAPSHOT_CLOCK_MARGIN = 60
+
+
+def new_touched():
+    """Get an empty record of the resources modified by a plan.
+    :return: (dict) sets of IDs: servers, volumes, deleted_servers and
+             deleted_volumes
+    """
+    return {"servers": set(), "volumes": set(),
+            "deleted_servers": set(), "deleted_volumes": set()}
+
+
+def add_touched(touched, step, resource_id):
+    """Record the resources modified by a step.
+    :param touched: (dict) see new_touched
+    :param step: (dict) step of a plan
+    :param resource_id: ID of the resource of the step
+    """
+    action = step["action"]
+    if action == "delete_vm":
+        touched["deleted_servers"].add(step["id"])
+        # Attached volumes are deleted with the VM
+        touched["deleted_volumes"].update(step["volumes"])
+    elif action == "delete_volume":
+        touched["deleted_volumes"].add(step["id"])
+    elif action in ("create_vm", "update_metadata"):
+        touched["servers"].add(resource_id)
+    elif resource_id:
+        touched["volumes"].add(resource_id)
 
 
 class OpenStackInventoryManager(object):
 
-    def __init__(self, configs):
+    def __init__(self, configs, connect=True):
         """OpenStackInventory.
         :param configs: (dict) configuration content
-        :param inventory: (ansible.inventory.ini.InventoryParser) Inventory object
+        :param connect: (bool) True to authenticate the client immediately.
+                        If False, the client is authenticated when it is
+                        first needed, so that offline plans do not need
+                        any access to the platform.
         """
         self.configs = configs
-        self.client = ou.OpenStackClient(configs)
-        self.client.initiate_client()
+        self.client = None
+        self.inventory = None
+        # Interrupted multi-create requests whose VMs were cleaned up
+        self._cleaned_batches = set()
+        # IDs of the resources modified by the last plan applied
+        self.touched = new_touched()
+        # True if the last update resumed an interrupted plan instead of
+        # applying the inventory
+        self.resumed = False
+        if connect:
+            self.connect()
+
+    def connect(self):
+        "Authenticate the OpenStack client if it is not done yet"
+        if self.client is None:
+            client = ou.OpenStackClient(self.configs)
+            client.initiate_client()
+            self.client = client
+        return self.client
+
+    def get_namespace(self, inventory):
+        """Get the metadata namespace of an inventory.
+        :param inventory: (ansible.inventory.ini.InventoryParser)
+        :return: (string) namespace
+        """
+        if "openstack_namespace" in inventory.groups["all"].vars:
+            return inventory.groups["all"].vars["openstack_namespace"]
+        default_section = self.configs.get("Default", {})
+        return default_section.get("metadata_namespace",
+                                   DEFAULT_METADATA_NAMESPACE)
+
+    def discover_platform(self, namespace, snapshot=None, refresh=False):
+        """Get the model of the platform.
+        If a snapshot is given and exists, the model is loaded from it,
+        without accessing the platform, unless refresh is set.
+        :param namespace: (string) metadata namespace
+        :param snapshot: (string) platform snapshot file
+        :param refresh: (bool) True to update the snapshot from the platform:
+                        incrementally if the snapshot exists, otherwise by
+                        listing all resources
+        :return: (platform_model.PlatformModel)
+        """
+        if snapshot and os.path.exists(os.path.expanduser(snapshot)):
+            platform = pm.PlatformModel.load(snapshot, namespace)
+            if refresh:
+                self.refresh_platform(platform)
+                self._save_snapshot(platform, snapshot)
+            return platform
+        platform = self.list_platform(namespace)
+        if snapshot:
+            self._save_snapshot(platform, snapshot)
+        return platform
+
+    def list_platform(self, namespace):
+        """Build the model of the platform by listing all its resources.
+        Servers, volumes (with their attachments) and networks are listed
+        concurrently.
+        :param namespace: (string) metadata namespace
+        :return: (platform_model.PlatformModel)
+        """
+        client = self.connect()
+        platform = pm.PlatformModel(namespace)
+        platform.info["taken_at"] = time.time()
+        servers, volumes, networks = ou.run_concurrently(
+            [client.list_servers, client.list_volumes, client.list_networks])
+        for vm in servers:
+            platform.add_vm(**vm)
+        for vol in volumes:
+            platform.add_volume_info(**vol)
+        for net in networks:
+            platform.add_network(net["id"], net["label"])
+        return platform
+
+    def refresh_platform(self, platform):
+        """Update a platform model with the changes since it was taken.
+        Only the servers changed since the model was taken are listed.
+        Volumes and networks are listed again. The listings are concurrent.
+        :param platform: (platform_model.PlatformModel)
+        """
+        client = self.connect()
+        now = time.time()
+        # Leave a margin for clock differences with the platform
+        since = time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                              time.gmtime(float(platform.info.get("taken_at", 0)) -
+                                          SNAPSHOT_CLOCK_MARGIN))
+        servers, volumes, networks = ou.run_concurrently(
+            [lambda: client.list_servers(search_opts={"changes-since": since}),
+             client.list_volumes, client.list_networks])
+        for vm in servers:
+            if vm["status"] == "DELETED":
+                platform.remove_vm(vm["id"])
+            else:
+                platform.add_vm(**vm)
+        platform.clear_volumes()
+        for vol in volumes:
+            platform.add_volume_info(**vol)
+        platform.networks = {}
+        for net in networks:
+            platform.add_network(net["id"], net["label"])
+        platform.info["taken_at"] = now
 
-    def update_platform(self, inventory_file, inherited=True, update=False):
+    def refresh_touched(self, platform):
+        """Update a platform model with the resources modified by the last
+        plan applied, without listing the platform. Deleted resources are
+        removed from the model, the others are fetched concurrently, at most
+        ou.MAX_WORKERS at once.
+        :param platform: (platform_model.PlatformModel)
+        """
+        client = self.connect()
+        touched = self.touched
+        for vm_id in touched["deleted_servers"]:
+            platform.remove_vm(vm_id)
+        for volume_id in touched["deleted_volumes"]:
+            platform.remove_volume(volume_id)
+        server_ids = sorted(touched["servers"] - touched["deleted_servers"])
+        volume_ids = sorted(touched["volumes"] - touched["deleted_volumes"])
+        results = ou.run_concurrently(
+            [lambda vm_id=vm_id: client.get_server(vm_id)
+             for vm_id in server_ids] +
+            [lambda volume_id=volume_id: client.get_volume(volume_id)
+             for volume_id in volume_ids],
+            max_workers=ou.MAX_WORKERS)
+        for vm_id, vm in zip(server_ids, results):
+            if vm is None or vm["status"] == "DELETED":
+                platform.remove_vm(vm_id)
+            else:
+                platform.add_vm(**vm)
+        for volume_id, vol in zip(volume_ids, results[len(server_ids):]):
+            platform.remove_volume(volume_id)
+            if vol is not None:
+                platform.add_volume_info(**vol)
+
+    def _save_snapshot(self, platform, snapshot):
+        cache_section = self.configs.get("Cache", {})
+        platform.save(snapshot, compress=to_bool(cache_section.get("compress")))
+
+    def update_platform(self, inventory_file, inherited=True, update=False,
+                        snapshot=None, refresh=False, plan_file=None,
+                        journal_file=None, force=False):
         """Synchronize the VMs based on an inventory.
         This function also deletes VMs if their names are no longer in the
         inventory.
@@ -60,131 +240,300 @@ class OpenStackInventoryManager(object):
                           variables will be stored in hosts' metadata
         :param update: (bool) True: update the OpenStack platform
                        (default) False: only show actions, not update the platform
+        :param snapshot: (string) platform snapshot file. Without update and
+                         refresh, the plan is computed offline from it.
+        :param refresh: (bool) refresh the snapshot before planning. Always
+                        done when updating the platform.
+        :param plan_file: (string) save the plan in this file
+        :param journal_file: (string) journal of the application of the plan.
+                             If it contains an unfinished plan, this plan is
+                             resumed instead of computing a new one.
+        :param force: (bool) compare all the metadata of the VMs, even if
+                      their digest matches the inventory
+        :return: (dict) plan, see utils.planner
         """
-        inventory = au.parse_inventory_file(inventory_file)
-        hostnames = inventory.hosts.keys()
-        host_list = inventory.hosts.values()
-        if "openstack_namespace" in inventory.groups["all"].vars:
-            namespace = self.inventory.groups["all"].vars["openstack_namespace"]
-        else:
-            default_section = self.configs.get("Default", {})
-            namespace = default_section.get("metadata_namespace",
-                                            DEFAULT_METADATA_NAMESPACE)
+        with PROFILER.phase("parse inventory"):
+            inventory = au.parse_inventory_file(inventory_file)
+        self.inventory = inventory
+        namespace = self.get_namespace(inventory)
         print "Namspace: %s" % namespace
-        groups_metadata = namespace + "groups"
-        vm_list = self.client.nova.servers.list()
-        scoped_vms = {}
-        for vm in vm_list:
-            if groups_metadata in vm.metadata:
-                scoped_vms[vm.name] = vm
-        # Get all Inventory hosts that are not existed on OpenStack platform
-        unmapped_inventory_hosts = [host for host in host_list
-                                         if host.name not in scoped_vms]
-       # Get all VMs that are no longer in inventory
-        unmapped_vms = [scoped_vms[vm_name] for vm_name in scoped_vms
-                                            if vm_name not in hostnames]
-        # Get all VMs that are associated with hosts in the Inventory
-        mapped_vms = [scoped_vms[vm_name] for vm_name in scoped_vms
-                                          if vm_name in hostnames]
-
-        # Volumes listed in the Inventory
-        inventory_volumes = {}
-        for host in host_list:
-            host_vars = au.get_host_variables(host, inherited=True)
-            for key, value in host_vars.items():
-                if key.startswith(ou.OPENSTACK_VOLUME_PREFIX):
-                    device = key[len(ou.OPENSTACK_VOLUME_PREFIX)+1:]
-                    inventory_volumes[host.name + '_' + device] = [host.name + '_' + device, host.name, device, value]
-        # Volumes on OpenStack platform that belong to our namespace
-        volume_list = self.client.cinder.volumes.list()
-        scoped_volumes = {}
-        volume_host_metadata = namespace + "host"
-        for vol in volume_list:
-            if volume_host_metadata in vol.metadata:
-                scoped_volumes[vol.name] = {'host': vol.metadata[volume_host_metadata],
-                                            'device': vol.metadata.get(namespace + "device"),
-                                            'volume': vol}
-
-        unmapped_inventory_volumes = {}
-        for inv_vol_name, inv_vol in inventory_volumes.items():
-            if inv_vol_name not in scoped_volumes:
-                unmapped_inventory_volumes[inv_vol_name] = inv_vol
-        unmapped_os_volumes = [scoped_volumes[vol_name]
-                                    for vol_name in scoped_volumes
-                                    if vol_name not in inventory_volumes]
+        self.resumed = False
+        if update and journal_file:
+            journal = jn.ApplyJournal(journal_file)
+            if journal.pending:
+                print("Journal %s contains an unfinished plan, resuming it. "
+                      "Re-run the script afterwards to apply the inventory." %
+                      journal.path)
+                self.apply_plan(journal.plan, journal_file=journal_file)
+                self.resumed = True
+                return journal.plan
+        encoding = to_string(self.configs.get("Default", {}).get(
+            "metadata_encoding"), mc.PLAIN)
+        with PROFILER.phase("host metadata"):
+            inventory_model = pm.InventoryModel.from_inventory(inventory, namespace,
+                                                               encoding=encoding)
+        with PROFILER.phase("discovery"):
+            platform = self.discover_platform(namespace, snapshot,
+                                              refresh=refresh or update)
+        with PROFILER.phase("plan"):
+            plan = planner.compute_plan(inventory_model, platform,
+                                        inventory_file=inventory_file,
+                                        trust_digest=not force)
+        if plan_file:
+            with open(plan_file, 'w') as f:
+                json.dump(plan, f, indent=2)
 
         if not update:
-            print("Create VMs: %s" % unmapped_inventory_hosts)
-            print("Delete VMs: %s" % unmapped_vms)
-            print("Update metadata for VMs: %s" % mapped_vms)
-            print("Create volumes: %s" % unmapped_inventory_volumes)
-            print("Delete volumes: %s" % [vol['volume'].name for vol in unmapped_os_volumes])
-            return
-    
-        for host in unmapped_inventory_hosts:
-            self._create_vm(host, metadata_namespace=namespace, inherited=inherited)
-    
-        for vm in unmapped_vms:
-            self._delete_vm(vm)
-
-        for vm in mapped_vms:
-            self.client.update_metadata(vm, inventory.hosts[vm.name], metadata_namespace=namespace)
-
-        for vol in unmapped_os_volumes:
-            self._delete_volume(vol['volume'])    
-
-        # Refresh the list of VMs
-        vm_list = self.client.nova.servers.list()
-        scoped_vms = {}
-        for vm in vm_list:
-            if vm.name in inventory.hosts and groups_metadata in vm.metadata:
-                scoped_vms[vm.name] = vm
-        for vm_name, vm in scoped_vms.items():
-            self._update_volumes(vm, inventory.hosts[vm_name], namespace)
+            print(json.dumps(plan, indent=2))
+            print("Plan: %s" % planner.summarize_plan(plan))
+            return plan
 
-        print("OpenStackInventoryManager: update platform done")
+        self.apply_plan(plan, journal_file=journal_file)
+        if snapshot:
+            with PROFILER.phase("refresh touched"):
+                self.refresh_touched(platform)
+                self._save_snapshot(platform, snapshot)
+        return plan
 
-    def _create_vm(self, host, metadata_namespace=DEFAULT_METADATA_NAMESPACE,
-                   inherited=False):
-        """Create a VM based on an Ansible inventory host.
-        :param host: ansible.inventory.host.Host object
-        :param inherited: (bool) True if no template is used, all inherited groups
-                          and variables will be stored in hosts' metadata
-                          False (default) if a template is used, only host-specific
-                          groups and variables will be stored in hosts' metadata
-        :param return: new vm
+    def apply_plan(self, plan, journal_file=None):
+        """Execute the steps of a plan on the platform.
+        If a journal is given, every step is recorded in it. If the journal
+        contains the same plan, unfinished, the steps already done are
+        skipped and the interrupted ones are checked before being re-run.
+        :param plan: (dict) plan, see utils.planner
+        :param journal_file: (string) journal file
+        Raise JournalError if the journal contains another unfinished plan.
         """
-        self.client.create_vm(host, metadata_namespace, inherited)
+        if plan.get("version") != planner.PLAN_VERSION:
+            raise planner.PlanError("Unsupported plan version: %s" %
+                                    plan.get("version"))
+        self.connect()
+        namespace = plan["namespace"]
+        journal = None
+        if journal_file:
+            journal = jn.ApplyJournal(journal_file)
+            if journal.begin(plan):
+                print("Resuming plan: %d/%d steps already done" %
+                      (journal.done_count(), len(plan["steps"])))
+        # IDs of the VMs created by the plan, by name
+        vm_ids = {}
+        batches = self._get_boot_batches(plan["steps"], journal)
+        batched = set()
+        for indexes in batches.values():
+            batched.update(indexes)
+        self._cleaned_batches = set()
+        self.touched = new_touched()
+        for index, step in enumerate(plan["steps"]):
+            if index in batches:
+                self._apply_boot_batch(plan["steps"], batches[index],
+                                       vm_ids, journal)
+                continue
+            if index in batched:
+                continue
+            if journal:
+                status = journal.status(index)
+                resource_id = journal.resource_id(index)
+                if status in (jn.STARTED, jn.FAILED):
+                    # The step may have taken effect before the failure
+                    resource_id = self._recover_step(
+                        step, vm_ids, journal.steps[index].get("batch"))
+                    if resource_id:
+                        journal.done(index, resource_id)
+                        status = jn.DONE
+                if status == jn.DONE:
+                    if step["action"] == "create_vm":
+                        vm_ids[step["name"]] = resource_id
+                    add_touched(self.touched, step, resource_id)
+                    continue
+                journal.start(index)
+            try:
+                with PROFILER.phase("apply " + step["action"]):
+                    resource_id = self._apply_step(step, namespace, vm_ids)
+            except BaseException as e:
+                if journal:
+                    journal.fail(index, e if str(e) else e.__class__.__name__)
+                    journal.close()
+                raise
+            add_touched(self.touched, step, resource_id)
+            if journal:
+                journal.done(index, resource_id)
+        if journal:
+            journal.finish()
+        print("OpenStackInventoryManager: update platform done")
 
-    def _delete_vm(self, vm):
-        """Delete a VM from the OpenStack platform.
-        :param vm: (novaclient.v2.servers.Server) server to delete
+    def _get_boot_batches(self, steps, journal=None):
+        """Group the create_vm steps that can be executed by a single
+        multi-create request: same image, flavor, network, key and security
+        groups, and no fixed IP. Hosts with a fixed IP are booted one by one,
+        with their address. Steps already started are not batched, they are
+        recovered one by one.
+        The size of the batches is limited by the 'boot_batch_size'
+        configuration. Batches are disabled by default.
+        :param steps: list of (dict) steps of a plan
+        :param journal: (ApplyJournal)
+        :return: (dict) index of the first step of a batch to the indexes
+                 of the steps of the batch
         """
-        self.client.delete_vm(vm)
-
-    def _update_metadata(self, vm, host, metadata_namespace=DEFAULT_METADATA_NAMESPACE, inherited=True):
-        """Update metadata of the VM to match the correspondent host.
-        :param vm: (novaclient.v2.servers.Server) server to update
-        :param host: (ansible.inventory.host.Host) Host declared in the inventory,
-                     correspondent to the VM
-        :param metadata_namespace: (string) namespace of the project
-        :param inherited: (bool) True if no template is used, all inherited groups
-                          and variables will be stored in hosts' metadata
-                          False (default) if a template is used, only host-specific
-                          groups and variables will be stored in hosts' metadata
+        batch_size = int(self.configs.get("Default", {}).get("boot_batch_size", 1))
+        if batch_size < 2:
+            return {}
+        groups = {}
+        for index, step in enumerate(steps):
+            if step["action"] != "create_vm":
+                continue
+            if ou.is_ip(step["fixed_ip"]):
+                continue
+            if journal and journal.status(index) is not None:
+                continue
+            key = (step["image"], step["flavor"], step["network"],
+                   step["key_name"], tuple(step["security_groups"] or ()))
+            groups.setdefault(key, []).append(index)
+        batches = {}
+        for indexes in groups.values():
+            for start in range(0, len(indexes), batch_size):
+                batch = indexes[start:start + batch_size]
+                if len(batch) > 1:
+                    batches[batch[0]] = batch
+        return batches
+
+    def _apply_boot_batch(self, steps, indexes, vm_ids, journal=None):
+        """Execute create_vm steps with a single multi-create request.
+        Hosts that did not get a VM of the request, e.g. because it ended in
+        error, are booted again one by one.
+        :param steps: list of (dict) steps of a plan
+        :param indexes: list of (int) indexes of the create_vm steps
+        :param vm_ids: (dict) IDs of the VMs created by the plan, by name
+        :param journal: (ApplyJournal)
         """
-        self.client.update_metadata(vm, host, metadata_namespace, inherited)
+        client = self.client
+        batch = [steps[index] for index in indexes]
+        batch_name = "%s-batch" % batch[0]["name"]
+        if journal:
+            for index in indexes:
+                journal.start(index, batch=batch_name)
+        try:
+            with PROFILER.phase("apply create_vm batch"):
+                batch_ids = client.boot_vms(batch, batch_name)
+        except BaseException as e:
+            if journal:
+                for index in indexes:
+                    journal.fail(index, e if str(e) else e.__class__.__name__,
+                                 batch=batch_name)
+                journal.close()
+            raise
+        for index, step in zip(indexes, batch):
+            vm_id = batch_ids.get(step["name"])
+            if vm_id is None:
+                try:
+                    with PROFILER.phase("apply create_vm"):
+                        vm_id = client.boot_vm(step).id
+                except BaseException as e:
+                    if journal:
+                        journal.fail(index, e if str(e) else e.__class__.__name__,
+                                     batch=batch_name)
+                        journal.close()
+                    raise
+            vm_ids[step["name"]] = vm_id
+            add_touched(self.touched, step, vm_id)
+            if journal:
+                journal.done(index, vm_id)
 
-    def _delete_volume(self, volume):
-        """Delete a volume from the OpenStack platform.
-        :param volume: (cinderclient.v2.volumes.Volume) volume to delete
+    def _recover_step(self, step, vm_ids, batch=None):
+        """Check whether an interrupted step took effect.
+        :param step: (dict) step
+        :param vm_ids: (dict) IDs of the VMs created by the plan, by name
+        :param batch: (string) temporary name of the VMs of the multi-create
+                      request of the step, if any
+        :return: ID of the resource of the step if it is complete,
+                 None if the step must be executed again
         """
-        self.client.delete_volume(volume)
-    
-    def _update_volumes(self, vm, host, metadata_namespace=DEFAULT_METADATA_NAMESPACE):
-        """Create and attach volumes to VM following the description of a host
-        in an inventory.
-        :param vm: VM to attach volumes to
-        :param host: inventory host with description of volumes
+        client = self.client
+        action = step["action"]
+        if action == "create_vm":
+            if batch and batch not in self._cleaned_batches:
+                # VMs of the request that did not get a host
+                client.delete_batch(batch)
+                self._cleaned_batches.add(batch)
+            vm = client.find_server(step["name"])
+            if vm is None:
+                return None
+            if getattr(vm, "status", None) == "ERROR":
+                print("Delete VM %s in error before re-creating it" % vm.name)
+                client.nova.servers.delete(vm)
+                return None
+            print("VM %s was already created" % vm.name)
+            return vm.id
+        if action == "delete_vm":
+            if not client.server_exists(step["id"]):
+                return step["id"]
+        elif action == "delete_volume":
+            if not client.volume_exists(step["id"]):
+                return step["id"]
+        elif action == "create_volume":
+            vol = client.find_volume(step["name"])
+            if vol is None:
+                return None
+            print("Volume %s was already created" % vol.name)
+            if not vol.attachments:
+                vm_id = step["vm_id"] or vm_ids.get(step["vm"])
+                client.attach_volume(vm_id, vol.id, step["device"],
+                                     vol.name, step["vm"])
+            return vol.id
+        elif action == "attach_volume":
+            # Attaching an in-use volume again is rejected by Nova
+            vol = client.get_volume(step["id"])
+            if vol is not None and any(a["server_id"] == step["vm_id"]
+                                       for a in vol["attachments"]):
+                print("Volume %s was already attached" % step["name"])
+                return vol["id"]
+        # Other steps are idempotent and are executed again
+        return None
+
+    def _apply_step(self, step, namespace, vm_ids):
+        """Execute a step of a plan.
+        :param step: (dict) step
+        :param namespace: (string) metadata namespace
+        :param vm_ids: (dict) IDs of the VMs created by the plan, by name
+        :return: ID of the resource created or modified by the step
         """
-        self.client.update_volumes(vm, host, metadata_namespace=metadata_namespace)
+        client = self.client
+        action = step["action"]
+        if action == "create_vm":
+            vm = client.boot_vm(step)
+            vm_ids[step["name"]] = vm.id
+            return vm.id
+        if action == "delete_vm":
+            client.delete_vm(pm.VMRecord(step["id"], step["name"]),
+                             volume_ids=step["volumes"])
+            return step["id"]
+        if action == "update_metadata":
+            vm = pm.VMRecord(step["id"], step["name"])
+            print("Update VM metadata: name=%-10s metadata=%s\n" %
+                  (step["name"], step["metadata"]))
+            if step["delete_keys"]:
+                client.nova.servers.delete_meta(vm, step["delete_keys"])
+            client.nova.servers.set_meta(vm, metadata=step["metadata"])
+            return step["id"]
+        if action == "delete_volume":
+            attachments = [{"server_id": server_id}
+                           for server_id in step["attachments"]]
+            client.delete_volume(pm.VolumeRecord(step["id"], step["name"],
+                                                 attachments=attachments))
+            return step["id"]
+        if action == "rename_volume":
+            print("Change volume name %s -> %s" % (step["old_name"], step["name"]))
+            client.cinder.volumes.update(step["id"], name=step["name"])
+            return step["id"]
+        if action == "attach_volume":
+            client.attach_volume(step["vm_id"], step["id"], step["device"],
+                                 step["name"], step["vm"])
+            return step["id"]
+        if action == "create_volume":
+            vm_id = step["vm_id"] or vm_ids.get(step["vm"])
+            if not vm_id:
+                raise planner.PlanError("VM %s of volume %s was not created" %
+                                        (step["vm"], step["name"]))
+            return client.create_volume(vm_id, step["vm"], step["device"],
+                                        step["size"], step["volume_type"],
+                                        namespace).id
+        raise planner.PlanError("Unknown action: %s" % action)
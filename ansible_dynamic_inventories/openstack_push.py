@@ -26,13 +26,19 @@
 #
 
 import argparse
+import json
 import os
 import sys
 
 sys.path.insert(1, '..')
 
 from ansible_dynamic_inventories.openstack_inventory_manager import OpenStackInventoryManager
+from ansible_dynamic_inventories.utils import DEFAULT_APPLIED_FILE, DEFAULT_JOURNAL_FILE
+from ansible_dynamic_inventories.utils.fingerprint import AppliedRecord, inventory_fingerprint
+from ansible_dynamic_inventories.utils.journal import ApplyJournal
+from ansible_dynamic_inventories.utils.ansible_utils import make_template, parse_inventory_file
 from ansible_dynamic_inventories.utils.parse import get_config
+from ansible_dynamic_inventories.utils.profiler import PROFILER, add_profile_arguments, enable_profiler
 
 
 def get_args():
@@ -51,10 +57,50 @@ def get_args():
     parser.add_argument('-u', '--update',
                         action='store_true',
                         help="If set, will update the platform")
+    parser.add_argument('-s', '--snapshot', metavar='snapshot',
+                        default=None,
+                        help="Platform snapshot file. If it exists, the plan "
+                             "is computed from it without accessing the "
+                             "platform, unless --refresh or --update is set. "
+                             "Otherwise it is created.")
+    parser.add_argument('-r', '--refresh',
+                        action='store_true',
+                        help="Refresh the snapshot with the changes of the "
+                             "platform before planning")
+    parser.add_argument('-p', '--plan-out', metavar='plan',
+                        default=None,
+                        help="Save the plan in a JSON file")
+    parser.add_argument('-a', '--apply-plan', metavar='plan',
+                        default=None,
+                        help="Apply a plan saved with --plan-out, without "
+                             "re-planning")
+
+    parser.add_argument('-j', '--journal', metavar='journal',
+                        default=None,
+                        help="Journal of the update. If an update is "
+                             "interrupted, the next run resumes it from the "
+                             "journal. Default is the 'journal_file' "
+                             "configuration, or %s" % DEFAULT_JOURNAL_FILE)
+    parser.add_argument('--discard-journal',
+                        action='store_true',
+                        help="Forget an interrupted update instead of "
+                             "resuming it")
+    parser.add_argument('-f', '--force',
+                        action='store_true',
+                        help="Update the platform even if the inventory did "
+                             "not change since the last update, and compare "
+                             "all the metadata of the VMs instead of their "
+                             "digest")
+    add_profile_arguments(parser)
 
-    parser.add_argument('inventory', help="Inventory file (INI format)")
+    parser.add_argument('inventory', nargs='?', default=None,
+                        help="Inventory file (INI format)")
     args = parser.parse_args()
+    if args.apply_plan:
+        return args
     filename = args.inventory
+    if not filename:
+        parser.error("an inventory file is required")
     if not os.path.exists(filename):
         print "ERROR: File %s does not exists" % filename
         exit(0)
@@ -64,22 +110,69 @@ def get_args():
     return args
 
 
+def save_template(inventory, filename):
+    print("Generating template file %s..." % filename)
+    with PROFILER.phase("template"):
+        template = make_template(inventory)
+        with open(filename, 'w') as f:
+            json.dump(template, f, indent=2)
+
+
 def main():
     args = get_args()
-    configs = get_config(args.config)
+    enable_profiler(args)
+    with PROFILER.phase("config"):
+        configs = get_config(args.config)
     if args.use_template:
-        configs["Default"]["no_template"] = True
-    openstack_inventory = OpenStackInventoryManager(configs)
+        configs.setdefault("Default", {})["no_template"] = True
+    default_section = configs.get("Default", {})
+    journal_file = (args.journal or
+                    default_section.get("journal_file", DEFAULT_JOURNAL_FILE))
+    applied = AppliedRecord(default_section.get("applied_file",
+                                                DEFAULT_APPLIED_FILE))
+    if args.discard_journal:
+        ApplyJournal(journal_file).discard()
+    if args.apply_plan:
+        with open(args.apply_plan) as f:
+            plan = json.load(f)
+        if plan.get("inventory"):
+            # The platform may no longer match the inventory of the plan
+            applied.forget(AppliedRecord.get_key("openstack_push",
+                                                 plan["inventory"], configs))
+        OpenStackInventoryManager(configs).apply_plan(plan,
+                                                      journal_file=journal_file)
+        return
+    key = AppliedRecord.get_key("openstack_push", args.inventory, configs)
+    fingerprint = None
+    if args.update:
+        with PROFILER.phase("fingerprint"):
+            fingerprint = inventory_fingerprint(args.inventory, configs)
+        if (not args.force and applied.matches(key, fingerprint) and
+                not ApplyJournal(journal_file).pending):
+            print("Inventory %s did not change since the last update, nothing "
+                  "to do. Use --force to check the platform." % args.inventory)
+            if args.out_template:
+                with PROFILER.phase("parse inventory"):
+                    inventory = parse_inventory_file(args.inventory)
+                save_template(inventory, args.out_template)
+            return
+    # The client authenticates only if the platform is accessed, so that
+    # plans computed from a snapshot are offline
+    openstack_inventory = OpenStackInventoryManager(configs, connect=False)
     openstack_inventory.update_platform(inherited=not args.use_template,
                                         inventory_file=args.inventory,
-                                        update=args.update)
+                                        update=args.update,
+                                        snapshot=args.snapshot,
+                                        refresh=args.refresh,
+                                        plan_file=args.plan_out,
+                                        journal_file=journal_file,
+                                        force=args.force)
     if not args.update:
         print "If you are sure that the actions are correct, re-run the script with --update to update the platform."
+    elif not openstack_inventory.resumed:
+        applied.record(key, fingerprint)
     if args.out_template:
-        print("Generating template file %s..." % args.out_template)
-        template = make_template(openstack_inventory.inventory)
-        with open(args.out_template, 'w') as f:
-            json.dump(template, f, indent=2)
+        save_template(openstack_inventory.inventory, args.out_template)
 
 
 if __name__ == "__main__":
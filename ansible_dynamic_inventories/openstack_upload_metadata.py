@@ -46,16 +46,27 @@ from ansible_dynamic_inventories.utils import *
 from ansible_dynamic_inventories.utils.parse import *
 from ansible_dynamic_inventories.utils.ansible_utils import *
 from ansible_dynamic_inventories.utils.openstack_utils import *
-
-
-def set_metadata(configs, inventory):
-    "Set VM metadata based on an inventory"
-
-    nova = get_novaclient(configs)
-    server_list = nova.servers.list()
+from ansible_dynamic_inventories.utils.metadata_codec import *
+from ansible_dynamic_inventories.utils.fingerprint import AppliedRecord, inventory_fingerprint
+from ansible_dynamic_inventories.utils.platform_model import digest_volumes, get_volume_specs
+from ansible_dynamic_inventories.utils.profiler import PROFILER, add_profile_arguments, enable_profiler
+
+
+def set_metadata(configs, inventory, force=False):
+    """Set VM metadata based on an inventory.
+    VMs whose digest item matches the metadata are not updated, unless
+    force is set.
+    """
+
+    with PROFILER.phase("list servers"):
+        osclient = OpenStackClient(configs)
+        osclient.initiate_client()
+        nova = osclient.nova
+        server_list = nova.servers.list()
     default_section = configs.get("Default", {})
     namespace = default_section.get("metadata_namespace",
                                     DEFAULT_METADATA_NAMESPACE)
+    encoding = to_string(default_section.get("metadata_encoding"), PLAIN)
     server_infos = {}
     for s in server_list:
         server_infos[s.name] = {'server': s, 'groups': [], 'vars': {}}
@@ -64,6 +75,7 @@ def set_metadata(configs, inventory):
         if hname not in server_infos:
             raise Exception("Host %s is not found on cloud." % hname)
         server_infos[hname]['vars'] = host.vars
+        server_infos[hname]['host'] = host
 
     for gname, group in inventory.groups.items():
         for host in group.hosts:
@@ -78,11 +90,23 @@ def set_metadata(configs, inventory):
         # We need to remove all hosts that already have at least one group
         if (len(info['groups']) > 1) and ('ungrouped' in info['groups']):
             info['groups'].remove('ungrouped')
-        meta = {}
-        meta[namespace + "groups"] = ','.join(info['groups'])
-        for key, value in info['vars'].items():
-            meta[namespace + key] = str(value)
-        nova.servers.set_meta(info['server'], meta)
+        with PROFILER.phase("host metadata"):
+            meta = {}
+            meta[namespace + "groups"] = ','.join(info['groups'])
+            meta.update(encode_variables(info['vars'], namespace, encoding))
+            # Same digest as openstack_push.py: the volumes are included
+            volumes = get_volume_specs(sname, get_host_variables(info['host']))
+            add_digest(meta, namespace, digest_volumes(volumes))
+            if not force and same_digest(info['server'].metadata, meta, namespace):
+                continue
+            # Remove the items of the previous variables, e.g. after a change
+            # of encoding
+            stale_keys = [key for key in info['server'].metadata
+                          if key.startswith(namespace) and key not in meta]
+        with PROFILER.phase("upload metadata"):
+            if stale_keys:
+                nova.servers.delete_meta(info['server'], stale_keys)
+            nova.servers.set_meta(info['server'], meta)
 
 
 def get_args():
@@ -96,6 +120,12 @@ def get_args():
     parser.add_argument('inventory', help="Inventory file (INI format)")
     parser.add_argument('-n', '--no-update', action='store_true',
                         help="If set, do not update metadata of the VMs")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="Update the metadata even if the inventory did "
+                             "not change since the last upload, and compare "
+                             "all the metadata of the VMs instead of their "
+                             "digest")
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
     filename = args.inventory
@@ -110,17 +140,36 @@ def get_args():
 
 def main():
     args = get_args()
+    enable_profiler(args)
     filename = args.inventory
-    configs = get_config(args.config)
-    inventory = parse_inventory_file(filename)
+    with PROFILER.phase("config"):
+        configs = get_config(args.config)
+    applied = AppliedRecord(configs.get("Default", {}).get(
+        "applied_file", DEFAULT_APPLIED_FILE))
+    key = AppliedRecord.get_key("openstack_upload_metadata", filename,
+                                configs)
+    update = not args.no_update
+    if update:
+        with PROFILER.phase("fingerprint"):
+            fingerprint = inventory_fingerprint(filename, configs)
+        if not args.force and applied.matches(key, fingerprint):
+            print("Inventory %s did not change since the last upload, nothing "
+                  "to do. Use --force to check the platform." % filename)
+            update = False
+            if not args.out_template:
+                return
+    with PROFILER.phase("parse inventory"):
+        inventory = parse_inventory_file(filename)
     if args.out_template:
         print("Generating template file %s..." % args.out_template)
-        template = make_template(inventory)
-        with open(args.out_template, 'w') as f:
-            json.dump(template, f, indent=2)
-    if not args.no_update:
+        with PROFILER.phase("template"):
+            template = make_template(inventory)
+            with open(args.out_template, 'w') as f:
+                json.dump(template, f, indent=2)
+    if update:
         print("Updating metadata...")
-        set_metadata(configs, inventory)
+        set_metadata(configs, inventory, force=args.force)
+        applied.record(key, fingerprint)
 
 
 if __name__ == "__main__":
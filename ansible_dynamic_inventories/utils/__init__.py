@@ -3,3 +3,17 @@ from parse import CONF_FILES
 DEFAULT_METADATA_NAMESPACE = "ansible:"
     
 DEFAULT_KEY_FOLDER = "."
+
+OPENSTACK_VOLUME_PREFIX = "openstack_volume"
+
+DEFAULT_CACHE_MAX_AGE = 300
+
+DEFAULT_JOURNAL_FILE = "~/.ansible/openstack_push.journal"
+
+DEFAULT_APPLIED_FILE = "~/.ansible/openstack_applied.json"
+
+DEFAULT_TEMPLATE_CACHE_DIR = "~/.ansible/cache"
+
+DEFAULT_RECONCILE_INTERVAL = 3600
+
+DEFAULT_BASELINE_FILE = "~/.ansible/openstack_inventory.baseline"
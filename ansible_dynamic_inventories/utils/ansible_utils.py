@@ -20,17 +20,35 @@ import os
 from ansible.inventory.group import Group
 from ansible.inventory.ini import InventoryParser
 
+from ansible_dynamic_inventories.utils import metadata_codec as mc
+from ansible_dynamic_inventories.utils import template_compiler as tc
 
-def get_template(configs):
-    "Get inventory template from template file."
+
+def get_compiled_template(configs):
+    """Get the compiled template of the configuration.
+    The template file is only parsed when it changed since the last run.
+    :param configs: (dict) Configuration
+    :return: (dict) compiled template, None if there is no template file
+    """
+    template_section = configs.get("Template", {})
+    if "template_file" not in template_section:
+        return None
+    return tc.load_compiled_template(template_section["template_file"],
+                                     template_section.get("compiled_cache"))
+
+
+def get_template(configs, compiled=None):
+    """Get inventory template from template file.
+    :param configs: (dict) Configuration
+    :param compiled: (dict) compiled template, loaded from configs if None
+    """
     inventory = {"_meta": {
                    "hostvars": {}
                  }}
-    if "Template" in configs:
-        if "template_file" in configs["Template"]:
-            with open(os.path.abspath(os.path.expanduser(configs["Template"]["template_file"]))) as f:
-                template = json.load(f)
-                inventory.update(template)
+    if compiled is None:
+        compiled = get_compiled_template(configs)
+    if compiled is not None:
+        inventory.update(tc.inventory_from_compiled(compiled))
     return inventory
 
 
@@ -104,7 +122,8 @@ def get_host_variables(host, inherited=True):
     return host_vars
 
 
-def create_host_metadata(host, metadata_namespace, inherited=True):
+def create_host_metadata(host, metadata_namespace, inherited=True,
+                         encoding=mc.PLAIN):
     """Create metadata correspondent to a host in an inventory.
     :param host: (ansible.inventory.host.Host) Host declared in the
                  Ansible inventory
@@ -114,6 +133,9 @@ def create_host_metadata(host, metadata_namespace, inherited=True):
                       host's metadata
                       False if a template is used, only host-specific
                       groups and variables will be stored in hosts' metadata
+    :param encoding: (string) metadata encoding of the variables:
+                     "plain" (default) one item per variable, or
+                     "packed" all variables in a few compressed items
     :return: (dict) full metadata correspondent to the host's variables
     """
     meta = {}
@@ -123,14 +145,190 @@ def create_host_metadata(host, metadata_namespace, inherited=True):
     else:
         meta[metadata_namespace + "groups"] = 'ungrouped'
 
-    host_vars = get_host_variables(host, inherited=inherited)
-    for key, value in host_vars.items():
-        meta[metadata_namespace + key] = str(value)
+    host_vars = dict(get_host_variables(host, inherited=inherited))
     # Update "ansible_private_key_file" metadata
     if "ansible_private_key_file" in host_vars:
         key_name = os.path.basename(host_vars["ansible_private_key_file"])
     else:
         key_name = host_vars.get("openstack_keypair_id")
     if key_name:
-        meta[metadata_namespace + "ansible_private_key_file"] = key_name
+        host_vars["ansible_private_key_file"] = key_name
+    meta.update(mc.encode_variables(host_vars, metadata_namespace, encoding))
     return meta
+
+
+def get_group_hierarchy(inventory, ancestors=None):
+    """Get the members and ancestors of every group of a JSON inventory.
+    Members of a group include the hosts of all its descendant groups.
+    'all' is considered as the ancestor of every other group and contains
+    every host that has hostvars.
+    :param inventory: (dict) inventory in Ansible's dynamic inventory format
+    :param ancestors: (dict) ancestors of the groups of the template, as
+                      computed by template_compiler.compile_template. If
+                      None, the hierarchy of the inventory is walked.
+    :return: (tuple) (members, ancestors) where members maps group names to
+             sets of host names and ancestors maps group names to sets of
+             group names
+    """
+    groups = dict((name, group) for name, group in inventory.items()
+                  if name != "_meta" and isinstance(group, dict))
+    hostvars = inventory.get("_meta", {}).get("hostvars", {})
+
+    if ancestors is None:
+        ancestors = _walk_ancestors(groups)
+    else:
+        # Groups that are not in the template only belong to 'all'
+        ancestors = dict((name, set(ancestors.get(name, ["all"])))
+                         for name in groups)
+    ancestors.setdefault("all", set())
+    ancestors["all"].discard("all")
+
+    members = dict((name, set()) for name in groups)
+    for name, group in groups.items():
+        hosts = group.get("hosts", [])
+        if not hosts:
+            continue
+        members[name].update(hosts)
+        for ancestor in ancestors[name]:
+            members.setdefault(ancestor, set()).update(hosts)
+    members.setdefault("all", set()).update(hostvars)
+    return members, ancestors
+
+
+def _walk_ancestors(groups):
+    "Get the ancestors of groups by walking their children"
+    parents = dict((name, set()) for name in groups)
+    for name, group in groups.items():
+        for child in group.get("children", []):
+            if child in parents:
+                parents[child].add(name)
+
+    ancestors = {}
+
+    def _ancestors(name, path):
+        if name in ancestors:
+            return ancestors[name]
+        result = set()
+        for parent in parents[name]:
+            # Ignore cycles, Ansible will complain about them anyway
+            if parent in path:
+                continue
+            result.add(parent)
+            result.update(_ancestors(parent, path | set([parent])))
+        if name != "all":
+            result.add("all")
+        ancestors[name] = result
+        return result
+
+    for name in groups:
+        _ancestors(name, set([name]))
+    return ancestors
+
+
+def factor_hostvars(inventory, ancestors=None):
+    """Hoist variables shared by all hosts of a group into the group's vars.
+    A variable is moved from the hostvars to a group only if every member of
+    the group has the same value for it, and no other group of these members
+    (except the group's own ancestors, which have a lower precedence) sets
+    a different value. Thus the effective variables of every host are kept.
+    The variables of a group are hoisted together, and only if this reduces
+    the size of the compact JSON inventory.
+    Groups with the most members are factored first.
+    The inventory is modified in place.
+    :param inventory: (dict) inventory in Ansible's dynamic inventory format
+    :param ancestors: (dict) precomputed ancestors of the template groups,
+                      see get_group_hierarchy
+    :return: (dict) statistics: number of hoisted variables, number of
+             removed host variables, number of bytes saved in the compact
+             JSON inventory
+    """
+    stats = {"hoisted_vars": 0, "removed_hostvars": 0, "saved_bytes": 0}
+    hostvars = inventory.get("_meta", {}).get("hostvars", {})
+    members, ancestors = get_group_hierarchy(inventory, ancestors)
+    host_groups = {}
+    for name, hosts in members.items():
+        for host in hosts:
+            host_groups.setdefault(host, set()).add(name)
+
+    for name in sorted(members, key=lambda n: (-len(members[n]), n)):
+        hosts = members[name]
+        if len(hosts) < 2 or not all(h in hostvars for h in hosts):
+            continue
+        hosts = sorted(hosts)
+        common = dict(hostvars[hosts[0]])
+        for host in hosts[1:]:
+            host_vars = hostvars[host]
+            for key in list(common):
+                if key not in host_vars or host_vars[key] != common[key]:
+                    del common[key]
+            if not common:
+                break
+        common = dict((key, value) for key, value in common.items()
+                      if not _has_conflict(inventory, key, value, name, hosts,
+                                           host_groups, ancestors[name]))
+        if not common:
+            continue
+        saved = _hoisting_gain(inventory, name, hosts, common)
+        if saved <= 0:
+            continue
+        group = inventory.setdefault(name, {})
+        group.setdefault("vars", {}).update(common)
+        for host in hosts:
+            for key in common:
+                del hostvars[host][key]
+        stats["hoisted_vars"] += len(common)
+        stats["removed_hostvars"] += len(common) * len(hosts)
+        stats["saved_bytes"] += saved
+
+    return stats
+
+
+def _hoisting_gain(inventory, group_name, hosts, variables):
+    """Number of bytes saved in the compact JSON inventory by moving
+    variables from the hostvars of hosts to the vars of a group."""
+    def item_size(key, value):
+        # "key":value
+        return len(json.dumps({key: value}, separators=(',', ':'))) - 2
+
+    sizes = dict((key, item_size(key, value)) for key, value in variables.items())
+    hostvars = inventory["_meta"]["hostvars"]
+    removed = 0
+    for host in hosts:
+        # Items and their separating commas
+        remaining = len(hostvars[host]) - len(variables)
+        removed += sum(sizes.values()) + len(variables) - (0 if remaining else 1)
+    group = inventory.get(group_name)
+    group_vars = group.get("vars", {}) if group is not None else {}
+    new_keys = [key for key in variables if key not in group_vars]
+    # Replaced values, then new items and their separating commas
+    added = sum(sizes[key] - item_size(key, group_vars[key])
+                for key in variables if key in group_vars)
+    if new_keys:
+        added += sum(sizes[key] for key in new_keys) + len(new_keys) - 1
+        if group_vars:
+            added += 1
+        elif group is None:
+            # ,"name":{"vars":{...}}
+            added += len(json.dumps(group_name)) + len('{"vars":{}}') + 2
+        elif "vars" not in group:
+            # "vars":{...}, with a comma if the group has other keys
+            added += len('"vars":{}') + (1 if group else 0)
+    return removed - added
+
+
+def _has_conflict(inventory, key, value, group_name, hosts, host_groups,
+                  group_ancestors):
+    """Check whether hoisting key=value into a group could be overridden
+    by another group of its members."""
+    checked = set([group_name])
+    for host in hosts:
+        for other in host_groups[host]:
+            if other in checked:
+                continue
+            checked.add(other)
+            if other in group_ancestors:
+                continue
+            other_vars = inventory.get(other, {}).get("vars", {})
+            if key in other_vars and other_vars[key] != value:
+                return True
+    return False
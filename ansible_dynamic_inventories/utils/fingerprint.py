@@ -0,0 +1,123 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Fingerprints of the inventories applied to the platform.
+# The fingerprint of an inventory is the SHA1 of the inventory file and of
+# the configuration, in which the scripts set their options. After a
+# successful update, openstack_push.py and openstack_upload_metadata.py
+# record it in a local file (one entry per script and inventory file). When the next run has the
+# same fingerprint, the platform is assumed to be up to date and the script
+# exits before parsing the inventory or accessing the platform. Changes made
+# on the platform by other means are not detected: use --force.
+# Entries are also keyed by the platform (auth URL, user and tenant), which
+# usually comes from the environment, so that applying an inventory to a
+# platform does not mark it as applied to another one.
+#
+
+import hashlib
+import json
+import os
+import tempfile
+
+
+def inventory_fingerprint(inventory_file, configs):
+    """Get the fingerprint of an inventory.
+    :param inventory_file: (string) inventory file name
+    :param configs: (dict) configuration. Command line options that change
+                    the result of an update must be set in it, e.g. the
+                    no_template option of openstack_push.py.
+    :return: (string) SHA1
+    """
+    digest = hashlib.sha1()
+    with open(inventory_file, "rb") as f:
+        digest.update(f.read())
+    digest.update(json.dumps(configs, sort_keys=True,
+                             default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def platform_identity(configs):
+    """Get the platform the scripts access, resolved as
+    OpenStackClient does: environment variables take precedence over the
+    Authentication section of the configuration.
+    :param configs: (dict) configuration
+    :return: (string) <user>@<tenant>@<auth URL>
+    """
+    authentication = configs.get("Authentication", {})
+
+    def resolve(name):
+        return os.environ.get(name.upper(), authentication.get(name)) or ""
+
+    tenant = resolve("os_tenant_id") or resolve("os_tenant_name")
+    return "%s@%s@%s" % (resolve("os_username"), tenant,
+                         resolve("os_auth_url"))
+
+
+class AppliedRecord(object):
+    "Fingerprints of the inventories applied by the scripts"
+
+    def __init__(self, path):
+        """Read a record file, if it exists.
+        :param path: (string) file name
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                # Corrupted record: every inventory is applied again
+                self.entries = {}
+
+    @staticmethod
+    def get_key(script, inventory_file, configs):
+        """Get the entry of an inventory.
+        :param script: (string) name of the script
+        :param inventory_file: (string) inventory file name
+        :param configs: (dict) configuration, see platform_identity
+        """
+        return "%s:%s:%s" % (script, platform_identity(configs),
+                             os.path.abspath(inventory_file))
+
+    def matches(self, key, fingerprint):
+        "Check whether an inventory was applied with the same fingerprint"
+        return self.entries.get(key) == fingerprint
+
+    def record(self, key, fingerprint):
+        """Record that an inventory was applied. The file is replaced
+        atomically.
+        :param key: (string) see get_key
+        :param fingerprint: (string) see inventory_fingerprint
+        """
+        self.entries[key] = fingerprint
+        self._save()
+
+    def forget(self, key):
+        "Forget an inventory, so that the next run applies it"
+        if self.entries.pop(key, None) is not None:
+            self._save()
+
+    def _save(self):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
@@ -0,0 +1,154 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Changes between two inventories in Ansible's dynamic inventory format.
+# Hosts are compared by their effective groups (groups of the host and their
+# ancestors) and their effective variables (variables of their groups,
+# overridden by deeper groups, then by the host variables), so that the
+# result does not depend on where a variable is defined, e.g. after
+# factoring hostvars into group vars.
+#
+
+from ansible_dynamic_inventories.utils.ansible_utils import get_group_hierarchy
+
+# Ansible pattern that matches no host
+NO_HOSTS_PATTERN = "!all"
+
+
+def _host_groups(members):
+    "Invert the members of the groups: host name to set of group names"
+    host_groups = {}
+    for name, hosts in members.items():
+        for host in hosts:
+            host_groups.setdefault(host, set()).add(name)
+    return host_groups
+
+
+def effective_hosts(inventory):
+    """Get the effective groups and variables of the hosts of an inventory.
+    :param inventory: (dict) inventory in Ansible's dynamic inventory format
+    :return: (dict) host name to (set of group names, dict of variables)
+    """
+    members, ancestors = get_group_hierarchy(inventory)
+    hostvars = inventory.get("_meta", {}).get("hostvars", {})
+    result = {}
+    for host, groups in _host_groups(members).items():
+        variables = {}
+        # Deeper groups override their ancestors, as in Ansible
+        for name in sorted(groups, key=lambda g: (len(ancestors.get(g, ())), g)):
+            group = inventory.get(name)
+            if isinstance(group, dict):
+                variables.update(group.get("vars") or {})
+        variables.update(hostvars.get(host) or {})
+        result[host] = (groups, variables)
+    return result
+
+
+def diff_variables(old, new):
+    """Compare two sets of variables.
+    :return: (dict) added and removed variables with their value, changed
+             variables with their old and new values. None if no change.
+    """
+    added = dict((k, v) for k, v in new.items() if k not in old)
+    removed = dict((k, v) for k, v in old.items() if k not in new)
+    changed = dict((k, {"old": old[k], "new": new[k]}) for k in new
+                   if k in old and old[k] != new[k])
+    if not (added or removed or changed):
+        return None
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def diff_inventories(old, new):
+    """Compute the changes between two inventories.
+    :param old: (dict) previous inventory, empty if there is none
+    :param new: (dict) current inventory
+    :return: (dict) JSON-serializable changes:
+             added_hosts, removed_hosts: sorted lists of host names
+             groups: group name to its added_hosts and removed_hosts, for
+                     the groups whose members changed ('all' excluded)
+             hostvars: host name to its variable changes (see
+                       diff_variables), for the hosts kept
+             changed_hosts: sorted list of the hosts of the current inventory
+                            that were added, or whose groups or variables
+                            changed
+    """
+    old_hosts = effective_hosts(old)
+    new_hosts = effective_hosts(new)
+    added_hosts = set(new_hosts) - set(old_hosts)
+    removed_hosts = set(old_hosts) - set(new_hosts)
+    changed_hosts = set(added_hosts)
+
+    groups = {}
+    hostvars = {}
+    for host in set(old_hosts) | set(new_hosts):
+        old_groups, old_vars = old_hosts.get(host, (set(), {}))
+        new_groups, new_vars = new_hosts.get(host, (set(), {}))
+        for name in new_groups - old_groups - set(["all"]):
+            groups.setdefault(name, {"added_hosts": [], "removed_hosts": []})
+            groups[name]["added_hosts"].append(host)
+        for name in old_groups - new_groups - set(["all"]):
+            groups.setdefault(name, {"added_hosts": [], "removed_hosts": []})
+            groups[name]["removed_hosts"].append(host)
+        if host in added_hosts or host in removed_hosts:
+            continue
+        if old_groups != new_groups:
+            changed_hosts.add(host)
+        changes = diff_variables(old_vars, new_vars)
+        if changes:
+            hostvars[host] = changes
+            changed_hosts.add(host)
+    for group in groups.values():
+        group["added_hosts"].sort()
+        group["removed_hosts"].sort()
+
+    return {"added_hosts": sorted(added_hosts),
+            "removed_hosts": sorted(removed_hosts),
+            "groups": groups,
+            "hostvars": hostvars,
+            "changed_hosts": sorted(changed_hosts)}
+
+
+def limit_pattern(hosts):
+    """Get an Ansible --limit pattern matching a list of hosts.
+    An empty limit would match every host, so NO_HOSTS_PATTERN is returned
+    when the list is empty.
+    :param hosts: list of (string) host names
+    :return: (string) comma-separated host names
+    """
+    if not hosts:
+        return NO_HOSTS_PATTERN
+    return ",".join(sorted(hosts))
+
+
+def restrict_inventory(inventory, hosts):
+    """Get an inventory that only contains some hosts. Groups keep their
+    variables and children.
+    :param inventory: (dict) inventory in Ansible's dynamic inventory format
+    :param hosts: list of (string) host names to keep
+    :return: (dict) new inventory
+    """
+    hosts = set(hosts)
+    result = {}
+    for name, group in inventory.items():
+        if name == "_meta" or not isinstance(group, dict):
+            continue
+        group = dict(group)
+        if "hosts" in group:
+            group["hosts"] = [h for h in group["hosts"] if h in hosts]
+        result[name] = group
+    hostvars = inventory.get("_meta", {}).get("hostvars", {})
+    result["_meta"] = {"hostvars": dict((h, v) for h, v in hostvars.items()
+                                        if h in hosts)}
+    return result
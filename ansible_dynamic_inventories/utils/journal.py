@@ -0,0 +1,188 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Write-ahead journal of the application of a plan.
+# The journal is a JSON-lines file. The first record contains the plan, then
+# every step is recorded before it is executed ("started") and after
+# ("done" with the ID of the resource, or "failed" with the error). The
+# last record marks the plan as "complete".
+# If the application is interrupted, the journal keeps the plan and the
+# outcome of its steps, so that a new run can resume it.
+#
+
+import hashlib
+import json
+import os
+import time
+
+STARTED = "started"
+DONE = "done"
+FAILED = "failed"
+
+
+class JournalError(Exception):
+    pass
+
+
+def get_plan_id(plan):
+    """Get an identifier of the steps of a plan.
+    :param plan: (dict) plan
+    :return: (string) SHA1 of the steps
+    """
+    content = json.dumps(plan["steps"], sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+class ApplyJournal(object):
+    "Journal of the application of a plan"
+
+    def __init__(self, path):
+        """Read a journal file, if it exists.
+        :param path: (string) file name
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.plan = None
+        self.plan_id = None
+        self.complete = False
+        self.steps = {}
+        self._file = None
+        if os.path.exists(self.path):
+            self._read()
+
+    def _read(self):
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Record partially written before a crash
+                    continue
+                if record["type"] == "plan":
+                    self.plan = record["plan"]
+                    self.plan_id = record["plan_id"]
+                    self.complete = False
+                    self.steps = {}
+                elif record["type"] == "step":
+                    self.steps[record["index"]] = record
+                elif record["type"] == "complete":
+                    self.complete = True
+
+    @property
+    def pending(self):
+        "True if the journal contains a plan that was not completely applied"
+        return self.plan is not None and not self.complete
+
+    def status(self, index):
+        """Get the status of a step.
+        :param index: (int) index of the step in the plan
+        :return: (string) STARTED, DONE, FAILED or None if never started
+        """
+        record = self.steps.get(index)
+        return record["status"] if record else None
+
+    def resource_id(self, index):
+        """Get the ID of the resource created or modified by a done step.
+        :param index: (int) index of the step in the plan
+        """
+        record = self.steps.get(index)
+        return record.get("resource_id") if record else None
+
+    def done_count(self):
+        "Get the number of steps that are done"
+        return len([index for index in self.steps
+                    if self.status(index) == DONE])
+
+    def begin(self, plan):
+        """Start recording the application of a plan, or resume it if the
+        journal contains the same unfinished plan.
+        :param plan: (dict) plan
+        :return: (bool) True if the plan is resumed
+        Raise JournalError if the journal contains another unfinished plan.
+        """
+        plan_id = get_plan_id(plan)
+        if self.pending:
+            if self.plan_id != plan_id:
+                raise JournalError("Journal %s contains another unfinished "
+                                   "plan" % self.path)
+            self._file = open(self.path, "a+")
+            # Terminate a record partially written before a crash
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() > 0:
+                self._file.seek(-1, os.SEEK_END)
+                if self._file.read(1) != "\n":
+                    self._file.write("\n")
+            return True
+        self.plan = plan
+        self.plan_id = plan_id
+        self.complete = False
+        self.steps = {}
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self._file = open(self.path, "w")
+        self._write({"type": "plan", "plan_id": plan_id, "plan": plan})
+        return False
+
+    def _write(self, record):
+        record["time"] = time.time()
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _record_step(self, index, status, **kwargs):
+        record = {"type": "step", "index": index, "status": status,
+                  "action": self.plan["steps"][index]["action"]}
+        record.update(kwargs)
+        self._write(record)
+        self.steps[index] = record
+
+    def start(self, index, **kwargs):
+        """Record that a step is about to be executed
+        :param kwargs: information needed to recover the step
+        """
+        self._record_step(index, STARTED, **kwargs)
+
+    def done(self, index, resource_id=None):
+        "Record that a step succeeded"
+        self._record_step(index, DONE, resource_id=resource_id)
+
+    def fail(self, index, error, **kwargs):
+        """Record that a step failed
+        :param kwargs: information needed to recover the step
+        """
+        self._record_step(index, FAILED, error=str(error), **kwargs)
+
+    def finish(self):
+        "Record that all the steps of the plan are done"
+        self._write({"type": "complete"})
+        self.complete = True
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        "Remove the journal file"
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.plan = None
+        self.plan_id = None
+        self.complete = False
+        self.steps = {}
@@ -0,0 +1,169 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Encoding of host variables in VM metadata.
+# Two encodings are supported:
+#   plain:  one metadata item per variable, <namespace><variable>=str(value)
+#   packed: all variables in a single JSON document, compressed, base64
+#           encoded and split in chunks that fit in metadata values:
+#             <namespace>__packed__=<version>:<number of chunks>
+#             <namespace>__packed__0=<chunk 0>
+#             ...
+#           Values keep their types (numbers, lists, dicts...).
+# In both encodings, the groups of the host are stored in a plain
+# <namespace>groups item, so that VMs of a namespace can be recognized
+# without decoding their variables.
+# A <namespace>__digest__ item holds the SHA1 of the other items of the
+# namespace and of the volumes of the host. Comparing it is enough to know
+# whether the metadata of a VM are up to date.
+#
+
+import base64
+import hashlib
+import json
+import zlib
+
+PLAIN = "plain"
+PACKED = "packed"
+METADATA_ENCODINGS = (PLAIN, PACKED)
+
+PACKED_KEY = "__packed__"
+PACKED_VERSION = 1
+DIGEST_KEY = "__digest__"
+# Maximum length of a Nova metadata value
+CHUNK_SIZE = 255
+
+
+class MetadataDecodingError(Exception):
+    pass
+
+
+def pack_variables(variables, namespace):
+    """Encode variables in packed metadata items.
+    :param variables: (dict) variables
+    :param namespace: (string) metadata namespace
+    :return: (dict) metadata items
+    """
+    document = json.dumps(variables, sort_keys=True, separators=(',', ':'),
+                          default=str)
+    data = base64.b64encode(zlib.compress(document.encode("utf-8"), 9))
+    data = data.decode("ascii")
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    meta = {namespace + PACKED_KEY: "%d:%d" % (PACKED_VERSION, len(chunks))}
+    for index, chunk in enumerate(chunks):
+        meta["%s%s%d" % (namespace, PACKED_KEY, index)] = chunk
+    return meta
+
+
+def is_packed(metadata, namespace):
+    "Check whether metadata contain packed variables"
+    return namespace + PACKED_KEY in metadata
+
+
+def unpack_variables(metadata, namespace):
+    """Decode the packed variables of metadata.
+    :param metadata: (dict) metadata items
+    :param namespace: (string) metadata namespace
+    :return: (dict) variables, None if metadata contain no packed variables
+    Raise MetadataDecodingError if the packed variables are corrupted.
+    """
+    header = metadata.get(namespace + PACKED_KEY)
+    if header is None:
+        return None
+    try:
+        version, count = [int(x) for x in header.split(":")]
+    except ValueError:
+        raise MetadataDecodingError("Invalid packed metadata header: %s" % header)
+    if version != PACKED_VERSION:
+        raise MetadataDecodingError("Unsupported packed metadata version: %d" %
+                                    version)
+    try:
+        data = "".join(metadata["%s%s%d" % (namespace, PACKED_KEY, index)]
+                       for index in range(count))
+        document = zlib.decompress(base64.b64decode(data)).decode("utf-8")
+        return json.loads(document)
+    except (KeyError, TypeError, ValueError, zlib.error) as e:
+        raise MetadataDecodingError("Corrupted packed metadata: %s" % e)
+
+
+def get_metadata_variables(metadata, namespace):
+    """Get the variables stored in metadata, in plain or packed encoding.
+    Packed variables take precedence over plain items.
+    :param metadata: (dict) metadata items of a VM
+    :param namespace: (string) metadata namespace
+    :return: (dict) variables, without the groups item
+    """
+    variables = {}
+    group_key = namespace + "groups"
+    digest_key = namespace + DIGEST_KEY
+    packed_prefix = namespace + PACKED_KEY
+    for key, value in metadata.items():
+        if (key.startswith(namespace) and key not in (group_key, digest_key) and
+                not key.startswith(packed_prefix)):
+            variables[key[len(namespace):]] = value
+    packed = unpack_variables(metadata, namespace)
+    if packed:
+        variables.update(packed)
+    return variables
+
+
+def encode_variables(variables, namespace, encoding=PLAIN):
+    """Encode variables in metadata items.
+    :param variables: (dict) variables
+    :param namespace: (string) metadata namespace
+    :param encoding: (string) PLAIN or PACKED
+    :return: (dict) metadata items
+    """
+    if encoding == PACKED:
+        return pack_variables(variables, namespace)
+    if encoding != PLAIN:
+        raise ValueError("Unknown metadata encoding '%s', must be one of: %s" %
+                         (encoding, ', '.join(METADATA_ENCODINGS)))
+    return dict((namespace + key, str(value)) for key, value in variables.items())
+
+
+def metadata_digest(metadata, namespace, volumes=()):
+    """Compute the digest of the metadata of a host.
+    :param metadata: (dict) metadata items. The digest item is ignored.
+    :param namespace: (string) metadata namespace
+    :param volumes: list of (device, size, volume type) of the host
+    :return: (string) SHA1
+    """
+    digest_key = namespace + DIGEST_KEY
+    items = dict((key, value) for key, value in metadata.items()
+                 if key.startswith(namespace) and key != digest_key)
+    document = json.dumps([items, sorted(volumes)], sort_keys=True,
+                          separators=(',', ':'), default=str)
+    return hashlib.sha1(document.encode("utf-8")).hexdigest()
+
+
+def add_digest(metadata, namespace, volumes=()):
+    """Add the digest item to the metadata of a host.
+    :param metadata: (dict) metadata items, modified
+    :param namespace: (string) metadata namespace
+    :param volumes: see metadata_digest
+    :return: (dict) metadata
+    """
+    metadata[namespace + DIGEST_KEY] = metadata_digest(metadata, namespace,
+                                                       volumes)
+    return metadata
+
+
+def same_digest(metadata, other, namespace):
+    """Check whether two sets of metadata items have the same digest item.
+    :return: (bool) False if one of them has no digest
+    """
+    digest = metadata.get(namespace + DIGEST_KEY)
+    return digest is not None and digest == other.get(namespace + DIGEST_KEY)
@@ -0,0 +1,354 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Nova and Cinder notifications.
+# Notifications are read from a source, then applied to a PlatformModel:
+#   compute.instance.* / instance.*: VM created, updated (state, metadata...)
+#                                    or deleted
+#   volume.*:                        volume created, attached, detached,
+#                                    updated or deleted
+# ".start" and ".error" notifications are ignored, the change is applied
+# when it is done.
+# Both the legacy and the versioned ("nova_object.data") payloads are
+# understood, wrapped or not in an oslo.messaging envelope.
+#
+# Sources:
+#   file:  JSON notifications, one per line, appended to a file (e.g. by the
+#          "log" driver of oslo.messaging). The file is followed like
+#          'tail -F'.
+# Other sources, subclasses of NotificationSource, can be added with
+# register_source().
+#
+
+import io
+import json
+import os
+import time
+
+INSTANCE_PREFIXES = ("compute.instance.", "instance.")
+VOLUME_PREFIX = "volume."
+IGNORED_SUFFIXES = (".start", ".error")
+
+
+class NotificationError(Exception):
+    pass
+
+
+class NotificationSource(object):
+    "Source of notifications, base class of the sources of get_source()"
+
+    def poll(self, timeout):
+        """Wait for notifications.
+        :param timeout: (float) maximum time to wait, in seconds
+        :return: list of notifications (dict or JSON string), empty if none
+                 arrived before the timeout
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class FileNotificationSource(NotificationSource):
+    "Notifications appended to a file, one JSON document per line"
+
+    def __init__(self, path, from_start=False):
+        """
+        :param path: (string) file name
+        :param from_start: (bool) read the notifications already in the
+                           file. By default, only new ones are read.
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self._file = None
+        self._inode = None
+        self._buffer = b""
+        self._from_start = from_start
+
+    def _open(self):
+        try:
+            # Not a stdio file, whose end of file can be sticky
+            f = io.open(self.path, "rb")
+        except IOError:
+            return False
+        if self._file is not None:
+            self._file.close()
+        self._file = f
+        self._inode = os.fstat(f.fileno()).st_ino
+        self._buffer = b""
+        if not self._from_start:
+            f.seek(0, os.SEEK_END)
+        # Files created or rotated later are read from their beginning
+        self._from_start = True
+        return True
+
+    def _rotated(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_ino != self._inode or
+                stat.st_size < self._file.tell())
+
+    def _read(self):
+        data = self._file.read()
+        if not data:
+            return []
+        lines = (self._buffer + data).split(b"\n")
+        # The last line may be partially written
+        self._buffer = lines.pop()
+        return [line.decode("utf-8") for line in lines if line.strip()]
+
+    def poll(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            if self._file is None:
+                self._open()
+            if self._file is not None:
+                notifications = self._read()
+                if not notifications and self._rotated():
+                    self._open()
+                    notifications = self._read()
+                if notifications:
+                    return notifications
+            if time.time() >= deadline:
+                return []
+            time.sleep(min(0.2, max(0, deadline - time.time())))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+SOURCES = {"file": FileNotificationSource}
+
+
+def register_source(scheme, factory):
+    """Make a source available to get_source().
+    :param scheme: (string) scheme of the source URLs
+    :param factory: callable taking the rest of the URL and returning a
+                    NotificationSource
+    """
+    SOURCES[scheme] = factory
+
+
+def get_source(url):
+    """Create a source from an URL "<scheme>:<location>", e.g.
+    file:/var/log/nova/notifications.log. A URL without scheme is a file.
+    :return: (NotificationSource)
+    """
+    scheme, sep, location = url.partition(":")
+    if not sep or scheme not in SOURCES:
+        scheme, location = "file", url
+    if location.startswith("//"):
+        location = location[2:]
+    return SOURCES[scheme](location)
+
+
+def parse_notification(notification):
+    """Get the event type and the payload of a notification.
+    :param notification: (dict or string) notification, possibly in an
+                         oslo.messaging envelope
+    :return: (tuple) (event_type, payload)
+    Raise NotificationError if the notification cannot be decoded.
+    """
+    try:
+        if not isinstance(notification, dict):
+            notification = json.loads(notification)
+        if "oslo.message" in notification:
+            notification = json.loads(notification["oslo.message"])
+    except (TypeError, ValueError) as e:
+        raise NotificationError("Invalid notification: %s" % e)
+    if not isinstance(notification, dict):
+        raise NotificationError("Invalid notification: %r" % notification)
+    return notification.get("event_type") or "", notification.get("payload") or {}
+
+
+def _object_data(value):
+    "Data of a versioned notification object"
+    if isinstance(value, dict) and "nova_object.data" in value:
+        return value["nova_object.data"]
+    return value
+
+
+def instance_from_payload(payload):
+    """Get the fields of a VM from an instance notification.
+    :param payload: (dict) payload of the notification
+    :return: (dict) fields of openstack_utils.server_info found in the
+             payload, the ID included
+    """
+    data = _object_data(payload)
+    fields = {"id": data.get("uuid") or data.get("instance_id")}
+    if data.get("display_name") is not None:
+        fields["name"] = data["display_name"]
+    if data.get("state") is not None:
+        fields["status"] = data["state"].upper()
+    if data.get("key_name") is not None:
+        fields["key_name"] = data["key_name"]
+    if isinstance(data.get("metadata"), dict):
+        fields["metadata"] = data["metadata"]
+    addresses = data.get("ip_addresses", data.get("fixed_ips"))
+    if addresses is not None:
+        networks = {}
+        for address in addresses:
+            address = _object_data(address)
+            networks.setdefault(address.get("label"), []).append(
+                address.get("address"))
+        fields["networks"] = networks
+    return fields
+
+
+def volume_from_payload(payload):
+    """Get the fields of a volume from a volume notification.
+    :param payload: (dict) payload of the notification
+    :return: (dict) fields of openstack_utils.volume_info found in the
+             payload, the ID included
+    """
+    fields = {"id": payload.get("volume_id") or payload.get("id")}
+    name = payload.get("display_name", payload.get("name"))
+    if name is not None:
+        fields["name"] = name
+    for key in ("size", "volume_type"):
+        if payload.get(key) is not None:
+            fields[key] = payload[key]
+    metadata = payload.get("metadata")
+    if isinstance(metadata, list):
+        # Cinder sends the metadata items as a list
+        metadata = dict((item["key"], item["value"]) for item in metadata)
+    if isinstance(metadata, dict):
+        fields["metadata"] = metadata
+    if "volume_attachment" in payload:
+        fields["attachments"] = [
+            {"server_id": a.get("instance_uuid", a.get("server_id")),
+             "device": a.get("mountpoint", a.get("device"))}
+            for a in payload["volume_attachment"] or []
+            if a.get("attach_status", "attached") == "attached"]
+    return fields
+
+
+def notification_resource(notification):
+    """Get the resource concerned by a notification, e.g. to fetch it again
+    when the notification cannot be applied.
+    :param notification: (dict or string) notification
+    :return: (tuple) ("server" or "volume", ID), None if unknown
+    """
+    try:
+        event_type, payload = parse_notification(notification)
+        if event_type.startswith(VOLUME_PREFIX):
+            resource = ("volume", payload.get("volume_id") or payload.get("id"))
+        elif event_type.startswith(INSTANCE_PREFIXES):
+            data = _object_data(payload)
+            resource = ("server", data.get("uuid") or data.get("instance_id"))
+        else:
+            return None
+    except (NotificationError, AttributeError):
+        return None
+    return resource if resource[1] else None
+
+
+def apply_instance_notification(platform, event_type, payload,
+                                fetch_server=None):
+    """Apply an instance notification to a platform model.
+    :param platform: (PlatformModel)
+    :param event_type: (string) type of the notification
+    :param payload: (dict) payload of the notification
+    :param fetch_server: function returning the server_info of a VM from
+                         its ID, used when a notification does not contain
+                         all the fields of an unknown VM
+    :return: (bool) True if the model changed
+    """
+    fields = instance_from_payload(payload)
+    vm_id = fields["id"]
+    if not vm_id:
+        return False
+    if ".delete." in event_type or fields.get("status") in ("DELETED",
+                                                            "SOFT_DELETED"):
+        return platform.remove_vm(vm_id) is not None
+    vm = platform.get_vm(vm_id)
+    if vm is not None:
+        server = {"id": vm.id, "name": vm.name, "status": vm.status,
+                  "key_name": vm.key_name, "networks": vm.networks,
+                  "metadata": vm.metadata}
+    elif platform.namespace + "groups" not in fields.get("metadata", {}):
+        # Not a VM of the namespace
+        return False
+    elif fetch_server is not None and ("name" not in fields or
+                                       "key_name" not in fields or
+                                       "networks" not in fields):
+        server = fetch_server(vm_id)
+        if server is None:
+            return False
+    else:
+        server = {"id": vm_id, "name": None, "status": None,
+                  "key_name": None, "networks": {}, "metadata": {}}
+    server.update(fields)
+    if not server["name"]:
+        return False
+    new_vm = platform.add_vm(**server)
+    if vm is None:
+        return new_vm is not None
+    return (new_vm is None or
+            (new_vm.name, new_vm.status, new_vm.key_name, new_vm.networks,
+             new_vm.metadata) !=
+            (vm.name, vm.status, vm.key_name, vm.networks, vm.metadata))
+
+
+def apply_volume_notification(platform, event_type, payload):
+    """Apply a volume notification to a platform model.
+    :param platform: (PlatformModel)
+    :param event_type: (string) type of the notification
+    :param payload: (dict) payload of the notification
+    :return: (bool) True if the model changed
+    """
+    fields = volume_from_payload(payload)
+    volume_id = fields["id"]
+    if not volume_id:
+        return False
+    vol = platform.get_volume(volume_id)
+    if ".delete." in event_type or payload.get("status") == "deleted":
+        return platform.remove_volume(volume_id) is not None
+    info = {"id": volume_id, "name": None, "metadata": {}, "size": None,
+            "volume_type": None, "attachments": []}
+    if vol is not None:
+        ns = platform.namespace
+        info.update({"name": vol.name, "size": vol.size,
+                     "volume_type": vol.volume_type,
+                     "attachments": list(vol.attachments)})
+        if vol.host is not None:
+            info["metadata"][ns + "host"] = vol.host
+        if vol.device is not None:
+            info["metadata"][ns + "device"] = vol.device
+    info.update(fields)
+    platform.remove_volume(volume_id)
+    return platform.add_volume_info(**info) is not None or vol is not None
+
+
+def apply_notification(platform, notification, fetch_server=None):
+    """Apply a notification to a platform model.
+    :param platform: (PlatformModel)
+    :param notification: (dict or string) notification
+    :param fetch_server: see apply_instance_notification
+    :return: (bool) True if the model changed
+    Raise NotificationError if the notification cannot be decoded.
+    """
+    event_type, payload = parse_notification(notification)
+    if event_type.endswith(IGNORED_SUFFIXES):
+        return False
+    if event_type.startswith(VOLUME_PREFIX):
+        return apply_volume_notification(platform, event_type, payload)
+    if event_type.startswith(INSTANCE_PREFIXES):
+        return apply_instance_notification(platform, event_type, payload,
+                                           fetch_server)
+    return False
@@ -26,15 +26,143 @@
 #
 
 import os
+import re
+import socket
+import sys
+import threading
 from time import sleep
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
 
 from cinderclient import client as cclient
 from novaclient import client as nclient
 
 from ansible_dynamic_inventories.utils import *
-from ansible_dynamic_inventories.utils import ansible_utils as au
+from ansible_dynamic_inventories.utils.parse import to_bool
 
-OPENSTACK_VOLUME_PREFIX = "openstack_volume"
+UUID_RE = re.compile(r'^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?'
+                     r'[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$')
+
+
+def is_uuid(value):
+    "Check whether a string is an UUID"
+    return bool(UUID_RE.match(value or ''))
+
+
+def is_ip(value):
+    "Check whether a string is an IPv4 or IPv6 address"
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, value or '')
+            return True
+        except (socket.error, ValueError):
+            pass
+    return False
+
+
+def server_info(data):
+    """Extract the fields used by the scripts from a server of the Nova API.
+    :param data: (dict) server, as decoded from the API response
+    :return: (dict) id, name, status, key_name, networks (network label to
+             list of addresses) and metadata
+    """
+    return {"id": data["id"],
+            "name": data["name"],
+            "status": data.get("status"),
+            "key_name": data.get("key_name"),
+            "networks": dict((label, [a["addr"] for a in addresses])
+                             for label, addresses in
+                             (data.get("addresses") or {}).items()),
+            "metadata": data.get("metadata") or {}}
+
+
+def volume_info(data):
+    """Extract the fields used by the scripts from a volume of the Cinder API.
+    :param data: (dict) volume, as decoded from the API response
+    :return: (dict) id, name, metadata, size, volume_type and attachments
+             (list of dicts with server_id and device)
+    """
+    return {"id": data["id"],
+            # Cinder v1 API
+            "name": data.get("name", data.get("display_name")),
+            "metadata": data.get("metadata") or {},
+            "size": data.get("size"),
+            "volume_type": data.get("volume_type"),
+            "attachments": [{"server_id": a.get("server_id"),
+                             "device": a.get("device")}
+                            for a in data.get("attachments") or []]}
+
+
+def raw_list(http_client, path, key, params=None):
+    """List resources with a GET on the API, without building novaclient or
+    cinderclient objects. Pages are followed until the last one.
+    :param http_client: HTTP client of novaclient or cinderclient
+    :param path: (string) URL of the listing, e.g. /servers/detail
+    :param key: (string) key of the resources in the response, e.g. servers
+    :param params: (dict) query parameters
+    :return: generator of (dict) resources, as decoded from the responses
+    """
+    params = dict((k, v) for k, v in (params or {}).items() if v is not None)
+    while True:
+        query = urlencode(sorted(params.items()))
+        _, body = http_client.get(path + ("?" + query if query else ""))
+        items = body.get(key) or []
+        for item in items:
+            yield item
+        # The API truncates long listings and adds a link to the next page
+        next_links = [link for link in body.get(key + "_links") or []
+                      if link.get("rel") == "next"]
+        if not items or not next_links:
+            break
+        params["marker"] = items[-1]["id"]
+
+
+# Maximum number of concurrent API requests of run_concurrently, so that
+# the platform does not throttle the scripts
+MAX_WORKERS = 8
+
+
+def run_concurrently(calls, max_workers=MAX_WORKERS):
+    """Execute functions in parallel threads and wait for all of them.
+    With enough workers, the time taken is the one of the slowest function.
+    :param calls: list of functions without arguments
+    :param max_workers: (int) maximum number of functions executed at once
+    :return: list of the results of the functions, in the same order
+    Raise the first exception raised by a function, once all are finished.
+    """
+    results = [None] * len(calls)
+    errors = [None] * len(calls)
+    pending = iter(enumerate(calls))
+    lock = threading.Lock()
+
+    def run():
+        while True:
+            with lock:
+                try:
+                    index, call = next(pending)
+                except StopIteration:
+                    return
+            try:
+                results[index] = call()
+            except BaseException:
+                errors[index] = sys.exc_info()
+
+    threads = [threading.Thread(target=run)
+               for _ in range(min(max_workers, len(calls)))]
+    for thread in threads:
+        # Do not keep the script alive on an interruption
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # A join with a timeout can be interrupted by Ctrl-C
+        while thread.is_alive():
+            thread.join(1)
+    for error in errors:
+        if error is not None:
+            raise error[1]
+    return results
 
 
 class ConfigError(Exception):
@@ -49,13 +177,6 @@ class VolumeDeletingError(Exception):
     pass
 
 
-class OpenStackVolume(object):
-    def __init__(self, volume_id, host, device):
-        self.volume_id = volume_id
-        self.host = host
-        self.device = device
-
-
 class OpenStackClient(object):
     "Class for interact with OpenStack platform"
 
@@ -67,6 +188,8 @@ class OpenStackClient(object):
         self._validate_config()
         self.nova = None
         self.cinder = None
+        # List servers and volumes from the API responses directly
+        self.raw_listing = to_bool(configs.get("Default", {}).get("raw_listing"))
 
     def _validate_config(self):
         "Validate configs. Update configs with environment variables."
@@ -133,111 +256,218 @@ class OpenStackClient(object):
         self.nova.authenticate()
         self.cinder.authenticate()
 
-    def create_vm(self, host, metadata_namespace=DEFAULT_METADATA_NAMESPACE,
-                  inherited=True):
-        """Create a VM on an OpenStack platform based on an Ansible inventory host
-        :param host: ansible.inventory.host.Host object
-        :param inherited: (bool)(default) True if no template is used, all
-                          inherited groups and variables will be stored in
-                          host's metadata
-                          False if a template is used, only host-specific
-                          groups and variables will be stored in hosts' metadata
-        :param return: new VM
+    def list_servers(self, search_opts=None):
+        """List the servers of the platform.
+        :param search_opts: (dict) filters, e.g. {"changes-since": date}
+        :return: list of (dict), see server_info
         """
-        host_vars = au.get_host_variables(host, inherited=True)
-        if ("openstack_image_id" not in host_vars):
-            raise Exception("ERROR: openstack_image_id is defined")
-        if ("openstack_flavor_id" not in host_vars):
-            raise Exception("ERROR: openstack_image_id is not defined")
-        if ("openstack_network_id" not in host_vars):
-            raise Exception("ERROR: openstack_network_id is not defined")
-    
-        # Get network ID
-        # TODO: optimize this part to avoid multiple calls to OpenStack
-        net_id = ''
-        net_list = self.nova.networks.list()
-        for net in net_list:
-            if (net.id == host_vars["openstack_network_id"] or 
-                net.label == host_vars["openstack_network_id"]):
-                net_id = net.id
-                break
-        if not net_id:
-            raise Exception("Network '%s' does not exists" %
-                             host_vars["openstack_network_id"])
-    
-        name = host.name
-        image = host_vars["openstack_image_id"]
-        flavor = host_vars["openstack_flavor_id"]
-        nics = [{"net-id": net_id,
-                 "v4-fixed-ip": host.address}]
-        security_groups = host_vars.get("openstack_security_groups")
-        if security_groups:
-            security_groups = security_groups.split(",")
-        if "ansible_private_key_file" in host_vars:
-            key_name = os.path.basename(host_vars["ansible_private_key_file"])
+        if self.raw_listing:
+            servers = raw_list(self.nova.client, "/servers/detail", "servers",
+                               search_opts)
         else:
-            key_name = host_vars.get("openstack_keypair_id")
-        meta = au.create_host_metadata(host, metadata_namespace)
+            servers = (s._info for s in
+                       self.nova.servers.list(search_opts=search_opts))
+        return [server_info(s) for s in servers]
+
+    def list_volumes(self):
+        """List the volumes of the platform.
+        :return: list of (dict), see volume_info
+        """
+        if self.raw_listing:
+            volumes = raw_list(self.cinder.client, "/volumes/detail", "volumes")
+        else:
+            volumes = (v._info for v in self.cinder.volumes.list())
+        return [volume_info(v) for v in volumes]
+
+    def list_networks(self):
+        """List the networks of the platform.
+        :return: list of (dict) with id and label
+        """
+        return [{"id": net.id, "label": net.label}
+                for net in self.nova.networks.list()]
+
+    def find_network(self, network):
+        """Get the ID of a network from its ID or label.
+        :param network: (string) ID or label of the network
+        :return: (string) network ID
+        Raise Exception if the network does not exist.
+        """
+        for net in self.nova.networks.list():
+            if net.id == network or net.label == network:
+                return net.id
+        raise Exception("Network '%s' does not exists" % network)
+
+    def boot_vm(self, step):
+        """Create a VM from a create_vm step of a plan.
+        :param step: (dict) create_vm step, see utils.planner
+        :return: (novaclient.v2.servers.Server) new VM
+        """
+        network = step["network"]
+        if not is_uuid(network):
+            network = self.find_network(network)
+        nics = [{"net-id": network, "v4-fixed-ip": step["fixed_ip"]}]
         print("Create VM: name=%-10s flavor=%-6s image=%-20s key_name=%-10s "
               "security_groups=%s nics=%s metadata=%s\n" %
-              (name, flavor, image, key_name, security_groups, nics, meta))
-        self.nova.servers.create(name, image, flavor, meta=meta,
-                                 security_groups=security_groups,
-                                 key_name=key_name, nics=nics)
+              (step["name"], step["flavor"], step["image"], step["key_name"],
+               step["security_groups"], nics, step["metadata"]))
+        return self.nova.servers.create(step["name"], step["image"],
+                                        step["flavor"], meta=step["metadata"],
+                                        security_groups=step["security_groups"],
+                                        key_name=step["key_name"], nics=nics)
+
+    def get_server(self, vm_id):
+        """Get a server by its ID.
+        :param vm_id: (string) ID of the server
+        :return: (dict) see server_info, None if the server does not exist
+        """
+        try:
+            return server_info(self.nova.servers.get(vm_id)._info)
+        except nclient.exceptions.NotFound:
+            return None
+
+    def boot_vms(self, steps, batch_name):
+        """Create the VMs of several create_vm steps with a single
+        multi-create request. The steps must have the same image, flavor,
+        network, key and security groups, and no fixed IP: Nova cannot give
+        its own fixed IP to each VM of a multi-create request.
+        The VMs are booted with temporary names starting with batch_name.
+        Then each VM gets the metadata and finally the name of a host.
+        :param steps: list of (dict) create_vm steps, see utils.planner
+        :param batch_name: (string) prefix of the temporary names
+        The VMs are not waited for: as with boot_vm, a VM that fails later
+        keeps the name and metadata of its host.
+        :return: (dict) host name to VM ID. Hosts without a VM, if Nova
+                 listed fewer VMs than requested, are missing and must be
+                 booted again by the caller.
+        """
+        if any(is_ip(step["fixed_ip"]) for step in steps):
+            raise ValueError("VMs with a fixed IP cannot be booted with a "
+                             "multi-create request")
+        first = steps[0]
+        network = first["network"]
+        if not is_uuid(network):
+            network = self.find_network(network)
+        count = len(steps)
+        print("Create %d VMs: names=%s flavor=%-6s image=%-20s key_name=%-10s "
+              "security_groups=%s network=%s\n" %
+              (count, ','.join(step["name"] for step in steps), first["flavor"],
+               first["image"], first["key_name"], first["security_groups"],
+               network))
+        reservation_id = self.nova.servers.create(
+            batch_name, first["image"], first["flavor"],
+            security_groups=first["security_groups"],
+            key_name=first["key_name"], nics=[{"net-id": network}],
+            min_count=count, max_count=count, reservation_id=True)
+        servers = self.nova.servers.list(
+            search_opts={"reservation_id": reservation_id})
+        booted = list(servers)
+        if len(booted) < count:
+            print("Warning: %d of %d VMs of %s were not booted, their hosts "
+                  "are booted one by one" % (count - len(booted), count,
+                                             batch_name))
+        # The VMs were booted with the same parameters: any of them can be
+        # used for any host
+        booted.sort(key=lambda server: server.id)
+        vm_ids = {}
+        for step, server in zip(steps, booted):
+            self.nova.servers.set_meta(server, step["metadata"])
+            # Renamed last: a VM with the name of a host is complete
+            self.nova.servers.update(server, name=step["name"])
+            vm_ids[step["name"]] = server.id
+        return vm_ids
+
+    def delete_batch(self, batch_name):
+        """Delete the VMs of an interrupted multi-create request that did not
+        get the name of a host.
+        :param batch_name: (string) prefix of the temporary names
+        """
+        for vm in self.nova.servers.list(
+                search_opts={"name": "^%s" % re.escape(batch_name)}):
+            if vm.name.startswith(batch_name):
+                print("Delete VM %s of an interrupted batch" % vm.name)
+                self.nova.servers.delete(vm)
+
+    def find_server(self, name):
+        """Get a server by its exact name.
+        :param name: (string) name of the server
+        :return: (novaclient.v2.servers.Server) None if not found
+        """
+        for vm in self.nova.servers.list(search_opts={"name": "^%s$" % re.escape(name)}):
+            if vm.name == name:
+                return vm
+        return None
+
+    def server_exists(self, vm_id):
+        "Check whether a server exists"
+        try:
+            self.nova.servers.get(vm_id)
+        except nclient.exceptions.NotFound:
+            return False
+        return True
+
+    def find_volume(self, name):
+        """Get a volume by its name.
+        :param name: (string) name of the volume
+        :return: (cinderclient.v2.volumes.Volume) None if not found
+        """
+        for vol in self.cinder.volumes.list(search_opts={"name": name}):
+            if vol.name == name:
+                return vol
+        return None
+
+    def get_volume(self, volume_id):
+        """Get a volume by its ID.
+        :param volume_id: (string) ID of the volume
+        :return: (dict) see volume_info, None if the volume does not exist
+        """
+        try:
+            return volume_info(self.cinder.volumes.get(volume_id)._info)
+        except cclient.exceptions.NotFound:
+            return None
+
+    def volume_exists(self, volume_id):
+        "Check whether a volume exists"
+        try:
+            self.cinder.volumes.get(volume_id)
+        except cclient.exceptions.NotFound:
+            return False
+        return True
 
-    def delete_vm(self, vm):
+    def delete_vm(self, vm, volume_ids=None):
         """Delete a VM from the OpenStack platform.
         :param vm: (novaclient.v2.servers.Server) server to delete
+        :param volume_ids: list of (string) IDs of the volumes attached to
+                           the VM, if already known. Otherwise they are
+                           asked to the platform.
         """
-        current_attached_volumes = self.nova.volumes.get_server_volumes(vm.id)
+        if volume_ids is None:
+            volume_ids = [volume.volumeId for volume in
+                          self.nova.volumes.get_server_volumes(vm.id)]
         # Detach volumes first. OpenStack detaches volume automatically
         # when deleting VMs, however, this is always better to avoid potential bugs
-        for volume in current_attached_volumes:
+        for volume_id in volume_ids:
             try:
-                print("Detach volume %s from VM %s" % (volume.volumeId, vm.name))
-                self.nova.volumes.delete_server_volume(vm.id, volume.id)
+                print("Detach volume %s from VM %s" % (volume_id, vm.name))
+                self.nova.volumes.delete_server_volume(vm.id, volume_id)
             except Exception as e:
-                print("Warning: Detaching volume %s from VM %s: %s" % (volume.volumeId, vm.name,e))
+                print("Warning: Detaching volume %s from VM %s: %s" % (volume_id, vm.name,e))
         print("Delete VM %s" % vm.name)
         self.nova.servers.delete(vm)
         # Delete attached volumes
-        for volume in current_attached_volumes:
+        for volume_id in volume_ids:
             try:
-                print("Delete volume: name=%-10s" % volume.volumeId)
-                self.cinder.volumes.delete(volume.volumeId)
+                print("Delete volume: name=%-10s" % volume_id)
+                self.cinder.volumes.delete(volume_id)
             except Exception as e:
-                print("Warning: Deleting volume %s: %s" % (volume.volumeId, e))
+                print("Warning: Deleting volume %s: %s" % (volume_id, e))
     
-    def update_metadata(self, vm, host, metadata_namespace, inherited=True):
-        """Update metadata of the VM to match the correspondent host.
-        :param host: (ansible.inventory.host.Host) Host declared in the inventory,
-                     correspondent to the VM
-        :param metadata_namespace: (string) namespace of the project
-        :param inherited: (bool)(default) True if no template is used, all
-                          inherited groups and variables will be stored in
-                          host's metadata
-                          False if a template is used, only host-specific
-                          groups and variables will be stored in hosts' metadata
-        """
-        # Update VM's metadata
-        meta = au.create_host_metadata(host, metadata_namespace,
-                                         inherited=inherited)
-        vm_meta = {}
-        for key, value in vm.metadata.items():
-            if key.startswith(metadata_namespace):
-                vm_meta[key] = value
-        if vm_meta != meta:
-            print("Update VM metadata: name=%-10s metadata=%s\n" % (host.name, meta))
-            self.nova.servers.delete_meta(vm, vm_meta.keys())
-            self.nova.servers.set_meta(vm, metadata=meta)
-
     def delete_volume(self, volume):
         """Delete volume on OpenStack platform, detach volume if necessary.
         :param volume: (cinderclient.v2.volumes.Volume) volume, or
                        (string) ID of the volume
         """
         if isinstance(volume, (str, unicode)):
-            volume = self.cinder.volumes.get(volume_id)
+            volume = self.cinder.volumes.get(volume)
         for attachment in volume.attachments:
             print("Detaching volume %s from VM %s" % (volume.name, attachment["server_id"]))
             self.nova.volumes.delete_server_volume(attachment["server_id"], volume.id)
@@ -255,71 +485,43 @@ class OpenStackClient(object):
                 print("Wait 20 seconds")
                 sleep(20)
 
-    def update_volumes(self, vm, host, metadata_namespace=DEFAULT_METADATA_NAMESPACE):
-        """Create and attach volumes to VM following the description of a host
-        in an inventory.
-        Host volume must be described in host vars. Syntax: 
-            <device_name>=<volume_size_GB>[,volume_type]
-            e.g. vdb=10,standard
-        This function will create a volume with name <vm_name>_<device_name> and
-        attach to the vm as <device_name>
-        Will not check wether the volume_type exists or not
-        If the VM already has a volume attached to the current device, then change
-        its name if necessary.
-        If the VM a volume does not attach to any device listed in host var, then
-        the volume will be deleted
-        :param vm: VM to attach volumes to
-        :param host: inventory host with description of volumes
+    def create_volume(self, vm_id, vm_name, device, size, volume_type=None,
+                      metadata_namespace=DEFAULT_METADATA_NAMESPACE):
+        """Create a volume named <vm_name>_<device> and attach it to a VM.
+        :param vm_id: (string) ID of the VM
+        :param vm_name: (string) name of the VM
+        :param device: (string) device name, e.g. vdb
+        :param size: (int) size in GB
+        :param volume_type: (string) volume type, None for default
+        :param metadata_namespace: (string) namespace of the project
+        :return: (cinderclient.v2.volumes.Volume) new volume
         """
-        expected_volumes = {}
-        for key, value in au.get_host_variables(host, inherited=True).items():
-            if key.startswith(OPENSTACK_VOLUME_PREFIX):
-                device = key[len(OPENSTACK_VOLUME_PREFIX)+1:]
-                expected_volumes[device] = str(value)
- 
-        current_attached_volumes = [self.cinder.volumes.get(vol.id) for vol in
-                                    self.nova.volumes.get_server_volumes(vm.id)]
- 
-        for vol in current_attached_volumes:
-            for attachment in vol.attachments:
-                if attachment['server_id'] == vm.id:
-                    device = attachment['device'].split('/')[-1]
-                    if device not in expected_volumes:
-                        print "Detach volume %s" % vol.name
-                        self.nova.volumes.delete_server_volume(vm.id, vol.id)
-                        sleep(3)
-                        print "Delete volume %s" % vol.name
-                        self.cinder.volumes.delete(vol)
-                    else:
-                        if vol.name != vm.name + '_' + device:
-                            print "Change volume name"
-                            self.cinder.volumes.update(vol, name=vm.name + '_' + device)
-                        print "Remove volume from list"
-                        expected_volumes.pop(device)
-                    break
-    
-        for device, value in expected_volumes.items():
-            vol_info = value.split(',')
-            vol_size = int(vol_info[0])
-            if len(vol_info) > 1:
-                vol_type = vol_info[1]
-            else:
-                vol_type = None
-            print "Create volume: Name: %s Size: %d Type: %s" % (vm.name + '_' + device, vol_size, vol_type)
-            new_vol = self.cinder.volumes.create(vol_size,
-                                                 name=vm.name + '_' + device,
-                                                 volume_type=vol_type,
-                                                 metadata = {metadata_namespace + "host": vm.name,
-                                                             metadata_namespace + "device": device})
-            print "Attach volume: %s to VM: %s as device: %s" % (new_vol.name, vm.name, device)
-            for trial in range(5):
-                try:
-                    self.nova.volumes.create_server_volume(vm.id, new_vol.id, "/dev/" + device)
-                    break
-                except nclient.exceptions.Conflict as e:
-                    print "Warning: %s" % e
-                    if trial == 4:
-                        print "Give up attahing volumes"
-                        raise VolumeAttachmentError("Cannot attach volumes: %s" % e)
-                    print "VM is not yet ready. Wait for 30 seconds"
-                    sleep(30)
+        print "Create volume: Name: %s Size: %d Type: %s" % (vm_name + '_' + device, size, volume_type)
+        new_vol = self.cinder.volumes.create(size,
+                                             name=vm_name + '_' + device,
+                                             volume_type=volume_type,
+                                             metadata = {metadata_namespace + "host": vm_name,
+                                                         metadata_namespace + "device": device})
+        self.attach_volume(vm_id, new_vol.id, device, new_vol.name, vm_name)
+        return new_vol
+
+    def attach_volume(self, vm_id, volume_id, device, volume_name=None,
+                      vm_name=None):
+        """Attach a volume to a VM, wait for the VM if it is not ready.
+        :param vm_id: (string) ID of the VM
+        :param volume_id: (string) ID of the volume
+        :param device: (string) device name, e.g. vdb
+        Raise VolumeAttachmentError if the volume cannot be attached.
+        """
+        print "Attach volume: %s to VM: %s as device: %s" % (volume_name or volume_id, vm_name or vm_id, device)
+        for trial in range(5):
+            try:
+                self.nova.volumes.create_server_volume(vm_id, volume_id, "/dev/" + device)
+                break
+            except nclient.exceptions.Conflict as e:
+                print "Warning: %s" % e
+                if trial == 4:
+                    print "Give up attahing volumes"
+                    raise VolumeAttachmentError("Cannot attach volumes: %s" % e)
+                print "VM is not yet ready. Wait for 30 seconds"
+                sleep(30)
@@ -0,0 +1,110 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Serialization of inventories.
+# Three output formats are supported:
+#   pretty:  indented JSON, the historical output of openstack_inventory.py
+#   compact: JSON without whitespace
+#   stream:  compact JSON written entry by entry, without building the whole
+#            document in memory
+# Compact and stream formats use ujson when it is installed.
+#
+
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+OUTPUT_FORMATS = ("pretty", "compact", "stream")
+
+DEFAULT_OUTPUT_FORMAT = "pretty"
+
+
+def dumps(obj):
+    """Encode an object as compact JSON, with the fastest available encoder.
+    :param obj: object to encode
+    :return: (string) JSON document
+    """
+    if ujson is not None:
+        try:
+            return ujson.dumps(obj, escape_forward_slashes=False)
+        except TypeError:
+            # Old ujson versions do not know escape_forward_slashes
+            return ujson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def write_inventory(inventory, stream, output_format=DEFAULT_OUTPUT_FORMAT):
+    """Write an inventory to a stream.
+    :param inventory: (dict) inventory
+    :param stream: file-like object
+    :param output_format: (string) one of OUTPUT_FORMATS
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format '%s', must be one of: %s" %
+                         (output_format, ', '.join(OUTPUT_FORMATS)))
+    if output_format == "pretty":
+        stream.write(json.dumps(inventory, indent=2))
+        stream.write("\n")
+    elif output_format == "compact":
+        stream.write(dumps(inventory))
+        stream.write("\n")
+    else:
+        groups = dict((name, group) for name, group in inventory.items()
+                      if name != "_meta")
+        hostvars = inventory.get("_meta", {}).get("hostvars", {})
+        stream_inventory(groups, hostvars.items(), stream)
+
+
+def stream_inventory(groups, hosts, stream):
+    """Write an inventory to a stream while its hosts are being produced.
+    Host variables are written as soon as they are received. Only the group
+    memberships are kept in memory until all hosts are written.
+    :param groups: (dict) groups of the inventory, e.g. a template. Hosts
+                   received later are appended to their "hosts" lists.
+    :param hosts: iterable of (hostname, variables) or
+                  (hostname, group names, variables) tuples
+    :param stream: file-like object
+    """
+    memberships = {}
+    stream.write('{"_meta":{"hostvars":{')
+    first = True
+    for host in hosts:
+        if len(host) == 3:
+            hostname, host_groups, variables = host
+            for group in host_groups:
+                memberships.setdefault(group, []).append(hostname)
+        else:
+            hostname, variables = host
+        if not first:
+            stream.write(',')
+        first = False
+        stream.write(dumps(hostname))
+        stream.write(':')
+        stream.write(dumps(variables))
+    stream.write('}}')
+
+    for name in sorted(set(groups) | set(memberships)):
+        group = groups.get(name, {})
+        if name in memberships:
+            group = dict(group)
+            group["hosts"] = list(group.get("hosts", [])) + memberships[name]
+        stream.write(',')
+        stream.write(dumps(name))
+        stream.write(':')
+        stream.write(dumps(group))
+    stream.write('}\n')
@@ -45,3 +45,28 @@ def get_config(filename=None):
                 configs[sec] = dict(parser.items(sec))
             return configs
     return {}
+
+
+def to_string(value, default=None):
+    """Convert a configuration value to a string, without its quotes.
+    :param value: (string) value read from the configuration
+    :param default: value to return if value is None or empty
+    :return: (string)
+    """
+    if value is None or value == '':
+        return default
+    value = str(value).strip().strip('"')
+    return value if value else default
+
+
+def to_bool(value, default=False):
+    """Convert a configuration value to a boolean.
+    :param value: (string or bool) value read from the configuration
+    :param default: (bool) value to return if value is None or empty
+    :return: (bool)
+    """
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return to_string(value, '').lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,205 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compute the actions needed to synchronize an OpenStack platform with an
+# inventory.
+# The planner works on an InventoryModel and a PlatformModel only, so it
+# does not need any access to the platform: the platform model can be
+# loaded from a snapshot.
+# A plan is a JSON-serializable dict. Its steps are executed in order by
+# OpenStackInventoryManager.apply_plan. Every step has an "action":
+#   create_vm:       boot a VM for a new host
+#   delete_vm:       delete a VM that is no longer in the inventory
+#   update_metadata: set the metadata of a VM to match its host
+#   delete_volume:   detach and delete a volume
+#   rename_volume:   rename a volume attached to a VM
+#   attach_volume:   attach an existing, detached volume to a VM
+#   create_volume:   create a volume and attach it to a VM. "vm_id" is None
+#                    if the VM is created by the same plan.
+#
+
+import time
+
+from ansible_dynamic_inventories.utils import metadata_codec as mc
+
+PLAN_VERSION = 1
+
+
+class PlanError(Exception):
+    pass
+
+
+def compute_plan(inventory_model, platform, inventory_file=None,
+                 trust_digest=True):
+    """Compute the plan to synchronize a platform with an inventory.
+    :param inventory_model: (InventoryModel) hosts of the inventory
+    :param platform: (PlatformModel) VMs and volumes of the platform
+    :param inventory_file: (string) name of the inventory, for information
+    :param trust_digest: (bool) True to consider the metadata of a VM up to
+                         date when its digest item matches the host. False
+                         to compare all the items.
+    :return: (dict) plan
+    """
+    namespace = inventory_model.namespace
+    if platform.namespace != namespace:
+        raise PlanError("Inventory namespace '%s' does not match platform "
+                        "namespace '%s'" % (namespace, platform.namespace))
+    hosts = inventory_model.hosts
+    vms = platform.vms
+    new_hosts = sorted(set(hosts) - set(vms))
+    removed_vms = sorted(set(vms) - set(hosts))
+    mapped_vms = sorted(set(vms) & set(hosts))
+
+    create_steps = []
+    for name in new_hosts:
+        create_steps.append(_create_vm_step(hosts[name], platform))
+
+    delete_steps = []
+    deleted_volumes = set()
+    for name in removed_vms:
+        vm = vms[name]
+        volumes = [vol.id for vol, _ in platform.volumes_of(vm)]
+        # Attached volumes are deleted with the VM
+        deleted_volumes.update(volumes)
+        delete_steps.append({"action": "delete_vm", "id": vm.id,
+                             "name": vm.name, "volumes": volumes})
+
+    metadata_steps = []
+    for name in mapped_vms:
+        step = _update_metadata_step(vms[name], hosts[name], namespace,
+                                     trust_digest)
+        if step:
+            metadata_steps.append(step)
+
+    # Volumes kept by the hosts, possibly renamed
+    kept_volumes = set()
+    volume_steps = []
+    for name in sorted(hosts):
+        volume_steps.extend(_volume_steps(hosts[name], vms.get(name), platform,
+                                          deleted_volumes, kept_volumes))
+
+    # Volumes of the namespace that are no longer in the inventory
+    volume_delete_steps = []
+    inventory_volumes = inventory_model.volume_specs()
+    for name in sorted(set(platform.volumes) - set(inventory_volumes)):
+        vol = platform.volumes[name]
+        if vol.id not in deleted_volumes and vol.id not in kept_volumes:
+            deleted_volumes.add(vol.id)
+            volume_delete_steps.append(_delete_volume_step(vol))
+    # Deletions first, so that devices are free before attaching volumes
+    volume_steps.sort(key=lambda step: step["action"] != "delete_volume")
+
+    return {"version": PLAN_VERSION,
+            "namespace": namespace,
+            "created_at": time.time(),
+            "inventory": inventory_file,
+            "platform": dict(platform.info),
+            "steps": (create_steps + delete_steps + metadata_steps +
+                      volume_delete_steps + volume_steps)}
+
+
+def _create_vm_step(host, platform):
+    boot = host.boot
+    boot.validate(host.name)
+    network = boot.network
+    if platform.networks:
+        network = platform.find_network(boot.network)
+        if not network:
+            raise PlanError("Network '%s' does not exists" % boot.network)
+    return {"action": "create_vm",
+            "name": host.name,
+            "image": boot.image,
+            "flavor": boot.flavor,
+            "network": network,
+            "fixed_ip": host.address,
+            "key_name": boot.key_name,
+            "security_groups": list(boot.security_groups or []) or None,
+            "metadata": host.metadata}
+
+
+def _update_metadata_step(vm, host, namespace, trust_digest=True):
+    if trust_digest and mc.same_digest(vm.metadata, host.metadata, namespace):
+        return None
+    if vm.metadata == host.metadata:
+        return None
+    return {"action": "update_metadata",
+            "id": vm.id,
+            "name": vm.name,
+            "metadata": host.metadata,
+            "delete_keys": sorted(set(vm.metadata) - set(host.metadata))}
+
+
+def _delete_volume_step(vol):
+    return {"action": "delete_volume",
+            "id": vol.id,
+            "name": vol.name,
+            "attachments": [a["server_id"] for a in vol.attachments]}
+
+
+def _volume_steps(host, vm, platform, deleted_volumes, kept_volumes):
+    """Steps to attach the volumes described in a host to its VM.
+    :param host: (HostRecord)
+    :param vm: (VMRecord) None if the VM is to be created
+    :param platform: (PlatformModel)
+    :param deleted_volumes: (set) IDs of volumes deleted by the plan,
+                            updated with the volumes deleted by these steps
+    :param kept_volumes: (set) updated with the IDs of the volumes used by
+                         the host
+    """
+    steps = []
+    expected = dict((spec.device, spec) for spec in host.volumes)
+    if vm is not None:
+        for vol, device in platform.volumes_of(vm):
+            if vol.id in deleted_volumes:
+                continue
+            if device not in expected:
+                deleted_volumes.add(vol.id)
+                steps.append(_delete_volume_step(vol))
+                continue
+            if vol.name != expected[device].name:
+                steps.append({"action": "rename_volume", "id": vol.id,
+                              "name": expected[device].name,
+                              "old_name": vol.name})
+            kept_volumes.add(vol.id)
+            expected.pop(device)
+
+    for device, spec in sorted(expected.items()):
+        existing = platform.volumes.get(spec.name)
+        if (vm is not None and existing is not None and
+                not existing.attachments and existing.id not in deleted_volumes):
+            kept_volumes.add(existing.id)
+            steps.append({"action": "attach_volume", "id": existing.id,
+                          "name": spec.name, "vm": host.name,
+                          "vm_id": vm.id, "device": device})
+            continue
+        steps.append({"action": "create_volume",
+                      "name": spec.name,
+                      "vm": host.name,
+                      "vm_id": vm.id if vm is not None else None,
+                      "device": device,
+                      "size": spec.size,
+                      "volume_type": spec.volume_type})
+    return steps
+
+
+def summarize_plan(plan):
+    """Count the steps of a plan by action.
+    :param plan: (dict) plan
+    :return: (dict) action to number of steps
+    """
+    summary = {}
+    for step in plan["steps"]:
+        summary[step["action"]] = summary.get(step["action"], 0) + 1
+    return summary
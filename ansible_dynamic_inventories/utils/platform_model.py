@@ -0,0 +1,457 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compact representation of the inventory and of the OpenStack platform.
+# Only the fields needed to plan the synchronization are extracted from the
+# Ansible and OpenStack objects. Records use __slots__ and all names are
+# interned, so that large inventories can be kept in memory at once.
+#
+
+import os
+
+from ansible_dynamic_inventories.utils import *
+from ansible_dynamic_inventories.utils import ansible_utils as au
+from ansible_dynamic_inventories.utils import metadata_codec as mc
+from ansible_dynamic_inventories.utils import snapshot as sn
+
+try:
+    _STRING_TYPES = (str, unicode)
+except NameError:
+    _STRING_TYPES = (str,)
+
+
+class StringPool(object):
+    "Intern strings so that equal names share the same object"
+
+    def __init__(self):
+        self._strings = {}
+
+    def __call__(self, string):
+        if string is None:
+            return None
+        return self._strings.setdefault(string, string)
+
+    def map(self, mapping):
+        """Intern the keys and string values of a dict.
+        :param mapping: (dict)
+        :return: (dict) new dict with interned strings
+        """
+        return dict((self(key), self(value) if isinstance(value, _STRING_TYPES) else value)
+                    for key, value in mapping.items())
+
+
+class VMRecord(object):
+    "VM of the platform. Can be used in place of a novaclient Server."
+    __slots__ = ("id", "name", "status", "key_name", "networks", "metadata")
+
+    def __init__(self, id, name, status=None, key_name=None, networks=None,
+                 metadata=None):
+        self.id = id
+        self.name = name
+        self.status = status
+        self.key_name = key_name
+        self.networks = networks or {}
+        self.metadata = metadata or {}
+
+    def __repr__(self):
+        return "<VM %s>" % self.name
+
+
+class VolumeRecord(object):
+    "Volume of the platform. Can be used in place of a cinderclient Volume."
+    __slots__ = ("id", "name", "size", "volume_type", "host", "device",
+                 "attachments")
+
+    def __init__(self, id, name, size=None, volume_type=None, host=None,
+                 device=None, attachments=None):
+        self.id = id
+        self.name = name
+        self.size = size
+        self.volume_type = volume_type
+        self.host = host
+        self.device = device
+        self.attachments = attachments or []
+
+    def __repr__(self):
+        return "<Volume %s>" % self.name
+
+
+class VolumeSpec(object):
+    "Volume described in the inventory: <host>_<device>"
+    __slots__ = ("name", "host", "device", "size", "volume_type")
+
+    def __init__(self, name, host, device, size, volume_type=None):
+        self.name = name
+        self.host = host
+        self.device = device
+        self.size = size
+        self.volume_type = volume_type
+
+    def __repr__(self):
+        return "<VolumeSpec %s>" % self.name
+
+
+class BootSpec(object):
+    "Parameters used to boot the VM of a host"
+    __slots__ = ("image", "flavor", "network", "key_name", "security_groups")
+
+    def __init__(self, image, flavor, network, key_name=None,
+                 security_groups=None):
+        self.image = image
+        self.flavor = flavor
+        self.network = network
+        self.key_name = key_name
+        self.security_groups = security_groups
+
+    def key(self):
+        "Tuple identifying VMs that can be booted with the same parameters"
+        return (self.image, self.flavor, self.network, self.key_name,
+                self.security_groups)
+
+    def validate(self, host_name):
+        "Raise Exception if a required parameter is missing"
+        for name in ("image", "flavor", "network"):
+            if getattr(self, name) is None:
+                raise Exception("ERROR: openstack_%s_id is not defined for "
+                                "host %s" % (name, host_name))
+
+
+class HostRecord(object):
+    "Host declared in the inventory"
+    __slots__ = ("name", "address", "groups", "metadata", "volumes", "boot")
+
+    def __init__(self, name, address, groups, metadata, volumes, boot=None):
+        self.name = name
+        self.address = address
+        self.groups = groups
+        self.metadata = metadata
+        self.volumes = volumes
+        self.boot = boot
+
+    def __repr__(self):
+        return "<Host %s>" % self.name
+
+
+def parse_volume_spec(host_name, device, value, pool=None):
+    """Parse the description of a volume: <size_GB>[,volume_type]
+    :param host_name: (string) name of the host
+    :param device: (string) device name, e.g. vdb
+    :param value: (string) description of the volume
+    :param pool: (StringPool) pool to intern names
+    :return: (VolumeSpec)
+    """
+    pool = pool or StringPool()
+    vol_info = str(value).split(',')
+    vol_type = pool(vol_info[1]) if len(vol_info) > 1 else None
+    return VolumeSpec(pool(host_name + '_' + device), pool(host_name),
+                      pool(device), int(vol_info[0]), vol_type)
+
+
+def get_volume_specs(host_name, host_vars, pool=None):
+    """Get the volumes described in the variables of a host.
+    :param host_name: (string) name of the host
+    :param host_vars: (dict) variables of the host, inherited ones included
+    :param pool: (StringPool) pool to intern names
+    :return: list of (VolumeSpec)
+    """
+    volumes = []
+    for key, value in host_vars.items():
+        if key.startswith(OPENSTACK_VOLUME_PREFIX):
+            device = key[len(OPENSTACK_VOLUME_PREFIX)+1:]
+            volumes.append(parse_volume_spec(host_name, device, value, pool))
+    return volumes
+
+
+def digest_volumes(volumes):
+    """Get the fields of volumes covered by the metadata digest.
+    :param volumes: list of (VolumeSpec)
+    :return: list of (device, size, volume type), see
+             metadata_codec.metadata_digest
+    """
+    return [(spec.device, spec.size, spec.volume_type) for spec in volumes]
+
+
+class InventoryModel(object):
+    "Hosts of an Ansible inventory"
+
+    def __init__(self, namespace, pool=None, encoding=mc.PLAIN):
+        self.namespace = namespace
+        self.pool = pool or StringPool()
+        self.encoding = encoding
+        self.hosts = {}
+
+    def add_host(self, host):
+        """Extract the fields used by the planner from an inventory host.
+        :param host: (ansible.inventory.host.Host)
+        :return: (HostRecord)
+        """
+        pool = self.pool
+        name = pool(host.name)
+        host_vars = au.get_host_variables(host, inherited=True)
+        volumes = get_volume_specs(name, host_vars, pool)
+        security_groups = host_vars.get("openstack_security_groups")
+        if security_groups:
+            security_groups = tuple(pool(g) for g in security_groups.split(","))
+        if "ansible_private_key_file" in host_vars:
+            key_name = os.path.basename(host_vars["ansible_private_key_file"])
+        else:
+            key_name = host_vars.get("openstack_keypair_id")
+        boot = BootSpec(pool(host_vars.get("openstack_image_id")),
+                        pool(host_vars.get("openstack_flavor_id")),
+                        pool(host_vars.get("openstack_network_id")),
+                        pool(key_name), security_groups or None)
+        metadata = au.create_host_metadata(host, self.namespace,
+                                           encoding=self.encoding)
+        mc.add_digest(metadata, self.namespace, digest_volumes(volumes))
+        record = HostRecord(name, pool(host.address),
+                            tuple(pool(g) for g in au.get_host_groups(host)),
+                            pool.map(metadata), tuple(volumes), boot)
+        self.hosts[name] = record
+        return record
+
+    def volume_specs(self):
+        """Get all volumes described in the inventory.
+        :return: (dict) volume names to VolumeSpec
+        """
+        return dict((spec.name, spec) for host in self.hosts.values()
+                    for spec in host.volumes)
+
+    @classmethod
+    def from_inventory(cls, inventory, namespace, encoding=mc.PLAIN):
+        """Build the model of an inventory.
+        :param inventory: (ansible.inventory.ini.InventoryParser)
+        :param namespace: (string) metadata namespace
+        :param encoding: (string) metadata encoding of the host variables
+        :return: (InventoryModel)
+        """
+        model = cls(namespace, encoding=encoding)
+        for host in inventory.hosts.values():
+            model.add_host(host)
+        return model
+
+
+class PlatformModel(object):
+    """VMs and volumes of the OpenStack platform that belong to a namespace.
+    VMs are indexed by name, volumes by their "<host>_<device>" name.
+    Volumes attached to a VM are also indexed by server ID, whatever their
+    namespace.
+    """
+
+    def __init__(self, namespace, pool=None):
+        self.namespace = namespace
+        self.pool = pool or StringPool()
+        self.vms = {}
+        self.volumes = {}
+        self.attached_volumes = {}
+        self.networks = {}
+        self.info = {}
+        self._vm_names = {}
+
+    def add_vm(self, id, name, metadata, status=None, key_name=None,
+               networks=None):
+        """Add a VM if it belongs to the namespace. Only the metadata of the
+        namespace are kept.
+        :return: (VMRecord) or None if the VM does not belong to the namespace
+        """
+        ns = self.namespace
+        self.remove_vm(id)
+        if ns + "groups" not in metadata:
+            return None
+        pool = self.pool
+        record = VMRecord(pool(id), pool(name), pool(status), pool(key_name),
+                          dict((pool(label), [pool(a) for a in addresses])
+                               for label, addresses in (networks or {}).items()),
+                          pool.map(dict((k, v) for k, v in metadata.items()
+                                        if k.startswith(ns))))
+        self.vms[record.name] = record
+        self._vm_names[record.id] = record.name
+        return record
+
+    def remove_vm(self, id):
+        """Remove a VM from the model.
+        :param id: (string) ID of the VM
+        :return: (VMRecord) removed VM, None if the VM is not in the model
+        """
+        name = self._vm_names.pop(id, None)
+        if name is None or self.vms[name].id != id:
+            return None
+        return self.vms.pop(name)
+
+    def get_vm(self, id):
+        """Get a VM by its ID.
+        :param id: (string) ID of the VM
+        :return: (VMRecord) None if the VM is not in the model
+        """
+        name = self._vm_names.get(id)
+        if name is None or self.vms[name].id != id:
+            return None
+        return self.vms[name]
+
+    def server_dicts(self):
+        """Get the VMs of the model in the format of
+        openstack_utils.server_info.
+        :return: list of (dict)
+        """
+        return [{"id": vm.id, "name": vm.name, "status": vm.status,
+                 "key_name": vm.key_name, "networks": vm.networks,
+                 "metadata": vm.metadata} for vm in self.vms.values()]
+
+    def add_volume_info(self, id, name, metadata, size=None, volume_type=None,
+                        attachments=None):
+        """Add a volume if it belongs to the namespace or is attached.
+        :param attachments: list of (dict) with "server_id" and "device" keys
+        :return: (VolumeRecord) or None if the volume is ignored
+        """
+        host = metadata.get(self.namespace + "host")
+        if host is None and not attachments:
+            return None
+        pool = self.pool
+        record = VolumeRecord(pool(id), pool(name), size, pool(volume_type),
+                              pool(host),
+                              pool(metadata.get(self.namespace + "device")),
+                              [{"server_id": pool(a.get("server_id")),
+                                "device": pool(a.get("device"))}
+                               for a in attachments or []])
+        if host is not None:
+            self.volumes[record.name] = record
+        for attachment in record.attachments:
+            self.attached_volumes.setdefault(attachment["server_id"], []).append(
+                (record, (attachment["device"] or '').split('/')[-1]))
+        return record
+
+    def get_volume(self, id):
+        """Get a volume by its ID.
+        :param id: (string) ID of the volume
+        :return: (VolumeRecord) None if the volume is not in the model
+        """
+        for vol in self.all_volumes():
+            if vol.id == id:
+                return vol
+        return None
+
+    def remove_volume(self, id):
+        """Remove a volume from the model.
+        :param id: (string) ID of the volume
+        :return: (VolumeRecord) removed volume, None if the volume is not in
+                 the model
+        """
+        removed = None
+        for name, vol in list(self.volumes.items()):
+            if vol.id == id:
+                removed = self.volumes.pop(name)
+        for server_id, attached in list(self.attached_volumes.items()):
+            kept = []
+            for vol, device in attached:
+                if vol.id == id:
+                    removed = vol
+                else:
+                    kept.append((vol, device))
+            if len(kept) != len(attached):
+                if kept:
+                    self.attached_volumes[server_id] = kept
+                else:
+                    del self.attached_volumes[server_id]
+        return removed
+
+    def clear_volumes(self):
+        "Remove all volumes from the model"
+        self.volumes = {}
+        self.attached_volumes = {}
+
+    def all_volumes(self):
+        """Get all volumes of the model: volumes of the namespace and volumes
+        attached to a VM.
+        :return: list of (VolumeRecord)
+        """
+        volumes = dict((vol.id, vol) for vol in self.volumes.values())
+        for attached in self.attached_volumes.values():
+            for vol, _ in attached:
+                volumes[vol.id] = vol
+        return list(volumes.values())
+
+    def add_network(self, id, label):
+        "Add a network"
+        self.networks[self.pool(id)] = self.pool(label)
+
+    def find_network(self, network):
+        """Get the ID of a network from its ID or label.
+        :param network: (string) ID or label
+        :return: (string) network ID, None if not found
+        """
+        if network in self.networks:
+            return network
+        for net_id, label in self.networks.items():
+            if label == network:
+                return net_id
+        return None
+
+    def volumes_of(self, vm):
+        """Get the volumes attached to a VM.
+        :param vm: (VMRecord)
+        :return: list of (VolumeRecord, device) tuples
+        """
+        return list(self.attached_volumes.get(vm.id, []))
+
+    def save(self, path, compress=False):
+        """Save the model in a platform snapshot.
+        :param path: (string) file name
+        :param compress: (bool) compress the snapshot
+        """
+        ns = self.namespace
+        servers = self.server_dicts()
+        volumes = []
+        for vol in self.all_volumes():
+            metadata = {}
+            if vol.host is not None:
+                metadata[ns + "host"] = vol.host
+            if vol.device is not None:
+                metadata[ns + "device"] = vol.device
+            volumes.append({"id": vol.id, "name": vol.name, "size": vol.size,
+                            "volume_type": vol.volume_type,
+                            "metadata": metadata,
+                            "attachments": vol.attachments})
+        networks = [{"id": net_id, "label": label}
+                    for net_id, label in self.networks.items()]
+        info = dict(self.info)
+        info["namespace"] = ns
+        sn.save_platform_state(path, servers, volumes, networks, info,
+                               compress=compress)
+
+    @classmethod
+    def load(cls, path, namespace):
+        """Load a model from a platform snapshot.
+        :param path: (string) file name
+        :param namespace: (string) metadata namespace
+        :return: (PlatformModel)
+        Raise SnapshotError if the snapshot was taken for another namespace.
+        """
+        state = sn.load_platform_state(path)
+        if state["info"].get("namespace") != namespace:
+            raise sn.SnapshotError("Snapshot %s was taken for namespace '%s', "
+                                   "not '%s'" % (path,
+                                                 state["info"].get("namespace"),
+                                                 namespace))
+        model = cls(namespace)
+        model.info = state["info"]
+        for s in state["servers"]:
+            model.add_vm(s["id"], s["name"], s["metadata"], status=s["status"],
+                         key_name=s["key_name"], networks=s["networks"])
+        for v in state["volumes"]:
+            model.add_volume_info(v["id"], v["name"], v["metadata"],
+                                  size=v["size"], volume_type=v["volume_type"],
+                                  attachments=v["attachments"])
+        for n in state["networks"]:
+            model.add_network(n["id"], n["label"])
+        return model
@@ -0,0 +1,234 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Profiling of the scripts.
+# The code is divided in named phases (with PROFILER.phase("name"): ...).
+# When the profiler is enabled (--profile), the wall and CPU time of every
+# phase is reported on stderr at exit. Phases can be nested.
+# Optionally, the whole run is captured with cProfile and written to a file
+# (--profile-output):
+#   *.prof, *.pstats: pstats dump, for snakeviz, flameprof, gprof2dot...
+#   other names:      folded stacks ("caller;callee microseconds" lines),
+#                     for flamegraph.pl, speedscope, inferno...
+# cProfile only records caller/callee pairs, so the time of a function is
+# split between its call stacks in proportion to the time spent in each
+# caller. The share of calls without a recorded caller (e.g. from the top
+# level of the script) is reported as a stack of its own.
+#
+
+import atexit
+import contextlib
+import os
+import sys
+import time
+
+PSTATS_EXTENSIONS = (".prof", ".pstats")
+
+# Limits of the conversion of cProfile statistics to folded stacks
+MAX_STACK_DEPTH = 64
+MAX_STACKS_PER_FUNCTION = 256
+
+
+def cpu_time():
+    "User and system CPU time of the process"
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Profiler(object):
+    "Wall and CPU time of named phases"
+
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        # Phase path (tuple of names) to [wall time, CPU time, count], in
+        # order of first use
+        self.phases = {}
+        self._order = []
+        self._stack = []
+        self._profile = None
+        self._start = None
+
+    def enable(self, output=None):
+        """Start profiling. The report is written at exit.
+        :param output: (string) file to write the cProfile capture to.
+                       None to only time the phases.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        self.output = output
+        self._start = (time.time(), cpu_time())
+        if output:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        atexit.register(self.finish)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a block of code.
+        :param name: (string) name of the phase
+        """
+        if not self.enabled:
+            yield
+            return
+        self._stack.append(name)
+        path = tuple(self._stack)
+        if path not in self.phases:
+            self.phases[path] = [0.0, 0.0, 0]
+            self._order.append(path)
+        wall, cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.time() - wall, cpu_time() - cpu
+            self._stack.pop()
+            record = self.phases[path]
+            record[0] += wall
+            record[1] += cpu
+            record[2] += 1
+
+    def report(self, stream=None):
+        """Write the time of the phases.
+        :param stream: file object, default is stderr
+        """
+        stream = stream or sys.stderr
+        stream.write("%-40s %10s %10s %6s\n" % ("Phase", "Wall (s)", "CPU (s)",
+                                                "Calls"))
+        for path in self._order:
+            wall, cpu, count = self.phases[path]
+            name = "  " * (len(path) - 1) + path[-1]
+            stream.write("%-40s %10.3f %10.3f %6d\n" % (name, wall, cpu, count))
+        if self._start:
+            stream.write("%-40s %10.3f %10.3f\n" %
+                         ("total", time.time() - self._start[0],
+                          cpu_time() - self._start[1]))
+
+    def finish(self):
+        "Stop profiling, write the report and the cProfile capture"
+        if not self.enabled:
+            return
+        if self._profile is not None:
+            self._profile.disable()
+        self.report()
+        if self._profile is not None:
+            if self.output.endswith(PSTATS_EXTENSIONS):
+                self._profile.dump_stats(self.output)
+            else:
+                self._profile.create_stats()
+                with open(self.output, "w") as f:
+                    write_folded_stacks(self._profile.stats, f)
+            sys.stderr.write("Profile written to %s\n" % self.output)
+            self._profile = None
+        self.enabled = False
+
+
+def _frame_name(func):
+    filename, line, name = func
+    if filename == "~":
+        # Built-in function
+        return name
+    return "%s:%d(%s)" % (os.path.basename(filename), line, name)
+
+
+def write_folded_stacks(stats, stream):
+    """Convert cProfile statistics to folded stacks.
+    :param stats: (dict) statistics of a cProfile.Profile, after
+                  create_stats()
+    :param stream: file object
+    """
+    stacks_cache = {}
+
+    def stacks(func, visiting):
+        """Get the call stacks of a function.
+        :return: list of (list of functions, fraction of the time of func)
+        """
+        if func in stacks_cache:
+            return stacks_cache[func]
+        # Direct recursion is folded into the outermost call
+        cc, nc, tt, ct, all_callers = stats[func]
+        callers = dict((caller, value) for caller, value in all_callers.items()
+                       if caller != func)
+        if not callers or func in visiting or len(visiting) >= MAX_STACK_DEPTH:
+            return [([func], 1.0)]
+        visiting = visiting | set([func])
+        # Weight of a caller: cumulative time of its calls to func, out of
+        # the cumulative time of func. The number of calls is used when no
+        # time was measured.
+        weights = dict((caller, value[3] if isinstance(value, tuple) else 0)
+                       for caller, value in callers.items())
+        total = ct
+        if not sum(weights.values()):
+            weights = dict((caller, value[1] if isinstance(value, tuple) else value)
+                           for caller, value in callers.items())
+            total = cc
+        total = max(total, sum(weights.values()))
+        if not total:
+            return [([func], 1.0)]
+        result = []
+        # Calls without a recorded caller
+        remainder = total - sum(weights.values())
+        if remainder > 0:
+            result.append(([func], float(remainder) / total))
+        for caller, weight in weights.items():
+            if caller not in stats:
+                # Called from code that was not profiled
+                result.append(([func], float(weight) / total))
+                continue
+            for stack, fraction in stacks(caller, visiting):
+                result.append((stack + [func], fraction * weight / total))
+        if not result:
+            result = [([func], 1.0)]
+        result.sort(key=lambda item: -item[1])
+        result = result[:MAX_STACKS_PER_FUNCTION]
+        stacks_cache[func] = result
+        return result
+
+    folded = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if tt <= 0:
+            continue
+        for stack, fraction in stacks(func, set()):
+            micros = int(tt * fraction * 1000000)
+            if micros <= 0:
+                continue
+            key = ";".join(_frame_name(f) for f in stack)
+            folded[key] = folded.get(key, 0) + micros
+    for key in sorted(folded):
+        stream.write("%s %d\n" % (key, folded[key]))
+
+
+def add_profile_arguments(parser):
+    """Add the profiling options to a command line parser.
+    :param parser: argparse.ArgumentParser
+    """
+    parser.add_argument('--profile', action='store_true',
+                        help="Report the wall and CPU time of every phase "
+                             "on stderr")
+    parser.add_argument('--profile-output', metavar='file', default=None,
+                        help="Capture the run with cProfile and write it to "
+                             "a file: pstats if the name ends with .prof, "
+                             "otherwise folded stacks for flame graph tools. "
+                             "Implies --profile")
+
+
+def enable_profiler(args):
+    "Enable the profiler if requested on the command line"
+    if args.profile or args.profile_output:
+        PROFILER.enable(args.profile_output)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,500 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Binary snapshots of inventories and platform states.
+#
+# A snapshot is a set of named tables. Each table maps string keys (e.g. host
+# names) to values made of strings, lists, dicts and JSON scalars. All
+# strings (group names, host names, metadata keys and values) are stored once
+# in a string table and referenced by their index.
+#
+# File layout (little endian):
+#   header:   magic "ADIS", u16 version, u16 flags, u32 payload size
+#   payload:  zlib-compressed if flags & FLAG_ZLIB
+#     u32 strings offset, u32 tables offset, u32 values offset
+#     strings: u32 count, (count + 1) x u32 offsets in blob, blob (UTF-8)
+#     tables:  u32 count, then for each table:
+#              u32 name id, u32 row count,
+#              row count x (u32 key id, u32 value offset), sorted by key
+#     values:  u8 tag, followed by
+#              TAG_STR:  u32 string id
+#              TAG_JSON: u32 string id of the JSON encoding of a scalar
+#              TAG_MAP:  u32 count, count x (u32 key id, value)
+#              TAG_LIST: u32 count, count x value
+#              TAG_STRMAP:  u32 count, count x (u32 key id, u32 string id)
+#              TAG_STRLIST: u32 count, count x u32 string id
+#              The last two are compact forms of maps and lists of strings.
+#
+# Uncompressed snapshots are memory-mapped: a single row can be read by
+# binary search without decoding the rest of the file.
+#
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+MAGIC = b"ADIS"
+VERSION = 1
+FLAG_ZLIB = 1
+
+TAG_STR = 0
+TAG_JSON = 1
+TAG_MAP = 2
+TAG_LIST = 3
+TAG_STRMAP = 4
+TAG_STRLIST = 5
+
+_HEADER = struct.Struct("<4sHHI")
+_PAYLOAD_HEADER = struct.Struct("<III")
+_U32 = struct.Struct("<I")
+_ROW = struct.Struct("<II")
+_TAGGED = struct.Struct("<BI")
+
+try:
+    _STRING_TYPES = (str, unicode)
+except NameError:
+    _STRING_TYPES = (str,)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotWriter(object):
+    "Build a snapshot from tables of values"
+
+    def __init__(self):
+        self._strings = []
+        self._string_ids = {}
+        self._tables = []
+        self._values = []
+        self._values_size = 0
+
+    def intern(self, string):
+        """Get the id of a string in the string table, add it if necessary.
+        :param string: (string)
+        :return: (int) string id
+        """
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings.append(string)
+            self._string_ids[string] = string_id
+        return string_id
+
+    def add_table(self, name, rows):
+        """Add a table to the snapshot.
+        :param name: (string) table name
+        :param rows: (dict) string keys to values
+        """
+        encoded_rows = []
+        for key, value in rows.items():
+            offset = self._values_size
+            self._encode(value)
+            encoded_rows.append((_utf8(key), self.intern(key), offset))
+        encoded_rows.sort()
+        self._tables.append((self.intern(name), encoded_rows))
+
+    def _append(self, data):
+        self._values.append(data)
+        self._values_size += len(data)
+
+    def _encode(self, value):
+        if isinstance(value, _STRING_TYPES):
+            self._append(_TAGGED.pack(TAG_STR, self.intern(value)))
+        elif isinstance(value, dict):
+            if all(isinstance(item, _STRING_TYPES) for item in value.values()):
+                ids = []
+                for key, item in value.items():
+                    ids.append(self.intern(key))
+                    ids.append(self.intern(item))
+                self._append(_TAGGED.pack(TAG_STRMAP, len(value)))
+                self._append(struct.pack("<%dI" % len(ids), *ids))
+                return
+            self._append(_TAGGED.pack(TAG_MAP, len(value)))
+            for key, item in value.items():
+                self._append(_U32.pack(self.intern(key)))
+                self._encode(item)
+        elif isinstance(value, (list, tuple, set)):
+            if all(isinstance(item, _STRING_TYPES) for item in value):
+                ids = [self.intern(item) for item in value]
+                self._append(_TAGGED.pack(TAG_STRLIST, len(ids)))
+                self._append(struct.pack("<%dI" % len(ids), *ids))
+                return
+            self._append(_TAGGED.pack(TAG_LIST, len(value)))
+            for item in value:
+                self._encode(item)
+        else:
+            self._append(_TAGGED.pack(TAG_JSON, self.intern(json.dumps(value))))
+
+    def to_bytes(self, compress=False):
+        """Serialize the snapshot.
+        :param compress: (bool) compress the payload with zlib
+        :return: (bytes) content of the snapshot file
+        """
+        blob = []
+        offsets = [0]
+        for string in self._strings:
+            data = _utf8(string)
+            blob.append(data)
+            offsets.append(offsets[-1] + len(data))
+        strings = [_U32.pack(len(self._strings)),
+                   struct.pack("<%dI" % len(offsets), *offsets)] + blob
+
+        tables = [_U32.pack(len(self._tables))]
+        for name_id, rows in self._tables:
+            tables.append(_ROW.pack(name_id, len(rows)))
+            tables.extend(_ROW.pack(key_id, offset) for _, key_id, offset in rows)
+
+        strings = b"".join(strings)
+        tables = b"".join(tables)
+        strings_offset = _PAYLOAD_HEADER.size
+        tables_offset = strings_offset + len(strings)
+        values_offset = tables_offset + len(tables)
+        payload = b"".join([_PAYLOAD_HEADER.pack(strings_offset, tables_offset,
+                                                 values_offset),
+                            strings, tables] + self._values)
+        flags = 0
+        size = len(payload)
+        if compress:
+            payload = zlib.compress(payload)
+            flags |= FLAG_ZLIB
+        return _HEADER.pack(MAGIC, VERSION, flags, size) + payload
+
+    def save(self, path, compress=False):
+        """Write the snapshot to a file atomically.
+        :param path: (string) file name
+        :param compress: (bool) compress the payload with zlib
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        # A unique temporary file, so that concurrent writers do not mix
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.to_bytes(compress=compress))
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+class Snapshot(object):
+    "Read-only access to a snapshot file"
+
+    def __init__(self, path):
+        """Open a snapshot.
+        :param path: (string) file name
+        Raise SnapshotError if the file is not a valid snapshot.
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self._file = open(self.path, "rb")
+        self._mmap = None
+        header = self._file.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            self.close()
+            raise SnapshotError("%s is not a snapshot" % self.path)
+        magic, version, flags, size = _HEADER.unpack(header)
+        if magic != MAGIC:
+            self.close()
+            raise SnapshotError("%s is not a snapshot" % self.path)
+        if version != VERSION:
+            self.close()
+            raise SnapshotError("Unsupported snapshot version %d in %s" %
+                                (version, self.path))
+        if flags & FLAG_ZLIB:
+            self._buf = zlib.decompress(self._file.read())
+            self._base = 0
+        else:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            self._buf = self._mmap
+            self._base = _HEADER.size
+        self.compressed = bool(flags & FLAG_ZLIB)
+
+        strings_offset, tables_offset, self._values_offset = \
+            _PAYLOAD_HEADER.unpack_from(self._buf, self._base)
+        self._values_offset += self._base
+        pos = self._base + strings_offset
+        self._string_count = _U32.unpack_from(self._buf, pos)[0]
+        self._string_offsets = pos + _U32.size
+        self._blob = self._string_offsets + (self._string_count + 1) * _U32.size
+        # Decoded strings, filled lazily by string() or at once by
+        # _load_strings()
+        self._strings = {}
+        self._json = {}
+        # Decoded keys of string maps, by key ids: rows of a table usually
+        # have the same keys
+        self._shapes = {}
+        self._unpackers = {}
+
+        self._tables = {}
+        pos = self._base + tables_offset
+        count = _U32.unpack_from(self._buf, pos)[0]
+        pos += _U32.size
+        for _ in range(count):
+            name_id, row_count = _ROW.unpack_from(self._buf, pos)
+            pos += _ROW.size
+            self._tables[self.string(name_id)] = (pos, row_count)
+            pos += row_count * _ROW.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        "Close the snapshot file"
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def string(self, string_id):
+        """Get a string of the string table.
+        :param string_id: (int) string id
+        :return: (string)
+        """
+        if isinstance(self._strings, list):
+            return self._strings[string_id]
+        string = self._strings.get(string_id)
+        if string is None:
+            start, end = struct.unpack_from(
+                "<II", self._buf, self._string_offsets + string_id * _U32.size)
+            string = self._buf[self._blob + start:self._blob + end].decode("utf-8")
+            self._strings[string_id] = string
+        return string
+
+    def _load_strings(self):
+        "Decode the whole string table at once"
+        if isinstance(self._strings, list):
+            return
+        offsets = struct.unpack_from("<%dI" % (self._string_count + 1),
+                                     self._buf, self._string_offsets)
+        blob = self._buf[self._blob:self._blob + offsets[-1]].decode("utf-8")
+        if len(blob) == offsets[-1]:
+            # ASCII only, offsets in bytes are offsets in characters
+            self._strings = [blob[offsets[i]:offsets[i + 1]]
+                             for i in range(self._string_count)]
+        else:
+            blob = self._buf[self._blob:self._blob + offsets[-1]]
+            self._strings = [blob[offsets[i]:offsets[i + 1]].decode("utf-8")
+                             for i in range(self._string_count)]
+
+    def tables(self):
+        """Get the names of the tables.
+        :return: list of (string) table names
+        """
+        return list(self._tables)
+
+    def _rows(self, table):
+        if table not in self._tables:
+            raise KeyError(table)
+        return self._tables[table]
+
+    def keys(self, table):
+        """Get the keys of a table.
+        :param table: (string) table name
+        :return: list of (string) keys, sorted
+        """
+        pos, row_count = self._rows(table)
+        return [self.string(_ROW.unpack_from(self._buf, pos + i * _ROW.size)[0])
+                for i in range(row_count)]
+
+    def get(self, table, key, default=None):
+        """Read a single row of a table, without decoding the others.
+        :param table: (string) table name
+        :param key: (string) key of the row
+        :param default: value to return if the key is not in the table
+        :return: value of the row
+        """
+        pos, row_count = self._rows(table)
+        wanted = _utf8(key)
+        low, high = 0, row_count
+        while low < high:
+            middle = (low + high) // 2
+            key_id, offset = _ROW.unpack_from(self._buf, pos + middle * _ROW.size)
+            current = _utf8(self.string(key_id))
+            if current < wanted:
+                low = middle + 1
+            elif current > wanted:
+                high = middle
+            else:
+                return self._decode(self._values_offset + offset)[0]
+        return default
+
+    def load(self, table):
+        """Decode a whole table.
+        :param table: (string) table name
+        :return: (dict) keys to values
+        """
+        pos, row_count = self._rows(table)
+        self._load_strings()
+        strings = self._strings
+        buf = self._buf
+        row_ids = self._unpacker(2 * row_count)(buf, pos)
+        values_offset = self._values_offset
+        get_string = strings.__getitem__
+        shapes = self._shapes
+        rows = {}
+        for i in range(0, 2 * row_count, 2):
+            value_pos = values_offset + row_ids[i + 1]
+            tag, number = _TAGGED.unpack_from(buf, value_pos)
+            if tag == TAG_STRMAP:
+                # Most rows are string maps: decoded inline
+                ids = self._unpacker(2 * number)(buf, value_pos + _TAGGED.size)
+                key_ids = ids[0::2]
+                keys = shapes.get(key_ids) or self._shape(key_ids)
+                rows[strings[row_ids[i]]] = dict(zip(keys, map(get_string,
+                                                               ids[1::2])))
+            else:
+                rows[strings[row_ids[i]]] = self._decode(value_pos)[0]
+        return rows
+
+    def _unpacker(self, count):
+        "Get a function that unpacks count u32 integers"
+        unpack = self._unpackers.get(count)
+        if unpack is None:
+            unpack = struct.Struct("<%dI" % count).unpack_from
+            self._unpackers[count] = unpack
+        return unpack
+
+    def _shape(self, key_ids):
+        """Get the decoded keys of a string map.
+        :param key_ids: (tuple) string ids of the keys
+        :return: list of (string)
+        """
+        keys = self._shapes.get(key_ids)
+        if keys is None:
+            keys = [self.string(i) for i in key_ids]
+            self._shapes[key_ids] = keys
+        return keys
+
+    def _decode(self, pos):
+        tag, number = _TAGGED.unpack_from(self._buf, pos)
+        pos += _TAGGED.size
+        if tag == TAG_STRMAP:
+            ids = self._unpacker(2 * number)(self._buf, pos)
+            if isinstance(self._strings, list):
+                strings = self._strings
+                values = [strings[i] for i in ids[1::2]]
+            else:
+                string = self.string
+                values = [string(i) for i in ids[1::2]]
+            value = dict(zip(self._shape(ids[0::2]), values))
+            return value, pos + 2 * number * _U32.size
+        if tag == TAG_STRLIST:
+            ids = self._unpacker(number)(self._buf, pos)
+            if isinstance(self._strings, list):
+                value = list(map(self._strings.__getitem__, ids))
+            else:
+                value = list(map(self.string, ids))
+            return value, pos + number * _U32.size
+        if tag == TAG_STR:
+            return self.string(number), pos
+        if tag == TAG_JSON:
+            # Scalars are immutable, they can be shared
+            if number not in self._json:
+                self._json[number] = json.loads(self.string(number))
+            return self._json[number], pos
+        if tag == TAG_MAP:
+            value = {}
+            for _ in range(number):
+                key_id = _U32.unpack_from(self._buf, pos)[0]
+                value[self.string(key_id)], pos = self._decode(pos + _U32.size)
+            return value, pos
+        if tag == TAG_LIST:
+            value = []
+            for _ in range(number):
+                item, pos = self._decode(pos)
+                value.append(item)
+            return value, pos
+        raise SnapshotError("Corrupted snapshot %s: unknown tag %d" %
+                            (self.path, tag))
+
+
+def _utf8(string):
+    if isinstance(string, bytes):
+        return string
+    return string.encode("utf-8")
+
+
+def save_inventory(inventory, path, compress=False):
+    """Save an inventory in a snapshot.
+    :param inventory: (dict) inventory in Ansible's dynamic inventory format
+    :param path: (string) file name
+    :param compress: (bool) compress the snapshot
+    """
+    writer = SnapshotWriter()
+    writer.add_table("hostvars", inventory.get("_meta", {}).get("hostvars", {}))
+    writer.add_table("groups", dict((name, group) for name, group in inventory.items()
+                                    if name != "_meta"))
+    writer.save(path, compress=compress)
+
+
+def load_inventory(path):
+    """Load an inventory from a snapshot.
+    :param path: (string) file name
+    :return: (dict) inventory in Ansible's dynamic inventory format
+    """
+    with Snapshot(path) as snapshot:
+        inventory = snapshot.load("groups")
+        inventory["_meta"] = {"hostvars": snapshot.load("hostvars")}
+    return inventory
+
+
+def load_hostvars(path, hostname):
+    """Load the variables of a single host from an inventory snapshot.
+    :param path: (string) file name
+    :param hostname: (string) name of the host
+    :return: (dict) host variables, None if the host is not in the snapshot
+    """
+    with Snapshot(path) as snapshot:
+        return snapshot.get("hostvars", hostname)
+
+
+def save_platform_state(path, servers, volumes, networks=None, info=None,
+                        compress=False):
+    """Save the state of an OpenStack platform in a snapshot.
+    :param path: (string) file name
+    :param servers: list of (dict) servers, see openstack_utils.server_info
+    :param volumes: list of (dict) volumes, see openstack_utils.volume_info
+    :param networks: list of (dict) networks with "id" and "label" keys
+    :param info: (dict) additional information, e.g. date of the snapshot
+    :param compress: (bool) compress the snapshot
+    """
+    writer = SnapshotWriter()
+    writer.add_table("servers", dict((s["id"], s) for s in servers))
+    writer.add_table("volumes", dict((v["id"], v) for v in volumes))
+    writer.add_table("networks", dict((n["id"], n) for n in networks or []))
+    writer.add_table("info", info or {})
+    writer.save(path, compress=compress)
+
+
+def load_platform_state(path):
+    """Load the state of an OpenStack platform from a snapshot.
+    :param path: (string) file name
+    :return: (dict) with "servers", "volumes", "networks" lists and "info"
+    """
+    with Snapshot(path) as snapshot:
+        return {"servers": list(snapshot.load("servers").values()),
+                "volumes": list(snapshot.load("volumes").values()),
+                "networks": list(snapshot.load("networks").values()),
+                "info": snapshot.load("info")}
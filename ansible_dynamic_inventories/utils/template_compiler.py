@@ -0,0 +1,280 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compiled inventory templates.
+# A template is validated once, then its group hierarchy is resolved: the
+# ancestors of every group. The compiled template is cached in a file, keyed
+# by the modification time, size and SHA1 of the template file. The template
+# is only parsed again when its content changes.
+# The cache is written with marshal, which decodes several times faster than
+# JSON (see benchmarks/bench_template.py). The marshal format depends on the
+# Python version, so a cache written by another version is rebuilt. Under
+# Python 2, ASCII strings are cached as interned str: marshal stores them once
+# and does not decode them.
+#
+
+import hashlib
+import json
+import marshal
+import os
+import sys
+import tempfile
+
+from ansible_dynamic_inventories.utils import *
+
+COMPILED_VERSION = 3
+
+try:
+    _UNICODE = unicode
+    _intern = intern
+except NameError:
+    _UNICODE = None
+
+GROUP_KEYS = ("hosts", "children", "vars")
+
+
+class TemplateError(Exception):
+    pass
+
+
+def _group(template, name):
+    "Get a group of a template as a dict, empty if it is not a JSON object"
+    group = template.get(name)
+    return group if isinstance(group, dict) else {}
+
+
+def validate_template(template):
+    """Check the structure of a template. Ansible accepts some templates
+    that do not follow the usual structure, so only warnings are returned.
+    :param template: (dict) template
+    :return: list of (string) warnings
+    Raise TemplateError if the template is not a JSON object.
+    """
+    if not isinstance(template, dict):
+        raise TemplateError("Template must be a JSON object")
+    warnings = []
+    for name, group in sorted(template.items()):
+        if name == "_meta":
+            continue
+        if not isinstance(group, dict):
+            warnings.append("Group %s is not a JSON object" % name)
+            continue
+        unknown = set(group) - set(GROUP_KEYS)
+        if unknown:
+            warnings.append("Group %s: unknown keys %s" %
+                            (name, ', '.join(sorted(unknown))))
+        for key in ("hosts", "children"):
+            if key in group and not isinstance(group[key], list):
+                warnings.append("Group %s: %s is not a list" % (name, key))
+        if "vars" in group and not isinstance(group["vars"], dict):
+            warnings.append("Group %s: vars is not a JSON object" % name)
+    return warnings
+
+
+def _children(template, name):
+    children = _group(template, name).get("children")
+    return children if isinstance(children, list) else []
+
+
+def _find_cycle(template):
+    """Find a cycle in the group hierarchy.
+    :return: list of group names forming a cycle, None if there is none
+    """
+    visiting, visited = set(), set()
+
+    def visit(name, path):
+        if name in visiting:
+            return path[path.index(name):] + [name]
+        if name in visited:
+            return None
+        visiting.add(name)
+        for child in _children(template, name):
+            cycle = visit(child, path + [name])
+            if cycle:
+                return cycle
+        visiting.discard(name)
+        visited.add(name)
+        return None
+
+    for name in sorted(template):
+        cycle = visit(name, [])
+        if cycle:
+            return cycle
+    return None
+
+
+def compile_template(template):
+    """Validate a template and resolve its group hierarchy.
+    Warnings about the structure of the template are written on stderr.
+    :param template: (dict) template
+    :return: (dict) compiled template with keys:
+             groups: the groups of the template
+             ancestors: group name to the sorted list of its ancestors,
+                        'all' included
+    Raise TemplateError if the template is not a JSON object or its group
+    hierarchy has a cycle.
+    """
+    for warning in validate_template(template):
+        sys.stderr.write("Warning: template: %s\n" % warning)
+    cycle = _find_cycle(template)
+    if cycle:
+        raise TemplateError("Cycle in group hierarchy: %s" % " -> ".join(cycle))
+
+    names = set(name for name in template if name != "_meta")
+    for name in list(names):
+        names.update(_children(template, name))
+    names.add("all")
+    parents = dict((name, set()) for name in names)
+    for name in names:
+        for child in _children(template, name):
+            parents[child].add(name)
+
+    ancestors = {}
+
+    def get_ancestors(name):
+        if name not in ancestors:
+            result = set()
+            for parent in parents[name]:
+                result.add(parent)
+                result.update(get_ancestors(parent))
+            if name != "all":
+                result.add("all")
+            ancestors[name] = result
+        return ancestors[name]
+
+    for name in names:
+        get_ancestors(name)
+
+    return {"groups": template,
+            "ancestors": dict((name, sorted(a)) for name, a in ancestors.items())}
+
+
+def get_cache_file(template_file, cache_dir=DEFAULT_TEMPLATE_CACHE_DIR):
+    """Get the cache file of a compiled template.
+    :param template_file: (string) template file name
+    :param cache_dir: (string) cache directory
+    :return: (string) cache file name
+    """
+    key = hashlib.sha1(os.path.abspath(template_file).encode("utf-8")).hexdigest()
+    return os.path.join(os.path.expanduser(cache_dir),
+                        "template-%s.cache" % key[:16])
+
+
+def _native_strings(value):
+    "Convert the ASCII unicode strings of a JSON value to interned str"
+    if isinstance(value, _UNICODE):
+        try:
+            return _intern(value.encode("ascii"))
+        except UnicodeError:
+            return value
+    if isinstance(value, dict):
+        return dict((_native_strings(k), _native_strings(v))
+                    for k, v in value.items())
+    if isinstance(value, list):
+        return [_native_strings(item) for item in value]
+    return value
+
+
+def _cache_version():
+    return (COMPILED_VERSION, marshal.version, tuple(sys.version_info[:2]))
+
+
+def _save_compiled(cache_file, compiled, stat, digest):
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    if _UNICODE is not None:
+        compiled = _native_strings(compiled)
+    data = marshal.dumps((_cache_version(), stat.st_mtime, stat.st_size,
+                          digest, compiled))
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, cache_file)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _load_cache(cache_file):
+    """Read a cache file.
+    :return: (tuple) (mtime, size, SHA1, compiled template) of the cached
+             template, None if the cache is missing, corrupted or written by
+             another version
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            cached = marshal.loads(f.read())
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if (not isinstance(cached, tuple) or len(cached) != 5 or
+            cached[0] != _cache_version()):
+        return None
+    return cached[1:]
+
+
+def load_compiled_template(template_file, cache_file=None):
+    """Get the compiled version of a template file, from the cache if the
+    file did not change.
+    :param template_file: (string) template file name
+    :param cache_file: (string) cache file name. Default is a file in
+                       DEFAULT_TEMPLATE_CACHE_DIR.
+    :return: (dict) compiled template, see compile_template. Every call
+             returns new objects, which the caller can modify.
+    Raise TemplateError if the template is not valid JSON or has a cycle.
+    """
+    template_file = os.path.abspath(os.path.expanduser(template_file))
+    cache_file = os.path.expanduser(cache_file or get_cache_file(template_file))
+    stat = os.stat(template_file)
+    cached = _load_cache(cache_file)
+    if cached is not None:
+        mtime, size, cached_digest, compiled = cached
+        if mtime == stat.st_mtime and size == stat.st_size:
+            return compiled
+    with open(template_file, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    if cached is not None and cached_digest == digest:
+        # Touched but not modified
+        _try_save(cache_file, compiled, stat, digest)
+        return compiled
+
+    try:
+        template = json.loads(content.decode("utf-8"))
+    except ValueError as e:
+        raise TemplateError("Invalid template %s: %s" % (template_file, e))
+    compiled = compile_template(template)
+    _try_save(cache_file, compiled, stat, digest)
+    return compiled
+
+
+def _try_save(cache_file, compiled, stat, digest):
+    # The cache is an optimization: a read-only location must not prevent
+    # the inventory from being generated
+    try:
+        _save_compiled(cache_file, compiled, stat, digest)
+    except (IOError, OSError):
+        pass
+
+
+def inventory_from_compiled(compiled):
+    """Get the groups of an inventory from a compiled template.
+    The groups are not copied: load_compiled_template returns new objects
+    on every call.
+    :param compiled: (dict) compiled template
+    :return: (dict) groups
+    """
+    return compiled["groups"]
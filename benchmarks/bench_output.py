@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compare serialization time and peak memory of the inventory output formats
+# on a synthetic inventory.
+# Each format is measured in its own process, so that the peak memory of one
+# run does not hide the others.
+#
+# Usage:
+#     python bench_output.py [-n hosts]
+#
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ansible_dynamic_inventories.utils.output import *
+
+
+class CountingStream(object):
+    "File-like object that only counts the written characters"
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def make_hosts(count):
+    "Generate synthetic (hostname, groups, variables) tuples"
+    for i in range(count):
+        hostname = "host-%05d" % i
+        variables = {"ansible_host": "10.%d.%d.%d" % (i // 65536, (i // 256) % 256, i % 256),
+                     "ansible_hostname": hostname,
+                     "ansible_user": "ubuntu",
+                     "ansible_port": "22",
+                     "ansible_private_key_file": "/home/ubuntu/keys/project.pem",
+                     "openstack_flavor_id": "m1.medium",
+                     "openstack_image_id": "ubuntu-16.04",
+                     "openstack_network_id": "private",
+                     "app_role": "role-%d" % (i % 7)}
+        yield hostname, ["group-%d" % (i % 50), "all_vms"], variables
+
+
+def make_inventory(count):
+    "Generate a synthetic inventory"
+    inventory = {"_meta": {"hostvars": {}}}
+    for hostname, groups, variables in make_hosts(count):
+        for group in groups:
+            inventory.setdefault(group, {"hosts": []})["hosts"].append(hostname)
+        inventory["_meta"]["hostvars"][hostname] = variables
+    return inventory
+
+
+def max_rss():
+    "Peak resident memory of the current process, in KB"
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        usage /= 1024
+    return usage
+
+
+def run(output_format, count):
+    "Measure one output format, print 'time_in_seconds peak_memory_in_KB size'"
+    stream = CountingStream()
+    if output_format == "stream-generator":
+        # Hosts are serialized as they are produced, the inventory is never
+        # built in memory
+        baseline = max_rss()
+        start = time.time()
+        stream_inventory({}, make_hosts(count), stream)
+    else:
+        inventory = make_inventory(count)
+        baseline = max_rss()
+        start = time.time()
+        if output_format == "print":
+            # Historical path of openstack_inventory.py
+            stream.write(json.dumps(inventory, indent=2))
+        else:
+            write_inventory(inventory, stream, output_format)
+    elapsed = time.time() - start
+    print("%f %d %d" % (elapsed, max_rss() - baseline, stream.size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inventory output')
+    parser.add_argument('-n', '--hosts', type=int, default=10000,
+                        help="Number of hosts (default: 10000)")
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        run(args.run, args.hosts)
+        return
+
+    print("Hosts: %d, ujson: %s" % (args.hosts, ujson is not None))
+    print("%-18s %10s %16s %12s" % ("format", "time (s)", "peak mem (KB)", "size (B)"))
+    for output_format in ("print",) + OUTPUT_FORMATS + ("stream-generator",):
+        result = subprocess.check_output([sys.executable, __file__,
+                                          "--hosts", str(args.hosts),
+                                          "--run", output_format])
+        elapsed, memory, size = result.split()
+        print("%-18s %10.3f %16s %12s" % (output_format, float(elapsed),
+                                          memory.decode(), size.decode()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compare the time needed to read the synthetic inventory of bench_output.py
+# from a JSON file and from a snapshot:
+#   json.load:        whole inventory from JSON
+#   snapshot:         whole inventory from an uncompressed snapshot (--list)
+#   snapshot-zlib:    whole inventory from a compressed snapshot
+#   snapshot-host:    variables of a single host (--host)
+# Each measure is the best of several runs.
+#
+# Usage:
+#     python bench_snapshot.py [-n hosts] [-r runs]
+#
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ansible_dynamic_inventories.utils.snapshot import load_hostvars, load_inventory, save_inventory
+from bench_output import make_inventory
+
+
+def best_time(function, runs):
+    "Best wall time of several calls of a function, in seconds"
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inventory snapshots')
+    parser.add_argument('-n', '--hosts', type=int, default=10000,
+                        help="Number of hosts (default: 10000)")
+    parser.add_argument('-r', '--runs', type=int, default=10,
+                        help="Number of runs of each measure (default: 10)")
+    args = parser.parse_args()
+
+    inventory = make_inventory(args.hosts)
+    host = sorted(inventory["_meta"]["hostvars"])[args.hosts // 2]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        json_file = os.path.join(tmp_dir, "inventory.json")
+        snapshot_file = os.path.join(tmp_dir, "inventory.snapshot")
+        zlib_file = os.path.join(tmp_dir, "inventory-zlib.snapshot")
+        with open(json_file, "w") as f:
+            json.dump(inventory, f)
+        save_inventory(inventory, snapshot_file)
+        save_inventory(inventory, zlib_file, compress=True)
+
+        def load_json():
+            with open(json_file) as f:
+                json.load(f)
+
+        print("Hosts: %d" % args.hosts)
+        print("%-14s %10s %12s" % ("path", "time (ms)", "size (B)"))
+        for name, function, path in (
+                ("json.load", load_json, json_file),
+                ("snapshot", lambda: load_inventory(snapshot_file),
+                 snapshot_file),
+                ("snapshot-zlib", lambda: load_inventory(zlib_file), zlib_file),
+                ("snapshot-host", lambda: load_hostvars(snapshot_file, host),
+                 snapshot_file)):
+            print("%-14s %10.2f %12d" % (name, best_time(function, args.runs) * 1000,
+                                         os.path.getsize(path)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
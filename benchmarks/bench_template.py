@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compare the time needed to get the groups of a synthetic template:
+#   json.load:  parsing the template file, without compiling it
+#   compile:    parsing and compiling the template (cache miss)
+#   cached:     loading the compiled template from its cache
+# Each measure is the best of several runs.
+#
+# Usage:
+#     python bench_template.py [-n groups] [-r runs]
+#
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ansible_dynamic_inventories.utils import template_compiler as tc
+
+
+def make_template(count):
+    "Generate a synthetic template: a random tree of groups with variables"
+    rand = random.Random(0)
+    template = {}
+    for i in range(count):
+        variables = dict(("var_%d" % j, "value-%d-%d" % (i, j)) for j in range(5))
+        variables["port"] = i
+        template["group-%05d" % i] = {"hosts": [], "vars": variables}
+    for i in range(1, count):
+        parent = template["group-%05d" % rand.randrange(0, i)]
+        parent.setdefault("children", []).append("group-%05d" % i)
+    return template
+
+
+def best_time(function, runs):
+    "Best wall time of several calls of a function, in seconds"
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark template loading')
+    parser.add_argument('-n', '--groups', type=int, default=2000,
+                        help="Number of groups (default: 2000)")
+    parser.add_argument('-r', '--runs', type=int, default=20,
+                        help="Number of runs of each measure (default: 20)")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        template_file = os.path.join(tmp_dir, "template.json")
+        cache_file = os.path.join(tmp_dir, "template.cache")
+        with open(template_file, "w") as f:
+            json.dump(make_template(args.groups), f)
+
+        def load_json():
+            with open(template_file) as f:
+                json.load(f)
+
+        def compile_template():
+            os.remove(cache_file)
+            tc.load_compiled_template(template_file, cache_file)
+
+        tc.load_compiled_template(template_file, cache_file)
+        print("Groups: %d, size: %d bytes" % (args.groups,
+                                              os.path.getsize(template_file)))
+        print("%-10s %10s" % ("path", "time (ms)"))
+        for name, function in (("json.load", load_json),
+                               ("compile", compile_template),
+                               ("cached", lambda: tc.load_compiled_template(
+                                   template_file, cache_file))):
+            print("%-10s %10.1f" % (name, best_time(function, args.runs) * 1000))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
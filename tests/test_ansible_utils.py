@@ -0,0 +1,112 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of the factoring of host variables in utils/ansible_utils.py,
+# which imports Ansible.
+#
+
+import copy
+import json
+import unittest
+
+try:
+    from ansible_dynamic_inventories.utils import ansible_utils as au
+except ImportError:
+    au = None
+
+
+def size(inventory):
+    return len(json.dumps(inventory, separators=(',', ':')))
+
+
+def hostvars(*hosts, **variables):
+    return dict((host, dict(variables)) for host in hosts)
+
+
+@unittest.skipIf(au is None, "Ansible is not installed")
+class FactorHostvarsTest(unittest.TestCase):
+
+    def factor(self, inventory):
+        before = size(inventory)
+        stats = au.factor_hostvars(inventory)
+        self.assertEqual(stats["saved_bytes"], before - size(inventory))
+        return stats
+
+    def test_hoist(self):
+        inventory = {"web": {"hosts": ["web-1", "web-2", "web-3"]},
+                     "db": {"hosts": ["db-1"]},
+                     "_meta": {"hostvars": hostvars("web-1", "web-2", "web-3",
+                                                    user="ubuntu", port=80)}}
+        inventory["_meta"]["hostvars"]["web-1"]["ansible_host"] = "10.0.0.1"
+        inventory["_meta"]["hostvars"]["db-1"] = {"port": 5432}
+        stats = self.factor(inventory)
+        self.assertEqual(stats["hoisted_vars"], 2)
+        self.assertEqual(stats["removed_hostvars"], 6)
+        self.assertEqual(inventory["web"]["vars"], {"user": "ubuntu",
+                                                    "port": 80})
+        self.assertEqual(inventory["_meta"]["hostvars"],
+                         {"web-1": {"ansible_host": "10.0.0.1"},
+                          "web-2": {}, "web-3": {}, "db-1": {"port": 5432}})
+
+    def test_child_overrides_parent(self):
+        # front is a child of web and sets its own port for web-1: hoisting
+        # the port of the hosts into web would give web-1 the port of front
+        inventory = {"web": {"hosts": ["web-1", "web-2"],
+                             "children": ["front"]},
+                     "front": {"hosts": ["web-1"], "vars": {"port": 443}},
+                     "_meta": {"hostvars": hostvars("web-1", "web-2",
+                                                    port=8080)}}
+        expected = copy.deepcopy(inventory)
+        stats = self.factor(inventory)
+        self.assertEqual(stats["hoisted_vars"], 0)
+        self.assertEqual(inventory, expected)
+
+    def test_override_parent(self):
+        # Hoisting into a child is allowed: it takes precedence over web
+        inventory = {"web": {"children": ["front"], "vars": {"port": 80}},
+                     "front": {"hosts": ["web-1", "web-2"]},
+                     "_meta": {"hostvars": hostvars("web-1", "web-2",
+                                                    port=8080)}}
+        self.factor(inventory)
+        self.assertEqual(inventory["front"]["vars"], {"port": 8080})
+        self.assertEqual(inventory["web"]["vars"], {"port": 80})
+
+    def test_sibling_conflict(self):
+        # app and db are siblings: hoisting port=5432 into app (or all)
+        # would let the value of db take precedence for db-1 and db-2
+        inventory = {"app": {"hosts": ["app-1", "db-1", "db-2"]},
+                     "db": {"hosts": ["db-1", "db-2"], "vars": {"port": 3306}},
+                     "_meta": {"hostvars": hostvars("app-1", "db-1", "db-2",
+                                                    port=5432)}}
+        self.factor(inventory)
+        self.assertNotIn("vars", inventory["app"])
+        self.assertNotIn("all", inventory)
+        self.assertEqual(inventory["db"]["vars"], {"port": 5432})
+        self.assertEqual(inventory["_meta"]["hostvars"],
+                         {"app-1": {"port": 5432}, "db-1": {}, "db-2": {}})
+
+    def test_no_size_reduction(self):
+        inventory = {"a": {"hosts": ["h1", "h2"]},
+                     "b": {"hosts": ["h1", "h2"]},
+                     "_meta": {"hostvars": hostvars("h1", "h2", v=1)}}
+        expected = copy.deepcopy(inventory)
+        stats = self.factor(inventory)
+        self.assertEqual(stats, {"hoisted_vars": 0, "removed_hostvars": 0,
+                                 "saved_bytes": 0})
+        self.assertEqual(inventory, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
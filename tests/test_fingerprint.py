@@ -0,0 +1,116 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/fingerprint.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ansible_dynamic_inventories.utils import fingerprint as fp
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.inventory = os.path.join(self.tmp_dir, "hosts")
+        with open(self.inventory, "w") as f:
+            f.write("[web]\nweb-1\n")
+        self.path = os.path.join(self.tmp_dir, "record", "applied.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fingerprint(self):
+        configs = {"Default": {"namespace": "test_"}}
+        fingerprint = fp.inventory_fingerprint(self.inventory, configs)
+        same = {"Default": {"namespace": "test_"}}
+        self.assertEqual(fp.inventory_fingerprint(self.inventory, same),
+                         fingerprint)
+        self.assertNotEqual(fp.inventory_fingerprint(self.inventory, {}),
+                            fingerprint)
+        with open(self.inventory, "a") as f:
+            f.write("web-2\n")
+        self.assertNotEqual(fp.inventory_fingerprint(self.inventory, configs),
+                            fingerprint)
+
+    def test_no_record(self):
+        record = fp.AppliedRecord(self.path)
+        key = fp.AppliedRecord.get_key("push", self.inventory, {})
+        self.assertFalse(record.matches(key, "sha1"))
+        # Forgetting an unknown inventory does not create the file
+        record.forget(key)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_round_trip(self):
+        record = fp.AppliedRecord(self.path)
+        push = fp.AppliedRecord.get_key("push", self.inventory, {})
+        upload = fp.AppliedRecord.get_key("upload", self.inventory, {})
+        record.record(push, "sha1")
+        record.record(upload, "sha2")
+        self.assertEqual(os.listdir(os.path.dirname(self.path)),
+                         ["applied.json"])
+
+        record = fp.AppliedRecord(self.path)
+        self.assertTrue(record.matches(push, "sha1"))
+        self.assertFalse(record.matches(push, "sha2"))
+        self.assertTrue(record.matches(upload, "sha2"))
+        record.forget(push)
+        record = fp.AppliedRecord(self.path)
+        self.assertFalse(record.matches(push, "sha1"))
+        self.assertTrue(record.matches(upload, "sha2"))
+
+    def test_platform(self):
+        configs = {"Authentication": {"os_auth_url": "http://keystone:5000",
+                                      "os_username": "admin",
+                                      "os_tenant_name": "dev"}}
+        saved = dict(os.environ)
+        try:
+            for name in ("OS_AUTH_URL", "OS_USERNAME", "OS_TENANT_ID",
+                         "OS_TENANT_NAME"):
+                os.environ.pop(name, None)
+            key = fp.AppliedRecord.get_key("push", self.inventory, configs)
+            self.assertIn("admin@dev@http://keystone:5000", key)
+            # Another tenant, e.g. after sourcing its openrc.sh
+            os.environ["OS_TENANT_NAME"] = "prod"
+            other = fp.AppliedRecord.get_key("push", self.inventory, configs)
+            self.assertNotEqual(other, key)
+            os.environ["OS_TENANT_ID"] = "1234"
+            self.assertIn("admin@1234@",
+                          fp.AppliedRecord.get_key("push", self.inventory,
+                                                   configs))
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+        record = fp.AppliedRecord(self.path)
+        record.record(key, "sha1")
+        self.assertFalse(fp.AppliedRecord(self.path).matches(other, "sha1"))
+
+    def test_corrupted_record(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write('{"push:')
+        record = fp.AppliedRecord(self.path)
+        self.assertEqual(record.entries, {})
+        record.record("push:hosts", "sha1")
+        self.assertTrue(fp.AppliedRecord(self.path).matches("push:hosts",
+                                                            "sha1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
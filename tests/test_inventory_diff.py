@@ -0,0 +1,136 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/inventory_diff.py
+# inventory_diff uses the group hierarchy of ansible_utils, which imports
+# Ansible.
+#
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from ansible_dynamic_inventories.utils import snapshot as sn
+
+try:
+    from ansible_dynamic_inventories.utils import inventory_diff as idf
+except ImportError:
+    idf = None
+
+INVENTORY = {
+    "web": {"hosts": ["web-1", "web-2"], "vars": {"port": 80},
+            "children": ["front"]},
+    "front": {"hosts": ["web-1"], "vars": {"port": 443}},
+    "db": {"hosts": ["db-1"]},
+    "_meta": {"hostvars": {"web-1": {"ansible_host": "10.0.0.1"},
+                           "web-2": {"ansible_host": "10.0.0.2"},
+                           "db-1": {"ansible_host": "10.0.0.3",
+                                    "port": 5432}}}
+}
+
+NO_CHANGES = {"added_hosts": [], "removed_hosts": [], "groups": {},
+              "hostvars": {}, "changed_hosts": []}
+
+
+@unittest.skipIf(idf is None, "Ansible is not installed")
+class DiffInventoriesTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(idf.diff_inventories({}, {}), NO_CHANGES)
+        changes = idf.diff_inventories({}, INVENTORY)
+        self.assertEqual(changes["added_hosts"], ["db-1", "web-1", "web-2"])
+        self.assertEqual(changes["changed_hosts"], changes["added_hosts"])
+        self.assertEqual(changes["groups"]["front"],
+                         {"added_hosts": ["web-1"], "removed_hosts": []})
+        self.assertEqual(idf.diff_inventories(INVENTORY, {})["removed_hosts"],
+                         ["db-1", "web-1", "web-2"])
+
+    def test_same_inventory(self):
+        self.assertEqual(idf.diff_inventories(INVENTORY,
+                                              copy.deepcopy(INVENTORY)),
+                         NO_CHANGES)
+
+    def test_effective_variables(self):
+        hosts = idf.effective_hosts(INVENTORY)
+        groups, variables = hosts["web-1"]
+        self.assertEqual(groups, set(["all", "web", "front"]))
+        # front is a child of web: its variables take precedence
+        self.assertEqual(variables, {"ansible_host": "10.0.0.1", "port": 443})
+        self.assertEqual(hosts["web-2"][1]["port"], 80)
+
+    def test_factored_variables(self):
+        # Variables moved from the hosts to their group
+        old = {"db": {"hosts": ["db-1", "db-2"]},
+               "_meta": {"hostvars": {"db-1": {"port": 5432},
+                                      "db-2": {"port": 5432}}}}
+        new = {"db": {"hosts": ["db-1", "db-2"], "vars": {"port": 5432}},
+               "_meta": {"hostvars": {"db-1": {}, "db-2": {}}}}
+        self.assertEqual(idf.diff_inventories(old, new), NO_CHANGES)
+
+    def test_changes(self):
+        new = copy.deepcopy(INVENTORY)
+        new["front"]["vars"]["port"] = 8443
+        new["db"]["hosts"].append("db-2")
+        new["_meta"]["hostvars"]["db-2"] = {"ansible_host": "10.0.0.4"}
+        new["web"]["hosts"].remove("web-2")
+        new["_meta"]["hostvars"]["web-2"]["user"] = "root"
+        changes = idf.diff_inventories(INVENTORY, new)
+        self.assertEqual(changes["added_hosts"], ["db-2"])
+        self.assertEqual(changes["removed_hosts"], [])
+        self.assertEqual(changes["groups"],
+                         {"db": {"added_hosts": ["db-2"], "removed_hosts": []},
+                          "web": {"added_hosts": [],
+                                  "removed_hosts": ["web-2"]}})
+        self.assertEqual(changes["hostvars"]["web-1"],
+                         {"added": {}, "removed": {},
+                          "changed": {"port": {"old": 443, "new": 8443}}})
+        self.assertEqual(changes["hostvars"]["web-2"],
+                         {"added": {"user": "root"}, "removed": {"port": 80},
+                          "changed": {}})
+        self.assertEqual(changes["changed_hosts"], ["db-2", "web-1", "web-2"])
+
+    def test_baseline_round_trip(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "baseline.snap")
+            sn.save_inventory(INVENTORY, path)
+            baseline = sn.load_inventory(path)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(idf.diff_inventories(baseline, INVENTORY),
+                         NO_CHANGES)
+
+    def test_limit_pattern(self):
+        self.assertEqual(idf.limit_pattern(["web-2", "db-1"]), "db-1,web-2")
+        self.assertEqual(idf.limit_pattern([]), idf.NO_HOSTS_PATTERN)
+
+    def test_restrict_inventory(self):
+        restricted = idf.restrict_inventory(INVENTORY, ["web-2"])
+        self.assertEqual(restricted["web"], {"hosts": ["web-2"],
+                                             "vars": {"port": 80},
+                                             "children": ["front"]})
+        self.assertEqual(restricted["front"]["hosts"], [])
+        self.assertEqual(restricted["_meta"]["hostvars"],
+                         {"web-2": {"ansible_host": "10.0.0.2"}})
+        # The original inventory is not modified
+        self.assertEqual(INVENTORY["web"]["hosts"], ["web-1", "web-2"])
+        self.assertEqual(idf.restrict_inventory({}, []),
+                         {"_meta": {"hostvars": {}}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/journal.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ansible_dynamic_inventories.utils import journal as jn
+
+PLAN = {"version": 1, "namespace": "test_",
+        "steps": [{"action": "create_vm", "name": "web-1"},
+                  {"action": "update_metadata", "id": "id-2",
+                   "metadata": {"test_groups": "web"}},
+                  {"action": "delete_vm", "id": "id-3", "volumes": []}]}
+
+
+class ApplyJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "journal", "apply.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_no_journal(self):
+        journal = jn.ApplyJournal(self.path)
+        self.assertFalse(journal.pending)
+        self.assertIsNone(journal.status(0))
+        self.assertEqual(journal.done_count(), 0)
+
+    def test_empty_plan(self):
+        journal = jn.ApplyJournal(self.path)
+        self.assertFalse(journal.begin({"steps": []}))
+        journal.finish()
+        journal = jn.ApplyJournal(self.path)
+        self.assertEqual(journal.plan, {"steps": []})
+        self.assertFalse(journal.pending)
+
+    def test_round_trip(self):
+        journal = jn.ApplyJournal(self.path)
+        self.assertFalse(journal.begin(PLAN))
+        journal.start(0)
+        journal.done(0, resource_id="id-1")
+        journal.start(1)
+        journal.fail(1, Exception("Quota exceeded"))
+        journal.close()
+
+        journal = jn.ApplyJournal(self.path)
+        self.assertTrue(journal.pending)
+        self.assertEqual(journal.plan, PLAN)
+        self.assertEqual(journal.plan_id, jn.get_plan_id(PLAN))
+        self.assertEqual(journal.status(0), jn.DONE)
+        self.assertEqual(journal.resource_id(0), "id-1")
+        self.assertEqual(journal.status(1), jn.FAILED)
+        self.assertEqual(journal.steps[1]["error"], "Quota exceeded")
+        self.assertIsNone(journal.status(2))
+        self.assertEqual(journal.done_count(), 1)
+
+    def test_resume(self):
+        journal = jn.ApplyJournal(self.path)
+        journal.begin(PLAN)
+        journal.start(0, name="web-1")
+        journal.close()
+        # Record partially written before a crash
+        with open(self.path, "a") as f:
+            f.write('{"type": "step", "index": 1, "sta')
+
+        journal = jn.ApplyJournal(self.path)
+        self.assertTrue(journal.pending)
+        self.assertEqual(journal.status(0), jn.STARTED)
+        self.assertEqual(journal.steps[0]["name"], "web-1")
+        self.assertIsNone(journal.status(1))
+        self.assertTrue(journal.begin(PLAN))
+        journal.done(0, resource_id="id-1")
+        for index in (1, 2):
+            journal.start(index)
+            journal.done(index)
+        journal.finish()
+
+        journal = jn.ApplyJournal(self.path)
+        self.assertFalse(journal.pending)
+        self.assertEqual(journal.done_count(), 3)
+        self.assertEqual(journal.resource_id(0), "id-1")
+
+    def test_other_plan(self):
+        journal = jn.ApplyJournal(self.path)
+        journal.begin(PLAN)
+        journal.close()
+        other = {"steps": PLAN["steps"][:1]}
+        journal = jn.ApplyJournal(self.path)
+        self.assertRaises(jn.JournalError, journal.begin, other)
+        journal.discard()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(journal.begin(other))
+        journal.close()
+        self.assertEqual(jn.ApplyJournal(self.path).plan, other)
+
+    def test_new_plan_after_complete(self):
+        journal = jn.ApplyJournal(self.path)
+        journal.begin(PLAN)
+        journal.finish()
+        other = {"steps": PLAN["steps"][:1]}
+        journal = jn.ApplyJournal(self.path)
+        self.assertFalse(journal.begin(other))
+        journal.close()
+        journal = jn.ApplyJournal(self.path)
+        self.assertTrue(journal.pending)
+        self.assertEqual(journal.plan, other)
+        self.assertEqual(journal.steps, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/metadata_codec.py
+#
+
+import random
+import unittest
+
+from ansible_dynamic_inventories.utils import metadata_codec as mc
+
+NS = "test_"
+
+VARIABLES = {"port": 80, "ratio": 0.5, "tls": True, "proxy": None,
+             "users": ["alice", "bob"], "disks": {"vdb": 10},
+             "motd": u"Bienvenue \xe0 bord"}
+
+
+class PackedEncodingTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        metadata = mc.encode_variables(VARIABLES, NS, encoding=mc.PACKED)
+        self.assertTrue(mc.is_packed(metadata, NS))
+        self.assertEqual(mc.unpack_variables(metadata, NS), VARIABLES)
+        metadata[NS + "groups"] = "web"
+        self.assertEqual(mc.get_metadata_variables(metadata, NS), VARIABLES)
+
+    def test_empty(self):
+        metadata = mc.pack_variables({}, NS)
+        self.assertEqual(mc.unpack_variables(metadata, NS), {})
+        self.assertEqual(mc.get_metadata_variables(metadata, NS), {})
+        self.assertEqual(mc.get_metadata_variables({}, NS), {})
+        self.assertIsNone(mc.unpack_variables({}, NS))
+
+    def test_chunks(self):
+        rand = random.Random(0)
+        variables = dict(("var%d" % i, "%x" % rand.getrandbits(128))
+                         for i in range(100))
+        metadata = mc.pack_variables(variables, NS)
+        self.assertTrue(len(metadata) > 2)
+        for value in metadata.values():
+            self.assertTrue(len(value) <= mc.CHUNK_SIZE)
+        self.assertEqual(mc.unpack_variables(metadata, NS), variables)
+
+    def test_corrupted(self):
+        metadata = mc.pack_variables(VARIABLES, NS)
+        broken = dict(metadata)
+        del broken[NS + mc.PACKED_KEY + "0"]
+        self.assertRaises(mc.MetadataDecodingError, mc.unpack_variables,
+                          broken, NS)
+        broken = dict(metadata)
+        broken[NS + mc.PACKED_KEY + "0"] = "not base64!"
+        self.assertRaises(mc.MetadataDecodingError, mc.unpack_variables,
+                          broken, NS)
+        broken = dict(metadata)
+        broken[NS + mc.PACKED_KEY] = "2:1"
+        self.assertRaises(mc.MetadataDecodingError, mc.unpack_variables,
+                          broken, NS)
+        broken[NS + mc.PACKED_KEY] = "1"
+        self.assertRaises(mc.MetadataDecodingError, mc.unpack_variables,
+                          broken, NS)
+
+
+class PlainEncodingTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        metadata = mc.encode_variables({"port": 80, "user": "root"}, NS)
+        self.assertEqual(metadata, {NS + "port": "80", NS + "user": "root"})
+        self.assertFalse(mc.is_packed(metadata, NS))
+        metadata[NS + "groups"] = "web"
+        metadata["other_port"] = "22"
+        self.assertEqual(mc.get_metadata_variables(metadata, NS),
+                         {"port": "80", "user": "root"})
+
+    def test_packed_precedence(self):
+        metadata = mc.encode_variables({"port": 80, "user": "root"}, NS)
+        metadata.update(mc.pack_variables({"port": 8080}, NS))
+        self.assertEqual(mc.get_metadata_variables(metadata, NS),
+                         {"port": 8080, "user": "root"})
+
+    def test_unknown_encoding(self):
+        self.assertRaises(ValueError, mc.encode_variables, VARIABLES, NS,
+                          "yaml")
+
+
+class DigestTest(unittest.TestCase):
+
+    def test_same_digest(self):
+        metadata = mc.add_digest({NS + "groups": "web", NS + "port": "80"},
+                                 NS, [("vdb", 10, None)])
+        other = mc.add_digest({NS + "port": "80", NS + "groups": "web"},
+                              NS, [("vdb", 10, None)])
+        self.assertTrue(mc.same_digest(metadata, other, NS))
+        # The digest item is not a variable
+        self.assertEqual(mc.get_metadata_variables(metadata, NS),
+                         {"port": "80"})
+
+    def test_changes(self):
+        metadata = {NS + "groups": "web", NS + "port": "80"}
+        digest = mc.metadata_digest(metadata, NS, [("vdb", 10, None)])
+        changed = dict(metadata)
+        changed[NS + "port"] = "22"
+        self.assertNotEqual(mc.metadata_digest(changed, NS,
+                                               [("vdb", 10, None)]), digest)
+        self.assertNotEqual(mc.metadata_digest(metadata, NS,
+                                               [("vdb", 20, None)]), digest)
+        self.assertNotEqual(mc.metadata_digest(metadata, NS), digest)
+        # Items of other namespaces and the order of volumes do not matter
+        other = dict(metadata)
+        other["other_port"] = "22"
+        volumes = [("vdc", 5, "ssd"), ("vdb", 10, None)]
+        self.assertEqual(mc.metadata_digest(other, NS, volumes),
+                         mc.metadata_digest(metadata, NS, volumes[::-1]))
+
+    def test_missing_digest(self):
+        self.assertFalse(mc.same_digest({}, {}, NS))
+        metadata = mc.add_digest({NS + "groups": "web"}, NS)
+        self.assertFalse(mc.same_digest(metadata, {NS + "groups": "web"}, NS))
+        self.assertFalse(mc.same_digest({NS + "groups": "web"}, metadata, NS))
+
+    def test_empty(self):
+        metadata = mc.add_digest({}, NS)
+        self.assertEqual(list(metadata), [NS + mc.DIGEST_KEY])
+        self.assertEqual(mc.metadata_digest(metadata, NS),
+                         metadata[NS + mc.DIGEST_KEY])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,286 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/notifications.py
+# Applying notifications needs the PlatformModel of utils/platform_model.py,
+# which imports Ansible.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ansible_dynamic_inventories.utils import notifications as nt
+
+try:
+    from ansible_dynamic_inventories.utils import platform_model as pm
+except ImportError:
+    pm = None
+
+NS = "ans:"
+
+
+def legacy_instance(event_type, vm_id, **fields):
+    payload = {"instance_id": vm_id, "display_name": "web-1",
+               "state": "active", "key_name": "key",
+               "metadata": {NS + "groups": "web", NS + "port": "80"},
+               "fixed_ips": [{"label": "net", "address": "10.0.0.1"}]}
+    payload.update(fields)
+    return {"event_type": event_type, "payload": payload}
+
+
+def versioned_instance(event_type, vm_id, **fields):
+    data = {"uuid": vm_id, "display_name": "web-1", "state": "active",
+            "key_name": "key",
+            "metadata": {NS + "groups": "web", NS + "port": "80"},
+            "ip_addresses": [{"nova_object.name": "IpPayload",
+                              "nova_object.data": {"label": "net",
+                                                   "address": "10.0.0.1"}}]}
+    data.update(fields)
+    return {"event_type": event_type,
+            "payload": {"nova_object.name": "InstanceUpdatePayload",
+                        "nova_object.data": data}}
+
+
+def volume(event_type, volume_id, **fields):
+    payload = {"volume_id": volume_id, "display_name": "web-1_vdb",
+               "size": 10, "volume_type": "ssd", "status": "available",
+               "metadata": [{"key": NS + "host", "value": "web-1"},
+                            {"key": NS + "device", "value": "vdb"}]}
+    payload.update(fields)
+    return {"event_type": event_type, "payload": payload}
+
+
+def envelope(notification):
+    return json.dumps({"oslo.version": "2.0",
+                       "oslo.message": json.dumps(notification)})
+
+
+class ParseNotificationTest(unittest.TestCase):
+
+    def test_parse(self):
+        notification = legacy_instance("compute.instance.update", "vm-1")
+        for value in (notification, json.dumps(notification),
+                      envelope(notification)):
+            event_type, payload = nt.parse_notification(value)
+            self.assertEqual(event_type, "compute.instance.update")
+            self.assertEqual(payload, notification["payload"])
+        self.assertEqual(nt.parse_notification({}), ("", {}))
+
+    def test_invalid(self):
+        for value in ('{"event_type": ', '[1, 2]', 3,
+                      {"oslo.message": "{"}):
+            self.assertRaises(nt.NotificationError, nt.parse_notification,
+                              value)
+
+    def test_instance_payload(self):
+        expected = {"id": "vm-1", "name": "web-1", "status": "ACTIVE",
+                    "key_name": "key",
+                    "metadata": {NS + "groups": "web", NS + "port": "80"},
+                    "networks": {"net": ["10.0.0.1"]}}
+        for notification in (legacy_instance("compute.instance.update", "vm-1"),
+                             versioned_instance("instance.update", "vm-1")):
+            self.assertEqual(nt.instance_from_payload(notification["payload"]),
+                             expected)
+        self.assertEqual(nt.instance_from_payload({"uuid": "vm-1"}),
+                         {"id": "vm-1"})
+
+    def test_volume_payload(self):
+        payload = volume("volume.attach.end", "vol-1", volume_attachment=[
+            {"instance_uuid": "vm-1", "mountpoint": "/dev/vdb",
+             "attach_status": "attached"},
+            {"instance_uuid": "vm-2", "mountpoint": "/dev/vdc",
+             "attach_status": "detached"}])["payload"]
+        self.assertEqual(nt.volume_from_payload(payload),
+                         {"id": "vol-1", "name": "web-1_vdb", "size": 10,
+                          "volume_type": "ssd",
+                          "metadata": {NS + "host": "web-1",
+                                       NS + "device": "vdb"},
+                          "attachments": [{"server_id": "vm-1",
+                                           "device": "/dev/vdb"}]})
+
+    def test_resource(self):
+        self.assertEqual(nt.notification_resource(
+            envelope(versioned_instance("instance.delete.end", "vm-1"))),
+            ("server", "vm-1"))
+        self.assertEqual(nt.notification_resource(
+            volume("volume.update.end", "vol-1")), ("volume", "vol-1"))
+        self.assertIsNone(nt.notification_resource(
+            {"event_type": "image.update", "payload": {"id": "img-1"}}))
+        self.assertIsNone(nt.notification_resource(
+            {"event_type": "volume.update.end", "payload": {}}))
+        self.assertIsNone(nt.notification_resource("not JSON"))
+
+
+@unittest.skipIf(pm is None, "Ansible is not installed")
+class ApplyNotificationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.platform = pm.PlatformModel(NS)
+
+    def apply(self, notification, fetch_server=None):
+        return nt.apply_notification(self.platform, notification,
+                                     fetch_server)
+
+    def test_create_and_delete_vm(self):
+        self.assertFalse(self.apply(
+            legacy_instance("compute.instance.create.start", "vm-1")))
+        self.assertTrue(self.apply(
+            legacy_instance("compute.instance.create.end", "vm-1")))
+        vm = self.platform.get_vm("vm-1")
+        self.assertEqual((vm.name, vm.status, vm.key_name, vm.networks),
+                         ("web-1", "ACTIVE", "key", {"net": ["10.0.0.1"]}))
+        self.assertTrue(self.apply(
+            envelope(versioned_instance("instance.delete.end", "vm-1"))))
+        self.assertIsNone(self.platform.get_vm("vm-1"))
+        self.assertFalse(self.apply(
+            legacy_instance("compute.instance.delete.end", "vm-1")))
+
+    def test_update_vm(self):
+        self.apply(legacy_instance("compute.instance.create.end", "vm-1"))
+        notification = versioned_instance(
+            "instance.update", "vm-1", state="stopped",
+            metadata={NS + "groups": "web", NS + "port": "8080"})
+        self.assertTrue(self.apply(notification))
+        vm = self.platform.get_vm("vm-1")
+        self.assertEqual(vm.status, "STOPPED")
+        self.assertEqual(vm.metadata[NS + "port"], "8080")
+        # Nothing changed
+        self.assertFalse(self.apply(notification))
+        # The groups metadata is removed: not a VM of the namespace anymore
+        self.assertTrue(self.apply(versioned_instance(
+            "instance.update", "vm-1", metadata={})))
+        self.assertIsNone(self.platform.get_vm("vm-1"))
+
+    def test_other_namespace(self):
+        self.assertFalse(self.apply(legacy_instance(
+            "compute.instance.create.end", "vm-1",
+            metadata={"other:groups": "web"})))
+        self.assertEqual(self.platform.vms, {})
+
+    def test_fetch_server(self):
+        fetched = []
+
+        def fetch_server(vm_id):
+            fetched.append(vm_id)
+            return {"id": vm_id, "name": "web-2", "status": "BUILD",
+                    "key_name": "key", "networks": {"net": ["10.0.0.2"]},
+                    "metadata": {}}
+
+        payload = {"uuid": "vm-2", "state": "active",
+                   "metadata": {NS + "groups": "web"}}
+        self.assertTrue(self.apply({"event_type": "instance.update",
+                                    "payload": {"nova_object.data": payload}},
+                                   fetch_server))
+        self.assertEqual(fetched, ["vm-2"])
+        vm = self.platform.get_vm("vm-2")
+        self.assertEqual((vm.name, vm.status, vm.networks),
+                         ("web-2", "ACTIVE", {"net": ["10.0.0.2"]}))
+
+    def test_volumes(self):
+        self.apply(legacy_instance("compute.instance.create.end", "vm-1"))
+        vm = self.platform.get_vm("vm-1")
+        self.assertTrue(self.apply(volume("volume.create.end", "vol-1")))
+        vol = self.platform.get_volume("vol-1")
+        self.assertEqual((vol.host, vol.device, vol.size), ("web-1", "vdb", 10))
+        self.assertEqual(self.platform.volumes_of(vm), [])
+
+        self.assertTrue(self.apply(volume(
+            "volume.attach.end", "vol-1", metadata=None, volume_attachment=[
+                {"instance_uuid": "vm-1", "mountpoint": "/dev/vdb"}])))
+        [(vol, device)] = self.platform.volumes_of(vm)
+        self.assertEqual((vol.id, vol.host, device), ("vol-1", "web-1", "vdb"))
+
+        self.assertTrue(self.apply(volume("volume.detach.end", "vol-1",
+                                          volume_attachment=[])))
+        self.assertEqual(self.platform.volumes_of(vm), [])
+        self.assertEqual(self.platform.get_volume("vol-1").host, "web-1")
+
+        self.assertTrue(self.apply(volume("volume.delete.end", "vol-1")))
+        self.assertIsNone(self.platform.get_volume("vol-1"))
+
+    def test_ignored(self):
+        self.assertFalse(self.apply({"event_type": "image.update",
+                                     "payload": {"id": "img-1"}}))
+        self.assertFalse(self.apply(volume("volume.create.end", "vol-1",
+                                           metadata={})))
+        self.assertRaises(nt.NotificationError, self.apply, "not JSON")
+
+
+class FileNotificationSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "notifications.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def append(self, data, path=None):
+        with open(path or self.path, "a") as f:
+            f.write(data)
+
+    def test_follow(self):
+        self.append('{"n": 0}\n')
+        source = nt.get_source("file://" + self.path)
+        try:
+            self.assertEqual(source.path, self.path)
+            # Only new notifications are read
+            self.assertEqual(source.poll(0), [])
+            self.append('{"n": 1}\n\n{"n": 2}\n{"n": ')
+            self.assertEqual(source.poll(0), ['{"n": 1}', '{"n": 2}'])
+            # The last line was partially written
+            self.assertEqual(source.poll(0), [])
+            self.append('3}\n')
+            self.assertEqual(source.poll(0), ['{"n": 3}'])
+        finally:
+            source.close()
+
+    def test_from_start(self):
+        source = nt.FileNotificationSource(self.path, from_start=True)
+        try:
+            # The file does not exist yet
+            self.assertEqual(source.poll(0), [])
+            self.append('{"n": 0}\n')
+            self.assertEqual(source.poll(0), ['{"n": 0}'])
+        finally:
+            source.close()
+
+    def test_rotation(self):
+        self.append('{"n": 0}\n')
+        source = nt.FileNotificationSource(self.path)
+        try:
+            self.assertEqual(source.poll(0), [])
+            self.append('{"n": 1}\n')
+            self.assertEqual(source.poll(0), ['{"n": 1}'])
+            # Renamed, then a new file is created: read from its beginning
+            os.rename(self.path, self.path + ".1")
+            self.append('{"n": 2}\n')
+            self.assertEqual(source.poll(0), ['{"n": 2}'])
+            self.append('{"n": 3}\n', self.path + ".1")
+            self.append('{"n": 4}\n')
+            self.assertEqual(source.poll(0), ['{"n": 4}'])
+            # Truncated in place
+            with open(self.path, "w") as f:
+                f.write('{"n": 5}\n')
+            self.assertEqual(source.poll(0), ['{"n": 5}'])
+        finally:
+            source.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/output.py and of the output_format configuration
+#
+
+import json
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from ansible_dynamic_inventories.utils import output
+from ansible_dynamic_inventories.utils.parse import to_bool, to_string
+
+INVENTORY = {"web": {"hosts": ["web-1"], "vars": {"url": "http://web/"}},
+             "db": {"hosts": []},
+             "_meta": {"hostvars": {"web-1": {"ansible_host": "10.0.0.1"},
+                                    "db-1": {"port": 5432}}}}
+
+
+def write(inventory, output_format):
+    stream = StringIO()
+    output.write_inventory(inventory, stream, output_format)
+    return stream.getvalue()
+
+
+class WriteInventoryTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for output_format in output.OUTPUT_FORMATS:
+            self.assertEqual(json.loads(write(INVENTORY, output_format)),
+                             INVENTORY)
+
+    def test_empty(self):
+        for output_format in output.OUTPUT_FORMATS:
+            self.assertEqual(json.loads(write({}, output_format)),
+                             {"_meta": {"hostvars": {}}}
+                             if output_format == "stream" else {})
+
+    def test_compact(self):
+        self.assertNotIn(" ", write({"web": {"hosts": ["a", "b"]}},
+                                    "compact"))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, write, INVENTORY, "yaml")
+
+    def test_stream_memberships(self):
+        stream = StringIO()
+        hosts = [("web-1", ["web"], {"port": 80}), ("db-1", {"port": 5432})]
+        output.stream_inventory({"web": {"vars": {"x": 1}}}, iter(hosts),
+                                stream)
+        self.assertEqual(json.loads(stream.getvalue()),
+                         {"web": {"vars": {"x": 1}, "hosts": ["web-1"]},
+                          "_meta": {"hostvars": {"web-1": {"port": 80},
+                                                 "db-1": {"port": 5432}}}})
+
+
+class ConfigValueTest(unittest.TestCase):
+
+    def test_to_string(self):
+        self.assertEqual(to_string('"compact"'), "compact")
+        self.assertEqual(to_string(' compact '), "compact")
+        self.assertEqual(to_string(None, "pretty"), "pretty")
+        self.assertEqual(to_string('', "pretty"), "pretty")
+        self.assertEqual(to_string('""', "pretty"), "pretty")
+
+    def test_to_bool(self):
+        self.assertTrue(to_bool('"yes"'))
+        self.assertTrue(to_bool("True"))
+        self.assertFalse(to_bool("off"))
+        self.assertFalse(to_bool('""'))
+        self.assertTrue(to_bool(None, default=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
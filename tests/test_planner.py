@@ -0,0 +1,173 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/planner.py
+# The models are filled directly with records, so that no inventory has to
+# be parsed. platform_model still imports Ansible.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ansible_dynamic_inventories.utils import metadata_codec as mc
+from ansible_dynamic_inventories.utils import planner
+
+try:
+    from ansible_dynamic_inventories.utils import platform_model as pm
+except ImportError:
+    pm = None
+
+NS = "test_"
+
+
+def make_host(name, groups="web", volumes=(), **variables):
+    metadata = {NS + "groups": groups}
+    metadata.update(mc.encode_variables(variables, NS))
+    volumes = [pm.VolumeSpec(name + "_" + device, name, device, size)
+               for device, size in volumes]
+    mc.add_digest(metadata, NS, pm.digest_volumes(volumes))
+    boot = pm.BootSpec("image", "flavor", "net")
+    return pm.HostRecord(name, "10.0.0.1", tuple(groups.split(",")), metadata,
+                         tuple(volumes), boot)
+
+
+def make_models(hosts):
+    inventory = pm.InventoryModel(NS)
+    for host in hosts:
+        inventory.hosts[host.name] = host
+    return inventory, pm.PlatformModel(NS)
+
+
+@unittest.skipIf(pm is None, "Ansible is not installed")
+class PlannerTest(unittest.TestCase):
+
+    def test_empty(self):
+        inventory, platform = make_models([])
+        plan = planner.compute_plan(inventory, platform)
+        self.assertEqual(plan["steps"], [])
+        self.assertEqual(plan["namespace"], NS)
+        self.assertEqual(planner.summarize_plan(plan), {})
+
+    def test_namespace_mismatch(self):
+        inventory = pm.InventoryModel(NS)
+        self.assertRaises(planner.PlanError, planner.compute_plan, inventory,
+                          pm.PlatformModel("other_"))
+
+    def test_create_and_delete(self):
+        inventory, platform = make_models([make_host("web-1",
+                                                     volumes=[("vdb", 10)])])
+        platform.add_vm("id-2", "web-2", {NS + "groups": "web"})
+        platform.add_volume_info("vol-2", "web-2_vdb", {NS + "host": "web-2"},
+                                 attachments=[{"server_id": "id-2",
+                                               "device": "/dev/vdb"}])
+        plan = planner.compute_plan(inventory, platform)
+        self.assertEqual([step["action"] for step in plan["steps"]],
+                         ["create_vm", "delete_vm", "create_volume"])
+        create, delete, volume = plan["steps"]
+        self.assertEqual(create["name"], "web-1")
+        self.assertEqual(create["metadata"], inventory.hosts["web-1"].metadata)
+        self.assertEqual(delete["volumes"], ["vol-2"])
+        self.assertEqual((volume["vm"], volume["vm_id"], volume["size"]),
+                         ("web-1", None, 10))
+
+    def test_up_to_date(self):
+        host = make_host("web-1", port=80)
+        inventory, platform = make_models([host])
+        platform.add_vm("id-1", "web-1", dict(host.metadata))
+        self.assertEqual(planner.compute_plan(inventory, platform)["steps"], [])
+
+    def test_update_metadata(self):
+        host = make_host("web-1", port=80)
+        inventory, platform = make_models([host])
+        platform.add_vm("id-1", "web-1", make_host("web-1", port=22,
+                                                   user="root").metadata)
+        steps = planner.compute_plan(inventory, platform)["steps"]
+        self.assertEqual(len(steps), 1)
+        self.assertEqual(steps[0]["action"], "update_metadata")
+        self.assertEqual(steps[0]["metadata"], host.metadata)
+        self.assertEqual(steps[0]["delete_keys"], [NS + "user"])
+
+    def test_trust_digest(self):
+        host = make_host("web-1", port=80)
+        inventory, platform = make_models([host])
+        # Same digest, but an item was changed by other means
+        metadata = dict(host.metadata)
+        metadata[NS + "port"] = "22"
+        platform.add_vm("id-1", "web-1", metadata)
+        self.assertEqual(planner.compute_plan(inventory, platform)["steps"], [])
+        steps = planner.compute_plan(inventory, platform,
+                                     trust_digest=False)["steps"]
+        self.assertEqual([step["action"] for step in steps],
+                         ["update_metadata"])
+
+    def test_volume_digest(self):
+        # openstack_upload_metadata.py gets the volumes from the variables
+        host = make_host("web-1", volumes=[("vdb", 10), ("vdc", 20)])
+        volumes = pm.get_volume_specs("web-1", {"openstack_volume_vdb": "10",
+                                                "openstack_volume_vdc": 20,
+                                                "port": 80})
+        metadata = dict((k, v) for k, v in host.metadata.items()
+                        if k != NS + mc.DIGEST_KEY)
+        mc.add_digest(metadata, NS, pm.digest_volumes(volumes))
+        self.assertTrue(mc.same_digest(metadata, host.metadata, NS))
+
+    def test_volumes(self):
+        host = make_host("web-1", volumes=[("vdb", 10), ("vdc", 20)])
+        inventory, platform = make_models([host])
+        platform.add_vm("id-1", "web-1", dict(host.metadata))
+        # vdb is attached under an old name, vdd is no longer in the
+        # inventory and web-1_vdc exists, detached
+        platform.add_volume_info("vol-b", "old_vdb", {NS + "host": "web-1"},
+                                 attachments=[{"server_id": "id-1",
+                                               "device": "/dev/vdb"}])
+        platform.add_volume_info("vol-d", "web-1_vdd", {NS + "host": "web-1"},
+                                 attachments=[{"server_id": "id-1",
+                                               "device": "/dev/vdd"}])
+        platform.add_volume_info("vol-c", "web-1_vdc", {NS + "host": "web-1"})
+        steps = planner.compute_plan(inventory, platform)["steps"]
+        self.assertEqual([(step["action"], step["id"]) for step in steps],
+                         [("delete_volume", "vol-d"),
+                          ("rename_volume", "vol-b"),
+                          ("attach_volume", "vol-c")])
+
+    def test_plan_from_snapshot(self):
+        host = make_host("web-1", port=80)
+        inventory, platform = make_models([host, make_host("web-2")])
+        platform.add_vm("id-1", "web-1", make_host("web-1", port=22).metadata)
+        platform.add_vm("id-3", "web-3", {NS + "groups": "web"})
+        platform.add_network("net-id", "net")
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "platform.snap")
+            platform.save(path)
+            loaded = pm.PlatformModel.load(path, NS)
+        finally:
+            shutil.rmtree(tmp_dir)
+        plan = planner.compute_plan(inventory, platform)
+        loaded_plan = planner.compute_plan(inventory, loaded)
+        self.assertEqual(loaded_plan["steps"], plan["steps"])
+        self.assertEqual(planner.summarize_plan(plan),
+                         {"create_vm": 1, "delete_vm": 1,
+                          "update_metadata": 1})
+        self.assertEqual(plan["steps"][0]["network"], "net-id")
+        # Plans are written to files
+        self.assertEqual(json.loads(json.dumps(plan))["steps"], plan["steps"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/profiler.py
+#
+
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from ansible_dynamic_inventories.utils import profiler
+
+F = ("f.py", 1, "f")
+G = ("g.py", 1, "g")
+H = ("h.py", 1, "h")
+
+
+def folded(stats):
+    stream = StringIO()
+    profiler.write_folded_stacks(stats, stream)
+    return dict((line.rsplit(" ", 1)[0], int(line.rsplit(" ", 1)[1]))
+                for line in stream.getvalue().splitlines())
+
+
+class FoldedStacksTest(unittest.TestCase):
+
+    def test_callers(self):
+        # f calls g for 3 s, h calls g for 1 s
+        stats = {F: (1, 1, 1.0, 4.0, {}),
+                 H: (1, 1, 1.0, 2.0, {}),
+                 G: (2, 2, 4.0, 4.0, {F: (1, 1, 3.0, 3.0),
+                                      H: (1, 1, 1.0, 1.0)})}
+        self.assertEqual(folded(stats),
+                         {"f.py:1(f)": 1000000,
+                          "h.py:1(h)": 1000000,
+                          "f.py:1(f);g.py:1(g)": 3000000,
+                          "h.py:1(h);g.py:1(g)": 1000000})
+
+    def test_top_level_call(self):
+        # g is called once from h and once from the top level
+        stats = {H: (1, 1, 1.0, 2.0, {}),
+                 G: (2, 2, 2.0, 2.0, {H: (1, 1, 1.0, 1.0)})}
+        self.assertEqual(folded(stats),
+                         {"h.py:1(h)": 1000000,
+                          "g.py:1(g)": 1000000,
+                          "h.py:1(h);g.py:1(g)": 1000000})
+
+    def test_call_counts(self):
+        # No time measured in the calls: split by number of calls
+        stats = {H: (1, 1, 1.0, 1.0, {}),
+                 G: (4, 4, 2.0, 0.0, {H: (1, 1, 0.0, 0.0)})}
+        self.assertEqual(folded(stats),
+                         {"h.py:1(h)": 1000000,
+                          "g.py:1(g)": 1500000,
+                          "h.py:1(h);g.py:1(g)": 500000})
+
+    def test_recursion(self):
+        stats = {F: (1, 1, 1.0, 3.0, {}),
+                 G: (1, 3, 2.0, 2.0, {F: (1, 1, 2.0, 2.0),
+                                      G: (2, 0, 1.0, 1.0)})}
+        self.assertEqual(folded(stats),
+                         {"f.py:1(f)": 1000000,
+                          "f.py:1(f);g.py:1(g)": 2000000})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/snapshot.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ansible_dynamic_inventories.utils import snapshot as sn
+
+INVENTORY = {
+    "web": {"hosts": ["web-1", "web-2"],
+            "vars": {"port": 80, "ratio": 0.5, "tls": True, "proxy": None,
+                     "names": ["a", "b"], "mixed": [1, "x", {"k": "v"}]},
+            "children": ["front"]},
+    "front": {"hosts": ["web-1"]},
+    "_meta": {"hostvars": {"web-1": {"ansible_host": "10.0.0.1",
+                                     "user": u"\xe9ric"},
+                           "web-2": {"ansible_host": "10.0.0.2",
+                                     "disks": {"size": 10, "type": "ssd"}}}}
+}
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "inventory.snap")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_inventory_round_trip(self):
+        sn.save_inventory(INVENTORY, self.path)
+        self.assertEqual(sn.load_inventory(self.path), INVENTORY)
+
+    def test_compressed_round_trip(self):
+        sn.save_inventory(INVENTORY, self.path, compress=True)
+        with sn.Snapshot(self.path) as snapshot:
+            self.assertTrue(snapshot.compressed)
+        self.assertEqual(sn.load_inventory(self.path), INVENTORY)
+
+    def test_empty_inventory(self):
+        sn.save_inventory({}, self.path)
+        self.assertEqual(sn.load_inventory(self.path),
+                         {"_meta": {"hostvars": {}}})
+        self.assertIsNone(sn.load_hostvars(self.path, "web-1"))
+
+    def test_load_hostvars(self):
+        sn.save_inventory(INVENTORY, self.path)
+        for host, variables in INVENTORY["_meta"]["hostvars"].items():
+            self.assertEqual(sn.load_hostvars(self.path, host), variables)
+        self.assertIsNone(sn.load_hostvars(self.path, "web-3"))
+
+    def test_keys_are_sorted(self):
+        writer = sn.SnapshotWriter()
+        writer.add_table("t", {"b": "1", "c": "2", "a": "3"})
+        writer.save(self.path)
+        with sn.Snapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.keys("t"), ["a", "b", "c"])
+            self.assertEqual(snapshot.get("t", "c"), "2")
+            self.assertEqual(snapshot.get("t", "d", "none"), "none")
+            self.assertRaises(KeyError, snapshot.load, "unknown")
+
+    def test_platform_state_round_trip(self):
+        servers = [{"id": "s1", "name": "web-1", "status": "ACTIVE",
+                    "key_name": None, "networks": {"net": ["10.0.0.1"]},
+                    "metadata": {"groups": "web"}}]
+        volumes = [{"id": "v1", "name": "web-1-disk", "size": 10,
+                    "volume_type": None, "metadata": {},
+                    "attachments": [{"server_id": "s1",
+                                     "device": "/dev/vdb"}]}]
+        networks = [{"id": "n1", "label": "net"}]
+        sn.save_platform_state(self.path, servers, volumes, networks,
+                               info={"date": "2016-01-01"})
+        state = sn.load_platform_state(self.path)
+        self.assertEqual(state["servers"], servers)
+        self.assertEqual(state["volumes"], volumes)
+        self.assertEqual(state["networks"], networks)
+        self.assertEqual(state["info"], {"date": "2016-01-01"})
+
+    def test_save_replaces_file(self):
+        sn.save_inventory(INVENTORY, self.path)
+        sn.save_inventory({}, self.path)
+        self.assertEqual(sn.load_inventory(self.path),
+                         {"_meta": {"hostvars": {}}})
+        # No temporary file is left behind
+        self.assertEqual(os.listdir(self.tmp_dir), ["inventory.snap"])
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "w") as f:
+            f.write('{"web": {}}')
+        self.assertRaises(sn.SnapshotError, sn.load_inventory, self.path)
+        with open(self.path, "w") as f:
+            f.write("")
+        self.assertRaises(sn.SnapshotError, sn.load_inventory, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
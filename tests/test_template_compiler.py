@@ -0,0 +1,139 @@
+# Copyright Khanh-Toan TRAN <khtoantran@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Unit tests of utils/template_compiler.py
+#
+
+import json
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+
+from ansible_dynamic_inventories.utils import template_compiler as tc
+
+TEMPLATE = {"web": {"children": ["front", "back"], "vars": {"port": 80}},
+            "front": {"children": ["edge"]},
+            "back": {},
+            "edge": {"hosts": []},
+            "db": {"vars": {"port": 5432}}}
+
+
+class CompileTemplateTest(unittest.TestCase):
+
+    def test_ancestors(self):
+        compiled = tc.compile_template(TEMPLATE)
+        self.assertEqual(compiled["groups"], TEMPLATE)
+        ancestors = compiled["ancestors"]
+        self.assertEqual(ancestors["edge"], ["all", "front", "web"])
+        self.assertEqual(ancestors["back"], ["all", "web"])
+        self.assertEqual(ancestors["db"], ["all"])
+        self.assertEqual(ancestors["all"], [])
+
+    def test_empty(self):
+        self.assertEqual(tc.validate_template({}), [])
+        self.assertEqual(tc.compile_template({}),
+                         {"groups": {}, "ancestors": {"all": []}})
+
+    def test_undeclared_child(self):
+        ancestors = tc.compile_template({"web": {"children": ["front"]}})[
+            "ancestors"]
+        self.assertEqual(ancestors["front"], ["all", "web"])
+
+    def test_warnings(self):
+        self.assertEqual(tc.validate_template(TEMPLATE), [])
+        self.assertEqual(tc.validate_template({"_meta": {"hostvars": {}}}),
+                         [])
+        warnings = tc.validate_template({"web": {"hosts": "web-1",
+                                                 "vars": [], "port": 80},
+                                         "db": ["db-1"]})
+        self.assertEqual(warnings,
+                         ["Group db is not a JSON object",
+                          "Group web: unknown keys port",
+                          "Group web: hosts is not a list",
+                          "Group web: vars is not a JSON object"])
+
+    def test_errors(self):
+        self.assertRaises(tc.TemplateError, tc.compile_template, ["web"])
+        cycle = {"a": {"children": ["b"]}, "b": {"children": ["c"]},
+                 "c": {"children": ["a"]}}
+        self.assertRaises(tc.TemplateError, tc.compile_template, cycle)
+
+
+class CompiledCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.template_file = os.path.join(self.tmp_dir, "template.json")
+        self.cache_file = os.path.join(self.tmp_dir, "cache", "template.snap")
+        self.write_template(TEMPLATE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_template(self, template):
+        with open(self.template_file, "w") as f:
+            json.dump(template, f)
+
+    def load(self):
+        return tc.load_compiled_template(self.template_file, self.cache_file)
+
+    def test_round_trip(self):
+        compiled = self.load()
+        self.assertTrue(os.path.exists(self.cache_file))
+        self.assertEqual(self.load(), compiled)
+        self.assertEqual(compiled, tc.compile_template(TEMPLATE))
+        # Every load returns new objects
+        inventory = tc.inventory_from_compiled(self.load())
+        inventory["web"]["vars"]["port"] = 8080
+        self.assertEqual(self.load()["groups"]["web"]["vars"]["port"], 80)
+
+    def test_modified_template(self):
+        self.load()
+        template = dict(TEMPLATE)
+        template["cache"] = {"vars": {"port": 6379}, "children": ["redis"]}
+        self.write_template(template)
+        compiled = self.load()
+        self.assertEqual(compiled["groups"], template)
+        self.assertEqual(compiled["ancestors"]["redis"], ["all", "cache"])
+
+    def test_corrupted_cache(self):
+        os.makedirs(os.path.dirname(self.cache_file))
+        with open(self.cache_file, "w") as f:
+            f.write("{}")
+        self.assertEqual(self.load(), tc.compile_template(TEMPLATE))
+        self.assertEqual(self.load(), tc.compile_template(TEMPLATE))
+
+    def test_touched_template(self):
+        compiled = self.load()
+        stat = os.stat(self.template_file)
+        os.utime(self.template_file, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(self.load(), compiled)
+
+    def test_other_version(self):
+        os.makedirs(os.path.dirname(self.cache_file))
+        with open(self.cache_file, "wb") as f:
+            f.write(marshal.dumps(((0, 0, (0, 0)), 0.0, 0, "", {})))
+        self.assertEqual(self.load(), tc.compile_template(TEMPLATE))
+
+    def test_invalid_json(self):
+        with open(self.template_file, "w") as f:
+            f.write('{"web": ')
+        self.assertRaises(tc.TemplateError, self.load)
+
+
+if __name__ == "__main__":
+    unittest.main()